@@ -0,0 +1,312 @@
+import os
+import time
+import uuid
+import signal
+import hashlib
+import asyncio
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from chunker import chunk_path
+from pipeline import build_result, save_result
+from progress_store import get_store
+from http_pool import backoff_delay, RETRY_STATUSES
+from indexing_poller import next_interval, DONE_STATUSES
+from dedup import source_info, reuse_existing, reuse_chunk, remember
+from uploader_API import plan_video_chunks
+from batch_ingest import resolve_inputs
+from metrics import span, record_upload
+from upload_body import multipart_envelope
+from temp_space import TempScope, InsufficientSpace, get_temp_space, projected_need, projected_total
+from config import (
+    API_KEY, INDEX_ID, API_BASE, HTTP_MAX_RETRIES, PIPELINE_DEPTH, UPLOAD_WORKERS,
+    INDEXING_SPEED_RATIO, ASYNC_FILE_CONCURRENCY, ASYNC_UPLOAD_CONCURRENCY, ASYNC_POLL_CONCURRENCY,
+    ASYNC_READ_SIZE, TEMP_ADMIT_POLL, INGEST_HASH
+)
+
+# Event-loop ingest for the API uploader: every file, chunk upload and
+# indexing status check is a coroutine on one loop, so hundreds of files can
+# be in flight without a thread each. Semaphores bound how many files are
+# being cut, how many uploads and how many status checks run at once.
+# Planning reuses the cached probe and keyframe planner; ffmpeg runs as an
+# asyncio subprocess.
+
+progress_store = get_store()
+
+
+async def multipart_body(path: str, head: bytes, tail: bytes, hasher=None) -> AsyncIterator[bytes]:
+    """Stream a multipart/form-data body from the file handle without loading the file; hasher is fed the file's bytes"""
+    yield head
+    with open(path, "rb") as f:
+        while True:
+            block = await asyncio.to_thread(f.read, ASYNC_READ_SIZE)
+            if not block:
+                break
+            if hasher:
+                hasher.update(block)
+            yield block
+    yield tail
+
+
+class AsyncIngest:
+    """One batch of files ingested on the running event loop"""
+
+    def __init__(self, client, file_limit: int = ASYNC_FILE_CONCURRENCY,
+                 upload_limit: int = ASYNC_UPLOAD_CONCURRENCY, poll_limit: int = ASYNC_POLL_CONCURRENCY):
+        self.client = client
+        self.files = asyncio.Semaphore(file_limit)
+        self.uploads = asyncio.Semaphore(upload_limit)
+        self.polls = asyncio.Semaphore(poll_limit)
+
+    async def request(self, method: str, url: str, semaphore: asyncio.Semaphore, body_factory=None, **kwargs):
+        """Send with the same backoff policy as http_pool; body_factory rebuilds a streamed body per attempt"""
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            if body_factory:
+                kwargs["content"] = body_factory()
+            try:
+                async with semaphore:
+                    res = await self.client.request(method, url, **kwargs)
+            except Exception as e:
+                if attempt == HTTP_MAX_RETRIES or not _is_transient(e):
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"⚠️  Request to {url} failed: {e}. Retrying in {delay:.1f}s...")
+            else:
+                if res.status_code not in RETRY_STATUSES or attempt == HTTP_MAX_RETRIES:
+                    return res
+                delay = backoff_delay(attempt, res.headers.get('Retry-After'))
+                print(f"⚠️  {res.status_code} from {url}. Retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+    async def upload(self, path: str) -> Tuple[str, str]:
+        """Create an indexing task from a file, streaming it from disk; returns its ID and the digest of the bytes sent"""
+        boundary = uuid.uuid4().hex
+        head, tail = multipart_envelope(os.path.basename(path), {"index_id": INDEX_ID, "language": "en"}, boundary)
+        headers = {
+            "x-api-key": API_KEY,
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            "Content-Length": str(len(head) + os.path.getsize(path) + len(tail)),
+        }
+        hashers = []
+
+        def body():
+            # A fresh hash per attempt; the last one saw the body that was accepted
+            hashers.append(hashlib.new(INGEST_HASH))
+            return multipart_body(path, head, tail, hashers[-1])
+
+        started = time.perf_counter()
+        with span("upload"):
+            res = await self.request("POST", f"{API_BASE}/tasks", self.uploads, body_factory=body, headers=headers)
+        record_upload(os.path.getsize(path), time.perf_counter() - started)
+        if res.status_code not in [200, 201]:
+            raise Exception(f"Upload failed: {res.status_code} - {res.text}")
+        data = res.json()
+        return data.get("_id") or data.get("id"), hashers[-1].hexdigest()
+
+    async def wait_indexed(self, task_id: str, duration: Optional[float]) -> str:
+        """Poll one task on the loop with the same adaptive intervals as the shared poller"""
+        with span("indexing_wait"):
+            return await self._poll_until_done(task_id, duration)
+
+    async def _poll_until_done(self, task_id: str, duration: Optional[float]) -> str:
+        started = time.monotonic()
+        expected = duration * INDEXING_SPEED_RATIO if duration else None
+        while True:
+            await asyncio.sleep(next_interval(time.monotonic() - started, expected))
+            res = await self.request("GET", f"{API_BASE}/tasks/{task_id}", self.polls, headers={"x-api-key": API_KEY})
+            if res.status_code == 404:
+                return "failed"
+            if res.status_code == 200:
+                status = res.json().get("status")
+                if status in DONE_STATUSES:
+                    return status
+
+    async def cut(self, source: str, start: float, length: float, out_path: str):
+        with span("cut"):
+            await self._run_ffmpeg(source, start, length, out_path)
+
+    async def _run_ffmpeg(self, source: str, start: float, length: float, out_path: str):
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-y", "-ss", str(start), "-i", source, "-t", str(length),
+            "-c", "copy", "-avoid_negative_ts", "make_zero", "-movflags", "faststart", out_path,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        try:
+            if await proc.wait() != 0:
+                raise Exception(f"ffmpeg failed cutting {out_path}")
+        except asyncio.CancelledError:
+            # Reap the process before deleting its output, so it can't write the file again afterwards
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            if os.path.exists(out_path):
+                os.remove(out_path)
+            raise
+
+    async def admit(self, filename: str, path: str) -> TempScope:
+        """Open the file's temp scope once there is disk space for its chunks, checking again while other files hold it"""
+        size = os.path.getsize(path)
+        while True:
+            try:
+                return get_temp_space().scope(filename, projected_need(size), total=projected_total(size))
+            except InsufficientSpace as e:
+                if not e.retryable:
+                    raise
+                progress_store.set(filename, 5, "Waiting for temp disk space...")
+                await asyncio.sleep(TEMP_ADMIT_POLL)
+
+    async def process(self, path: str) -> Dict:
+        """Cut and upload one file while holding a file slot, then wait for its indexing without one"""
+        filename = os.path.basename(path)
+        async with self.files:
+            progress_store.set(filename, 0, "Starting...")
+            source = await asyncio.to_thread(source_info, path)
+            existing = await asyncio.to_thread(reuse_existing, filename, path, source)
+            if existing:
+                await asyncio.to_thread(save_result, existing, source["hash"])
+                progress_store.set(filename, 100, existing["status"])
+                return existing
+            records, indexing = await self.send(path, filename, source)
+
+        # The slot is free for the next file to cut and upload while this one is indexed
+        records.sort(key=lambda r: r["start"])
+        pending = [r for r in records if r["result"] and indexing.get(r["result"]) is None]
+        statuses = await asyncio.gather(*(self.wait_indexed(r["result"], r["duration"]) for r in pending))
+        indexing.update({r["result"]: s for r, s in zip(pending, statuses)})
+
+        ready = [vid for vid, s in indexing.items() if s in ["ready", "completed"]]
+        status = ("Upload & Indexing successful" if len(ready) == len(records)
+                  else f"Partial success: {len(ready)}/{len(records)} chunks indexed")
+        await asyncio.to_thread(remember, source, filename, records, indexing)
+        result = build_result(filename, records, status, indexing)
+        await asyncio.to_thread(save_result, result, source["hash"])
+        progress_store.set(filename, 100, status)
+        return result
+
+    async def send(self, path: str, filename: str, source: Dict) -> Tuple[List[Dict], Dict[str, Optional[str]]]:
+        """Cut and upload one file's chunks, each uploaded while later ones are cut; returns the chunk records
+        and what is known of their indexing (None for tasks still to be polled)"""
+        progress_store.set(filename, 5, "Analyzing video...")
+        with span("plan"):
+            total_duration, cut_points = await asyncio.to_thread(plan_video_chunks, path)
+        scope = None if cut_points is None else await self.admit(filename, path)
+        temp_dir = scope.make_dir() if scope else None
+        cut_points = cut_points or [(0.0, total_duration)]
+        total = len(cut_points)
+        progress_store.set(filename, 20, f"Uploading {total} {'chunks' if temp_dir else 'file'}...")
+
+        queue = asyncio.Queue(maxsize=max(1, PIPELINE_DEPTH))
+        # As in pipeline.chunk_slots: a cut only starts once a queue place or an uploader will be free for it
+        slots = asyncio.Semaphore(max(1, PIPELINE_DEPTH) + max(1, UPLOAD_WORKERS))
+        records = []
+        indexing = {}
+        uploaded = 0
+
+        async def produce():
+            for i, (start, length) in enumerate(cut_points):
+                chunk = {"index": i + 1, "position": i, "start": start, "duration": length, "temp": bool(temp_dir)}
+                if temp_dir:
+                    chunk["path"] = chunk_path(temp_dir, Path(path).stem, i + 1)
+                    await slots.acquire()
+                    await self.cut(path, start, length, chunk["path"])
+                else:
+                    chunk["path"] = path
+                chunk["size"] = os.path.getsize(chunk["path"])
+                await queue.put(chunk)
+
+        async def consume():
+            nonlocal uploaded
+            while True:
+                chunk = await queue.get()
+                result, error, reused = None, None, None
+                try:
+                    reused = await asyncio.to_thread(reuse_chunk, chunk, source)
+                    if reused:
+                        result = reused
+                    else:
+                        result, chunk["hash"] = await self.upload(chunk["path"])
+                    print(f"✅ {filename} chunk {chunk['index']}/{total} {'reused' if reused else 'accepted'}: {result}")
+                except Exception as e:
+                    error = e
+                    print(f"❌ {filename} chunk {chunk['index']}/{total} failed: {e}")
+                finally:
+                    if chunk["temp"] and os.path.exists(chunk["path"]):
+                        with span("cleanup"):
+                            scope.remove(chunk["path"])
+                    if chunk["temp"]:
+                        slots.release()
+                    queue.task_done()
+                records.append({**chunk, "result": result, "error": error})
+                if result:
+                    uploaded += 1
+                    # Stays below 100 until indexing has finished and the final status is set
+                    progress_store.advance(filename, 20 + int(79 * uploaded / total),
+                                           f"Uploaded {uploaded}/{total}, waiting for indexing...")
+                    # Reused chunks are already indexed; new ones are polled once all are sent
+                    indexing[result] = "ready" if reused else None
+
+        consumers = [asyncio.create_task(consume()) for _ in range(max(1, UPLOAD_WORKERS))]
+        try:
+            await produce()
+            await queue.join()
+        finally:
+            for c in consumers:
+                c.cancel()
+            await asyncio.gather(*consumers, return_exceptions=True)
+            # Chunks cut but never picked up (the file was cancelled or the cutter failed)
+            while not queue.empty():
+                chunk = queue.get_nowait()
+                if chunk["temp"] and os.path.exists(chunk["path"]):
+                    os.remove(chunk["path"])
+            if scope:
+                scope.close()
+
+        return records, indexing
+
+
+def _is_transient(error: Exception) -> bool:
+    import httpx
+    return isinstance(error, (httpx.TransportError,))
+
+
+async def ingest_batch(paths: List[str]) -> List[Dict]:
+    """Ingest many files concurrently on one event loop; Ctrl-C cancels cleanly"""
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit("Batch mode needs httpx: pip install httpx")
+
+    limits = httpx.Limits(max_connections=ASYNC_UPLOAD_CONCURRENCY + ASYNC_POLL_CONCURRENCY)
+    timeout = httpx.Timeout(60.0, write=None)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        ingest = AsyncIngest(client)
+        tasks = [asyncio.create_task(ingest.process(p)) for p in paths]
+
+        # Cancel everything still running on SIGINT/SIGTERM; chunk temp files are cleaned up as tasks unwind
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, lambda: [t.cancel() for t in tasks])
+            except (NotImplementedError, RuntimeError):
+                pass  # Not supported on this platform or thread
+
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = []
+    for path, outcome in zip(paths, outcomes):
+        if isinstance(outcome, asyncio.CancelledError):
+            print(f"⏹️  Cancelled: {path}")
+        elif isinstance(outcome, BaseException):
+            print(f"❌ {path}: {outcome}")
+        else:
+            results.append(outcome)
+    return results
+
+
+def run_batch(source: str) -> List[Dict]:
+    """Ingest a directory, glob or manifest of videos"""
+    paths = resolve_inputs([source])
+    print(f"📂 {len(paths)} videos found in {source}")
+    started = time.monotonic()
+    results = asyncio.run(ingest_batch(paths))
+    ok = sum(1 for r in results if r["success"])
+    print(f"\n🎉 Batch done in {time.monotonic() - started:.0f}s: {ok}/{len(paths)} files fully indexed")
+    return results
@@ -0,0 +1,247 @@
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+from temp_space import get_temp_space, projected_need, projected_total
+from config import BATCH_DB, BATCH_WORKERS, BATCH_MAX_ATTEMPTS, VIRTUAL_CHUNKS, RESUMABLE_UPLOADS
+
+# Batch ingest with a durable work queue. Every file gets a row in a SQLite
+# checkpoint database, and each state change (pending -> running ->
+# uploaded -> done or failed) is committed before work moves on. A worker
+# is done with a file once its uploads are accepted: it checkpoints the file
+# as 'uploaded' (with what is needed to finish it) and moves on, while the
+# shared indexing poller completes the file when its tasks are indexed. A
+# run that dies leaves its in-flight rows as 'running'; the next run puts
+# them back in the queue (and with RESUMABLE_UPLOADS their parts resume from
+# the upload journal), picks 'uploaded' rows up where indexing left off, and
+# skips 'done' rows. Files are scheduled largest first so the long ones
+# don't end up as the tail of the run.
+
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.mkv', '.avi', '.webm', '.m4v', '.mpg', '.mpeg', '.ts', '.mts'}
+MANIFEST_EXTENSIONS = {'.txt', '.list', '.lst', '.csv', '.manifest'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    video_ids TEXT,
+    error TEXT,
+    started_at REAL,
+    finished_at REAL,
+    upload TEXT
+)
+"""
+
+
+def is_video(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def resolve_inputs(sources: List[str]) -> List[str]:
+    """Expand directories (recursively), glob patterns and manifest files into video paths
+
+    A manifest lists one path per line; a .csv manifest has the path in its
+    first column (quoted if it contains commas).
+    """
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                paths += [os.path.join(root, name) for name in files if is_video(name)]
+        elif any(c in source for c in "*?["):
+            paths += [p for p in glob.glob(source, recursive=True) if os.path.isfile(p) and is_video(p)]
+        elif os.path.splitext(source)[1].lower() in MANIFEST_EXTENSIONS:
+            base = os.path.dirname(os.path.abspath(source))
+            with open(source, 'r', newline='') as f:
+                rows = csv.reader(f) if source.lower().endswith('.csv') else ([line.rstrip('\r\n')] for line in f)
+                for row in rows:
+                    entry = row[0].strip() if row else ""
+                    if entry and not entry.startswith("#"):
+                        paths.append(entry if os.path.isabs(entry) else os.path.join(base, entry))
+        else:
+            paths.append(source)
+    return sorted({os.path.abspath(p) for p in paths})
+
+
+class Checkpoints:
+    """SQLite checkpoint store; one short transaction per state change"""
+
+    def __init__(self, path: str = BATCH_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        if "upload" not in [row[1] for row in self._conn.execute("PRAGMA table_info(files)")]:
+            self._conn.execute("ALTER TABLE files ADD COLUMN upload TEXT")  # Databases from before the 'uploaded' state
+        self._lock = threading.Lock()
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def sync(self, paths: List[str]) -> int:
+        """Add new files and re-queue changed or interrupted ones; returns how many are queued"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError as e:
+                    print(f"⚠️  Skipping {path}: {e}")
+                    continue
+                row = self._conn.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (path,)).fetchone()
+                if row is None:
+                    self._conn.execute("INSERT INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+                                       (path, st.st_size, st.st_mtime_ns))
+                elif tuple(row) != (st.st_size, st.st_mtime_ns):
+                    # The file changed since it was ingested: start it over
+                    self._conn.execute("UPDATE files SET size = ?, mtime_ns = ?, status = 'pending', attempts = 0, "
+                                       "video_ids = NULL, error = NULL, upload = NULL WHERE path = ?",
+                                       (st.st_size, st.st_mtime_ns, path))
+            # Rows left 'running' belong to a run that died
+            self._conn.execute("UPDATE files SET status = 'pending' WHERE status = 'running'")
+            self._conn.execute("UPDATE files SET status = 'pending' WHERE status = 'failed' AND attempts < ?",
+                               (BATCH_MAX_ATTEMPTS,))
+            self._conn.execute("COMMIT")
+        return len(self.queue(paths))
+
+    def queue(self, paths: List[str]) -> List[Dict]:
+        """Pending files among paths, largest first"""
+        wanted = set(paths)
+        rows = self._execute("SELECT path, size FROM files WHERE status = 'pending' ORDER BY size DESC")
+        return [{"path": p, "size": s} for p, s in rows if p in wanted]
+
+    def start(self, path: str):
+        self._execute("UPDATE files SET status = 'running', attempts = attempts + 1, started_at = ? WHERE path = ?",
+                      (time.time(), path))
+
+    def uploaded(self, path: str, upload: Dict):
+        """All of the file's uploads were accepted; upload (a pipeline.accepted_upload) is what finishing it needs"""
+        self._execute("UPDATE files SET status = 'uploaded', upload = ? WHERE path = ?", (json.dumps(upload), path))
+
+    def indexing(self, paths: List[str]) -> List[Dict]:
+        """Files among paths that were uploaded but not yet finished, with their uploads"""
+        wanted = set(paths)
+        rows = self._execute("SELECT path, upload FROM files WHERE status = 'uploaded'")
+        return [{"path": p, "upload": json.loads(u)} for p, u in rows if p in wanted]
+
+    def finish(self, path: str, video_ids: List[str], error: Optional[str] = None):
+        self._execute("UPDATE files SET status = ?, video_ids = ?, error = ?, finished_at = ?, upload = NULL WHERE path = ?",
+                      ("failed" if error else "done", json.dumps(video_ids), error, time.time(), path))
+
+    def done(self, paths: List[str]) -> int:
+        """How many of paths have finished successfully"""
+        wanted = set(paths)
+        return sum(1 for (p,) in self._execute("SELECT path FROM files WHERE status = 'done'") if p in wanted)
+
+    def summary(self) -> Dict[str, int]:
+        return dict(self._execute("SELECT status, COUNT(*) FROM files GROUP BY status"))
+
+
+def run(sources: List[str], method: str = 'api', workers: int = BATCH_WORKERS, db_path: str = BATCH_DB) -> Dict[str, int]:
+    """Ingest every file in sources that hasn't finished yet, checkpointing each one"""
+    import uploader_sdk
+    import uploader_API
+    from pipeline import track_upload, complete_upload
+    from indexing_poller import get_poller
+    uploader = uploader_sdk if method == 'sdk' else uploader_API
+    virtual = method == 'api' and VIRTUAL_CHUNKS and not RESUMABLE_UPLOADS
+
+    paths = resolve_inputs(sources)
+    checkpoints = Checkpoints(db_path)
+    checkpoints.sync(paths)
+    todo = checkpoints.queue(paths)
+    indexing = checkpoints.indexing(paths)
+    print(f"📂 {len(paths)} files, {checkpoints.done(paths)} already done, {len(indexing)} waiting for indexing, "
+          f"{len(todo)} to ingest ({sum(t['size'] for t in todo) / 1024 ** 3:.1f} GB, largest first)")
+
+    total = len(todo) + len(indexing)
+    finished = []
+    finished_lock = threading.Condition()
+
+    def report(path: str, outcome: str):
+        with finished_lock:
+            finished.append(path)
+            print(f"📋 [{len(finished)}/{total}] {os.path.basename(path)}: {outcome}")
+            finished_lock.notify_all()
+
+    def follow(path: str, upload: Dict):
+        """Have the shared poller finish the file once its tasks are indexed"""
+        def on_indexed(statuses):
+            try:
+                result = complete_upload(upload, statuses)
+            except Exception as e:
+                checkpoints.finish(path, [], str(e))
+                report(path, f"❌ {e}")
+                return
+            checkpoints.finish(path, result["video_ids"], None if result["success"] else result["status"])
+            report(path, result["status"])
+
+        track_upload(upload)
+        get_poller().when_done([c["result"] for c in upload["chunks"] if c["result"]], on_indexed)
+
+    def ingest(item):
+        path = item["path"]
+        # Waits while files already running hold the temp space this one needs
+        temp = get_temp_space().scope(os.path.basename(path), projected_need(item["size"], virtual=virtual), wait=True,
+                                      total=projected_total(item["size"], virtual=virtual))
+        checkpoints.start(path)
+        try:
+            upload = uploader.upload_video(path, temp=temp)
+        except Exception as e:
+            checkpoints.finish(path, [], str(e))
+            raise
+        finally:
+            temp.close()
+        if "result" in upload:
+            # Already indexed under another name
+            result = upload["result"]
+            checkpoints.finish(path, result["video_ids"], None if result["success"] else result["status"])
+            report(path, result["status"])
+            return
+        checkpoints.uploaded(path, upload)
+        follow(path, upload)
+
+    started = time.monotonic()
+    for item in indexing:
+        follow(item["path"], item["upload"])
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(ingest, item): item["path"] for item in todo}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                report(futures[future], f"❌ {e}")
+
+    # Uploads are all sent; the poller finishes the files still being indexed
+    with finished_lock:
+        finished_lock.wait_for(lambda: len(finished) >= total)
+
+    summary = checkpoints.summary()
+    print(f"\n🎉 Batch finished in {time.monotonic() - started:.0f}s: {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest many videos with crash-safe checkpoints")
+    parser.add_argument("sources", nargs="+", help="Directories, glob patterns or manifest files (one path per line)")
+    parser.add_argument("--method", choices=["api", "sdk"], default="api")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Files processed at once")
+    parser.add_argument("--db", default=BATCH_DB, help="Checkpoint database")
+    args = parser.parse_args()
+    summary = run(args.sources, args.method, args.workers, args.db)
+    sys.exit(1 if summary.get("failed") else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""End-to-end ingest benchmark against a local API stand-in (benchmarks/mock_api.py).
+
+Synthetic test videos are generated with ffmpeg (CBR and VBR at several
+durations) unless --videos points at existing files. Each mode then runs in
+a fresh Python process, so its peak RSS is its own. The uploaders are
+pointed at the mock and the videos are ingested:
+
+  api     uploader_API.process_video per file (what uploader_API.main runs)
+  sdk     uploader_sdk.process_video per file, with the SDK pointed at the mock
+  server  the Flask app on a local port: POST /upload, long-poll /progress
+          until the file is done, then POST /search
+
+Each run reports:
+  - files/hour and MB/s
+  - p50/p99 latency per file
+  - p50/p99 latency per stage: from metrics.py, plus HTTP round trips in server mode
+  - peak RSS of the run's process and of its largest ffmpeg child
+  - peak extra disk use on the temp filesystem
+
+--json saves the results. --baseline compares them with a saved run and
+fails if anything is worse by more than --tolerance.
+
+    python benchmarks/bench_e2e.py [--modes api,sdk,server] [--durations 30,120,600] [--kinds cbr,vbr]
+                                   [--videos DIR] [--concurrency 2] [--json out.json] [--baseline old.json]
+                                   [--latency 0.05] [--bandwidth 0] [--error-rate 0] [--indexing-delay 1]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+os.environ.setdefault("TL_API_KEY", "bench")
+os.environ.setdefault("TL_INDEX_ID", "bench")
+
+from mock_api import start_mock, add_mock_arguments, mock_options, PREFIX  # noqa: E402
+from batch_ingest import resolve_inputs  # noqa: E402
+
+MB = 1024 * 1024
+RESULT_MARKER = "BENCH_RESULT "
+MODES = ("api", "sdk", "server")
+
+# Higher is better for these; lower is better for everything else that is compared
+HIGHER_IS_BETTER = {"files_per_hour", "mb_per_s"}
+
+
+def make_videos(out_dir: str, durations, kinds):
+    """Generate 720p test videos once per (kind, duration); CBR is a test pattern, VBR a zooming fractal"""
+    if not shutil.which("ffmpeg"):
+        sys.exit("ffmpeg is needed to generate test videos (or pass --videos DIR)")
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for kind in kinds:
+        for duration in durations:
+            path = os.path.join(out_dir, f"{kind}_{duration}s.mp4")
+            paths.append(path)
+            if os.path.exists(path):
+                continue
+            if kind == "cbr":
+                video = ["-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=30"]
+                rate = ["-b:v", "4M", "-minrate", "4M", "-maxrate", "4M", "-bufsize", "4M", "-x264-params", "nal-hrd=cbr"]
+            else:
+                video = ["-f", "lavfi", "-i", "mandelbrot=size=1280x720:rate=30"]
+                rate = ["-crf", "23"]
+            print(f"🎬 Generating {path}...")
+            subprocess.run(["ffmpeg", "-y", *video, "-f", "lavfi", "-i", "sine=frequency=440", "-t", str(duration),
+                            "-c:v", "libx264", "-preset", "ultrafast", "-g", "60", "-pix_fmt", "yuv420p", *rate,
+                            "-c:a", "aac", "-shortest", path],
+                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return paths
+
+
+def percentile(values, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class DiskSampler:
+    """Track the peak of used space on a filesystem above where it started"""
+
+    def __init__(self, path: str, interval: float = 0.1):
+        self.path = path
+        self.interval = interval
+        self.baseline = shutil.disk_usage(path).used
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, shutil.disk_usage(self.path).used - self.baseline)
+
+    def stop(self) -> int:
+        self._stop.set()
+        self._thread.join()
+        return self.peak
+
+
+def run_mode(mode: str, paths, concurrency: int, poll_min: float) -> dict:
+    """Ingest paths in this process (already pointed at the mock) and measure it"""
+    import indexing_poller
+    import metrics
+    indexing_poller.INDEXING_POLL_MIN = poll_min  # The production floor (5s) would swamp the mock's timings
+
+    http_latencies = {"http_upload": [], "http_until_done": [], "http_search": []}
+    if mode == "server":
+        import requests
+        import server
+        from upload_body import MultipartFileBody
+        from werkzeug.serving import make_server
+        httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{httpd.server_port}"
+
+        def ingest(path):
+            filename = os.path.basename(path)
+            started = time.monotonic()
+            body = MultipartFileBody(path, {"method": "api"}, file_field="file")
+            res = requests.post(f"{base}/upload", data=body, headers={"Content-Type": body.content_type})
+            res.raise_for_status()
+            uploaded = time.monotonic()
+            version, state = -1, {}
+            if res.json().get("message") != "Already indexed":
+                while not server.is_finished(state):
+                    state = requests.get(f"{base}/progress/{filename}", params={"since": version}).json()
+                    version = state["version"]
+            done = time.monotonic()
+            res = requests.post(f"{base}/search", data={"query": "person walking", "selectedVideo": filename,
+                                                         "method": "api", "searchOptions": '["visual", "audio"]'})
+            res.raise_for_status()
+            http_latencies["http_upload"].append(uploaded - started)
+            http_latencies["http_until_done"].append(done - uploaded)
+            http_latencies["http_search"].append(time.monotonic() - done)
+            return not state or "successful" in state["status"]
+    else:
+        uploader = __import__("uploader_API" if mode == "api" else "uploader_sdk")
+
+        def ingest(path):
+            return uploader.process_video(path)["success"]
+
+    per_file = []
+
+    def timed(path):
+        started = time.monotonic()
+        try:
+            ok = ingest(path)
+        except Exception as e:
+            print(f"❌ {path}: {e}")
+            ok = False
+        per_file.append(time.monotonic() - started)
+        return ok
+
+    disk = DiskSampler(tempfile.gettempdir())
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        outcomes = list(executor.map(timed, paths))
+    elapsed = time.monotonic() - started
+    peak_disk = disk.stop()
+
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+    stages = {}
+    for stage, outcome in metrics.STAGE_SECONDS.labels():
+        if outcome == "ok":
+            series = metrics.STAGE_SECONDS
+            stages[stage] = {"p50": series.quantile(0.5, (stage, outcome)), "p99": series.quantile(0.99, (stage, outcome))}
+    for stage, values in http_latencies.items():
+        if values:
+            stages[stage] = {"p50": percentile(values, 0.5), "p99": percentile(values, 0.99), "exact": True}
+
+    return {
+        "mode": mode,
+        "files": len(paths),
+        "succeeded": sum(1 for ok in outcomes if ok),
+        "bytes": total_bytes,
+        "seconds": elapsed,
+        "files_per_hour": len(paths) / elapsed * 3600 if elapsed else 0.0,
+        "mb_per_s": total_bytes / MB / elapsed if elapsed else 0.0,
+        "file_p50": percentile(per_file, 0.5),
+        "file_p99": percentile(per_file, 0.99),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_child_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        "peak_disk_mb": peak_disk / MB,
+        "stages": stages,
+    }
+
+
+def run_child(mode: str, paths, args, base_url: str) -> dict:
+    """Run one mode in a fresh process and working directory, pointed at the mock"""
+    workdir = tempfile.mkdtemp(prefix=f"tl_bench_{mode}_")
+    env = dict(os.environ, TL_API_KEY="bench", TL_INDEX_ID="bench",
+               TL_API_BASE=f"{base_url}{PREFIX}", TWELVELABS_BASE_URL=base_url)
+    cmd = [sys.executable, os.path.abspath(__file__), "--run", mode, "--concurrency", str(args.concurrency),
+           "--poll-min", str(args.poll_min), *paths]
+    try:
+        proc = subprocess.run(cmd, cwd=workdir, env=env, capture_output=True, text=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.verbose:
+        print(proc.stdout)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    sys.exit(f"❌ {mode} run failed:\n{proc.stdout[-2000:]}\n{proc.stderr[-2000:]}")
+
+
+def _seconds(value) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def print_report(result: dict):
+    print(f"\n== {result['mode']}: {result['succeeded']}/{result['files']} files, "
+          f"{result['bytes'] / MB:.0f} MB in {result['seconds']:.1f}s ==")
+    print(f"  files/hour   {result['files_per_hour']:.1f}")
+    print(f"  MB/s         {result['mb_per_s']:.1f}")
+    print(f"  per file     p50 {_seconds(result['file_p50'])}  p99 {_seconds(result['file_p99'])}")
+    print(f"  peak RSS     {result['peak_rss_mb']:.0f} MB (largest child {result['peak_child_rss_mb']:.0f} MB)")
+    print(f"  peak disk    {result['peak_disk_mb']:.0f} MB")
+    print("  stages       p50 / p99")
+    for stage, q in sorted(result["stages"].items()):
+        note = "" if q.get("exact") else "  (from histogram buckets)"
+        print(f"    {stage:<16} {_seconds(q['p50'])} / {_seconds(q['p99'])}{note}")
+
+
+def compare(results, baseline, tolerance: float) -> bool:
+    """Print changes against a saved run; returns False if any metric got worse by more than tolerance"""
+    ok = True
+    old_runs = {r["mode"]: r for r in baseline}
+    for result in results:
+        old = old_runs.get(result["mode"])
+        if not old:
+            continue
+        print(f"\n== {result['mode']} vs baseline ==")
+        keys = ["files_per_hour", "mb_per_s", "file_p50", "file_p99", "peak_rss_mb", "peak_disk_mb"]
+        for key in keys:
+            before, after = old.get(key), result.get(key)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if key in HIGHER_IS_BETTER else change
+            flag = "❌ regression" if worse > tolerance else ""
+            ok = ok and worse <= tolerance
+            print(f"  {key:<16} {before:10.2f} → {after:10.2f}  ({change:+.0%}) {flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", help=argparse.SUPPRESS)
+    parser.add_argument("--run", choices=MODES, help=argparse.SUPPRESS)  # Internal: one mode in this process
+    parser.add_argument("--modes", default="api,sdk,server")
+    parser.add_argument("--durations", default="30,120,600", help="Seconds per generated video")
+    parser.add_argument("--kinds", default="cbr,vbr")
+    parser.add_argument("--videos", help="Use the videos in this directory instead of generating them")
+    parser.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(), "tl_bench_videos"),
+                        help="Where generated videos are kept between runs")
+    parser.add_argument("--concurrency", type=int, default=2, help="Files ingested at once")
+    parser.add_argument("--poll-min", type=float, default=0.2, help="Indexing poll floor in seconds")
+    parser.add_argument("--json", help="Save results to this file")
+    parser.add_argument("--baseline", help="Compare with results saved by --json")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown before a regression is flagged")
+    parser.add_argument("--verbose", action="store_true", help="Show the uploaders' output")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    if args.run:
+        result = run_mode(args.run, args.paths, args.concurrency, args.poll_min)
+        print(RESULT_MARKER + json.dumps(result))
+        return
+
+    if args.videos:
+        paths = resolve_inputs([args.videos])
+    else:
+        durations = [int(d) for d in args.durations.split(",")]
+        paths = make_videos(args.cache_dir, durations, args.kinds.split(","))
+    paths = [os.path.abspath(p) for p in paths]
+
+    api, httpd, base_url = start_mock(**mock_options(args))
+    print(f"🧪 Mock API on {base_url}{PREFIX}: latency={args.latency}s bandwidth={args.bandwidth or 'unlimited'} "
+          f"errors={args.error_rate:.0%} indexing={args.indexing_delay}s+{args.indexing_per_mb}s/MB")
+    results = []
+    for mode in args.modes.split(","):
+        results.append(run_child(mode, paths, args, base_url))
+        print_report(results[-1])
+    httpd.shutdown()
+    print(f"\nMock API: {api.stats}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results saved to {args.json}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            if not compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
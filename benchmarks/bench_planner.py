@@ -0,0 +1,126 @@
+"""Compare average-bitrate chunk planning with the keyframe planner on synthetic VBR content.
+
+For each synthetic file (a keyframe index with bursty per-GOP sizes) both
+planners are run against the same limits. Cutting is simulated from the
+index: a chunk's size is the bytes between its first keyframe and its
+end. Chunks planned from the average bitrate that come out oversized are
+re-cut at 80% duration, as cut_streaming does, and every re-cut counts as
+an extra ffmpeg pass plus the bytes it wrote for nothing.
+
+    python benchmarks/bench_planner.py [--files 20] [--hours 3] [--limit-mb 2048] [--video PATH]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from bisect import bisect_right
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("TL_API_KEY", "bench")
+os.environ.setdefault("TL_INDEX_ID", "bench")
+
+from chunker import plan_cut_points, plan_keyframe_cuts  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def synthetic_index(hours: float, seed: int, gop: float = 2.0):
+    """Keyframe index of a VBR file: quiet scenes around 3 Mbps with action bursts up to 40 Mbps"""
+    rng = random.Random(seed)
+    duration = hours * 3600
+    keyframes, offset, t = [], 0, 0.0
+    rate = 3e6
+    while t < duration:
+        keyframes.append((t, offset))
+        if rng.random() < 0.02:
+            rate = rng.choice([2e6, 3e6, 5e6, 12e6, 25e6, 40e6])  # scene change
+        gop_bytes = int(rate * gop / 8 * rng.lognormvariate(0, 0.35))
+        offset += gop_bytes
+        t += gop
+    return keyframes, duration, offset
+
+
+def bytes_between(keyframes, total_duration, total_bytes, start, end):
+    """Packet bytes a stream-copy seek cut of [start, end) would contain"""
+    times = [t for t, _ in keyframes] + [total_duration]
+    offsets = [o for _, o in keyframes] + [total_bytes]
+
+    def at(x):
+        i = max(0, min(bisect_right(times, x) - 1, len(times) - 2))
+        span = times[i + 1] - times[i]
+        return offsets[i] + (offsets[i + 1] - offsets[i]) * min(1.0, (x - times[i]) / span if span else 0)
+
+    first_key = times[max(0, bisect_right(times, start) - 1)]  # -ss snaps back to a keyframe
+    return at(min(end, total_duration)) - at(first_key)
+
+
+def simulate_bitrate_plan(keyframes, duration, total_bytes, max_size, max_duration):
+    bitrate = total_bytes * 8 / duration
+    chunk_duration = min(max_duration, max_size * 8 / bitrate)
+    pending = plan_cut_points(duration, chunk_duration)
+    chunks = passes = wasted = 0
+    while pending:
+        start, length = pending.pop()
+        size = bytes_between(keyframes, duration, total_bytes, start, start + length)
+        passes += 1
+        if size > max_size:
+            wasted += size
+            pending += [(start + s, l) for s, l in plan_cut_points(length, length * 0.8)]
+        else:
+            chunks += 1
+    return chunks, passes, wasted
+
+
+def simulate_keyframe_plan(keyframes, duration, total_bytes, max_size, max_duration):
+    started = time.perf_counter()
+    cuts = plan_keyframe_cuts(keyframes, duration, total_bytes, max_size, max_duration)
+    elapsed = time.perf_counter() - started
+    oversized = sum(1 for s, l in cuts if bytes_between(keyframes, duration, total_bytes, s, s + l) > max_size)
+    return len(cuts), len(cuts), oversized, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--hours", type=float, default=3.0)
+    parser.add_argument("--limit-mb", type=float, default=2048)
+    parser.add_argument("--max-duration", type=float, default=7200)
+    parser.add_argument("--video", help="Use a real file's keyframe index instead of synthetic ones")
+    args = parser.parse_args()
+    max_size = args.limit_mb * MB
+
+    if args.video:
+        from probe import probe, keyframe_index
+        info = probe(args.video)
+        keyframes = [tuple(k) for k in keyframe_index(args.video)]
+        inputs = [(args.video, keyframes, info["duration"], os.path.getsize(args.video))]
+    else:
+        inputs = []
+        for seed in range(args.files):
+            keyframes, duration, total = synthetic_index(args.hours, seed)
+            inputs.append((f"synthetic-{seed:02d}", keyframes, duration, total))
+
+    extra_passes = wasted = keyframe_extra = keyframe_oversized = 0
+    plan_time = 0.0
+    print(f"{'file':<16} {'GB':>6} | {'avg-bitrate: chunks passes wasted GB':>36} | {'keyframe: chunks passes oversized':>33}")
+    for name, keyframes, duration, total in inputs:
+        b_chunks, b_passes, b_wasted = simulate_bitrate_plan(keyframes, duration, total, max_size, args.max_duration)
+        k_chunks, k_passes, k_over, elapsed = simulate_keyframe_plan(keyframes, duration, total, max_size, args.max_duration)
+        plan_time += elapsed
+        print(f"{name:<16} {total / 1024 / MB:>6.2f} | {b_chunks:>19} {b_passes:>6} {b_wasted / 1024 / MB:>9.2f} | "
+              f"{k_chunks:>16} {k_passes:>6} {k_over:>9}")
+        extra_passes += b_passes - b_chunks
+        wasted += b_wasted
+        keyframe_extra += k_passes - k_chunks
+        keyframe_oversized += k_over
+
+    print()
+    print(f"Average-bitrate planner: {extra_passes} extra ffmpeg passes, "
+          f"{wasted / 1024 / MB:.2f} GB written and thrown away")
+    print(f"Keyframe planner:        {keyframe_extra} extra passes, {keyframe_oversized} oversized chunks, "
+          f"{plan_time * 1000 / len(inputs):.2f} ms planning per file")
+
+
+if __name__ == "__main__":
+    main()
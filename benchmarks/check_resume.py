@@ -0,0 +1,131 @@
+"""Check that a multipart upload resumes from its journal after the process dies.
+
+Starts the API stand-in (benchmarks/mock_api.py) with small parts and a
+fraction of part uploads cut off mid-body, then:
+
+  1. a child process uploads a random file with RESUMABLE_UPLOADS' upload
+     path and kills itself once --kill-after parts are acknowledged;
+  2. a second child process uploads the same file again.
+
+Passes if the second run reused the first run's upload session, sent only
+the parts the first one hadn't, the assembled asset is byte-identical to the
+file and its journal was deleted afterwards. Exits non-zero otherwise.
+
+    python benchmarks/check_resume.py [--size 2000000] [--part-size 131072] [--kill-after 5]
+                                      [--drop-rate 0.2] [--latency 0]
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import argparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+os.environ.setdefault("TL_API_KEY", "bench")
+os.environ.setdefault("TL_INDEX_ID", "bench")
+
+from mock_api import start_mock, PREFIX  # noqa: E402
+
+RESULT_MARKER = "RESUME_RESULT "
+KILLED = 3  # Exit code of a child that stopped itself on purpose
+
+
+def run_upload(path: str, kill_after: int):
+    """Child: upload path, exiting abruptly after kill_after acknowledged parts (0: never)"""
+    from resumable_upload import upload_resumable
+    acknowledged = 0
+
+    def on_progress(done, total):
+        nonlocal acknowledged
+        acknowledged += 1
+        if acknowledged == kill_after:
+            os._exit(KILLED)  # No cleanup, like a crash
+
+    video_id = upload_resumable(path, on_progress)
+    print(RESULT_MARKER + json.dumps({"video_id": video_id}))
+
+
+def run_child(path: str, kill_after: int, env: dict) -> subprocess.CompletedProcess:
+    cmd = [sys.executable, os.path.abspath(__file__), "--run", path, "--kill-after", str(kill_after)]
+    return subprocess.run(cmd, env=env, capture_output=True, text=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--run", help=argparse.SUPPRESS)  # Internal: upload this file in this process
+    parser.add_argument("--size", type=int, default=2_000_000, help="Bytes in the test file")
+    parser.add_argument("--part-size", type=int, default=128 * 1024, help="Multipart part size in bytes")
+    parser.add_argument("--kill-after", type=int, default=5, help="Parts the first run gets acknowledged before it dies")
+    parser.add_argument("--drop-rate", type=float, default=0.2, help="Fraction of part uploads cut off mid-body")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--verbose", action="store_true", help="Show the uploads' output")
+    args = parser.parse_args()
+
+    if args.run:
+        run_upload(args.run, args.kill_after)
+        return
+
+    total_parts = -(-args.size // args.part_size)
+    if not 0 < args.kill_after < total_parts:
+        sys.exit(f"--kill-after must be between 1 and {total_parts - 1} for a {args.size} byte file")
+
+    workdir = tempfile.mkdtemp(prefix="tl_resume_")
+    journal_dir = os.path.join(workdir, "journal")
+    path = os.path.join(workdir, "source.bin")
+    data = os.urandom(args.size)
+    with open(path, "wb") as f:
+        f.write(data)
+
+    api, httpd, base_url = start_mock(latency=args.latency, part_size=args.part_size, drop_rate=args.drop_rate)
+    env = dict(os.environ, TL_API_BASE=f"{base_url}{PREFIX}", TL_UPLOAD_JOURNAL_DIR=journal_dir)
+    checks = []
+
+    def check(name: str, ok: bool, detail: str = ""):
+        checks.append(ok)
+        print(f"{'✅' if ok else '❌'} {name}{f' ({detail})' if detail else ''}")
+
+    try:
+        print(f"🧪 {args.size} bytes in {total_parts} parts of {args.part_size}, "
+              f"first run dies after {args.kill_after}, {args.drop_rate:.0%} of part uploads dropped")
+        first = run_child(path, args.kill_after, env)
+        if args.verbose:
+            print(first.stdout, first.stderr)
+        check("first run died mid-upload", first.returncode == KILLED, f"exit code {first.returncode}")
+        journals = os.listdir(journal_dir) if os.path.isdir(journal_dir) else []
+        check("journal left behind", len(journals) == 1, f"{len(journals)} journal files")
+        parts_before = api.stats["parts_received"]
+
+        second = run_child(path, 0, env)
+        if args.verbose:
+            print(second.stdout, second.stderr)
+        result = next((json.loads(line[len(RESULT_MARKER):]) for line in second.stdout.splitlines()
+                       if line.startswith(RESULT_MARKER)), None)
+        check("second run finished", second.returncode == 0 and result is not None,
+              f"exit code {second.returncode}{'' if result else ': ' + (second.stdout + second.stderr)[-500:]}")
+
+        stats = api.stats
+        check("one upload session", stats["uploads_created"] == 1, f"{stats['uploads_created']} created")
+        check("each part sent once", stats["parts_received"] == total_parts,
+              f"{parts_before} + {stats['parts_received'] - parts_before} of {total_parts}, "
+              f"{stats['connections_dropped']} connections dropped")
+        upload = next(iter(api.uploads.values()), None)
+        check("asset matches the file", bool(upload) and upload["sha256"] == hashlib.sha256(data).hexdigest())
+        check("video indexed", bool(result) and result["video_id"] in api.tasks)
+        check("journal deleted", not os.listdir(journal_dir))
+    finally:
+        httpd.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if not all(checks):
+        sys.exit(1)
+    print("🎉 Upload resumed from its journal")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""Local stand-in for the TwelveLabs endpoints the uploaders and server use.
+
+Serves POST /tasks, GET /tasks/{id}, GET /tasks (in-flight listing for the
+indexing poller), POST /search and GET /search/{token} under /v1.3, so both
+TL_API_BASE (REST uploader, server) and TWELVELABS_BASE_URL (SDK) can point at
+it. The multipart upload flow used with RESUMABLE_UPLOADS is served too:
+/assets/multipart-uploads (create, status, report parts, presigned URLs), a
+PUT endpoint standing in for the part storage, and
+/indexes/{id}/indexed-assets. Every request can be slowed down (--latency),
+uploads are read no faster than --bandwidth bytes/s, a fraction of requests
+fail with 500 or 429 (--error-rate), a fraction of part PUTs have their
+connection dropped half-way through the body (--drop-rate), and a task turns
+ready --indexing-delay seconds plus --indexing-per-mb seconds per MB after it
+was created.
+
+    python benchmarks/mock_api.py [--port 8787] [--latency 0.05] [--bandwidth 0] [--error-rate 0]
+                                  [--indexing-delay 1] [--indexing-per-mb 0.01]
+                                  [--part-size 5242880] [--drop-rate 0]
+"""
+import json
+import time
+import uuid
+import base64
+import socket
+import hashlib
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from werkzeug.serving import make_server, WSGIRequestHandler
+from werkzeug.wrappers import Request, Response
+
+PREFIX = "/v1.3"
+READ_BLOCK = 64 * 1024
+URL_BATCH = 10  # Presigned part URLs handed out per response, so clients have to ask for more
+
+
+class MockAPI:
+    """WSGI app holding the mock's tasks; options can be changed while it runs"""
+
+    def __init__(self, latency: float = 0.05, bandwidth: float = 0, error_rate: float = 0.0,
+                 indexing_delay: float = 1.0, indexing_per_mb: float = 0.01, clips_per_video: int = 5, seed: int = 0,
+                 part_size: int = 5 * 1024 * 1024, drop_rate: float = 0.0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.indexing_delay = indexing_delay
+        self.indexing_per_mb = indexing_per_mb
+        self.clips_per_video = clips_per_video
+        self.part_size = part_size
+        self.drop_rate = drop_rate
+        self.tasks = {}
+        self.uploads = {}
+        self.stats = {"requests": 0, "errors_injected": 0, "bytes_received": 0,
+                      "uploads_created": 0, "parts_received": 0, "connections_dropped": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        with self._lock:
+            self.stats["requests"] += 1
+            inject = self._rng.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+
+        path = request.path[len(PREFIX):] if request.path.startswith(PREFIX) else request.path
+        parts = [p for p in path.split("/") if p]
+        if request.method == "POST" and parts == ["tasks"]:
+            response = self.create_task(request, inject)
+        elif inject:
+            response = self.injected_error()
+        elif request.method == "GET" and parts == ["tasks"]:
+            response = self.list_tasks(request)
+        elif request.method == "GET" and len(parts) == 2 and parts[0] == "tasks":
+            response = self.get_task(parts[1])
+        elif request.method == "POST" and parts == ["search"]:
+            response = self.search(request)
+        elif request.method == "GET" and len(parts) == 2 and parts[0] == "search":
+            response = _json({"data": [], "page_info": {}})
+        elif request.method == "POST" and parts == ["assets", "multipart-uploads"]:
+            response = self.create_upload(request)
+        elif len(parts) >= 3 and parts[:2] == ["assets", "multipart-uploads"]:
+            response = self.multipart(request, parts[2], parts[3:])
+        elif request.method == "PUT" and len(parts) == 3 and parts[0] == "mock-storage":
+            response = self.put_part(environ, request, parts[1], int(parts[2]))
+        elif request.method == "POST" and len(parts) == 3 and parts[0] == "indexes" and parts[2] == "indexed-assets":
+            response = self.index_asset(request, parts[1])
+        elif request.method == "GET" and len(parts) == 4 and parts[0] == "indexes" and parts[2] == "indexed-assets":
+            response = self.get_task(parts[3])
+        else:
+            response = _json({"message": f"No mock for {request.method} {request.path}"}, 404)
+        return response(environ, start_response)
+
+    def injected_error(self) -> Response:
+        with self._lock:
+            self.stats["errors_injected"] += 1
+        if self._rng.random() < 0.5:
+            return _json({"message": "Injected rate limit"}, 429, {"Retry-After": "1"})
+        return _json({"message": "Injected server error"}, 500)
+
+    def create_task(self, request: Request, inject: bool) -> Response:
+        # Read the whole body first, at no more than the bandwidth cap, like a real upload
+        stream = request.stream
+        received = 0
+        started = time.monotonic()
+        while True:
+            block = stream.read(READ_BLOCK)
+            if not block:
+                break
+            received += len(block)
+            if self.bandwidth:
+                ahead = received / self.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        with self._lock:
+            self.stats["bytes_received"] += received
+        if inject:
+            return self.injected_error()
+
+        task_id = self.new_task(request.args.get("index_id") or "mock-index", received)
+        return _json({"_id": task_id, "video_id": task_id}, 201)
+
+    def new_task(self, index_id: str, size: int) -> str:
+        task_id = uuid.uuid4().hex[:24]
+        now = time.time()
+        task = {
+            "_id": task_id,
+            "video_id": task_id,
+            "index_id": index_id,
+            "size": size,
+            "created": now,
+            "ready_at": now + self.indexing_delay + self.indexing_per_mb * size / (1024 * 1024),
+        }
+        with self._lock:
+            self.tasks[task_id] = task
+        return task_id
+
+    def _part_urls(self, request: Request, upload_id: str, start: int, count: int) -> list:
+        total = self.uploads[upload_id]["total_chunks"]
+        return [{"chunk_index": i, "url": f"{request.host_url}mock-storage/{upload_id}/{i}"}
+                for i in range(start, min(start + count, total + 1))]
+
+    def create_upload(self, request: Request) -> Response:
+        body = request.get_json()
+        upload_id = uuid.uuid4().hex[:24]
+        total_size = int(body["total_size"])
+        upload = {
+            "upload_id": upload_id,
+            "asset_id": uuid.uuid4().hex[:24],
+            "total_size": total_size,
+            "total_chunks": max(1, -(-total_size // self.part_size)),
+            "parts": {},
+            "completed": set(),
+            "sha256": None,
+        }
+        with self._lock:
+            self.uploads[upload_id] = upload
+            self.stats["uploads_created"] += 1
+        return _json({"upload_id": upload_id, "asset_id": upload["asset_id"], "chunk_size": self.part_size,
+                      "total_chunks": upload["total_chunks"],
+                      "upload_urls": self._part_urls(request, upload_id, 1, URL_BATCH)}, 201)
+
+    def multipart(self, request: Request, upload_id: str, rest: list) -> Response:
+        """Status (GET), part reports (POST) and fresh part URLs (POST .../presigned-urls) of one upload"""
+        upload = self.uploads.get(upload_id)
+        if not upload:
+            return _json({"message": "Upload not found"}, 404)
+        if request.method == "GET" and not rest:
+            with self._lock:
+                chunks = [{"chunk_index": i, "status": "completed"} for i in sorted(upload["completed"])]
+            return _json({"upload_id": upload_id, "chunks": chunks})
+        if request.method == "POST" and not rest:
+            for part in request.get_json().get("completed_chunks", []):
+                stored = upload["parts"].get(part["chunk_index"])
+                if stored is None or hashlib.md5(stored).hexdigest() != part["proof"]:
+                    return _json({"message": f"Part {part['chunk_index']} was not uploaded"}, 400)
+                with self._lock:
+                    upload["completed"].add(part["chunk_index"])
+            return _json({})
+        if request.method == "POST" and rest == ["presigned-urls"]:
+            body = request.get_json()
+            return _json({"upload_urls": self._part_urls(request, upload_id, int(body["start"]), int(body["count"]))})
+        return _json({"message": f"No mock for {request.method} {request.path}"}, 404)
+
+    def put_part(self, environ, request: Request, upload_id: str, index: int) -> Response:
+        upload = self.uploads.get(upload_id)
+        if not upload:
+            return _json({"message": "Upload not found"}, 404)
+        with self._lock:
+            drop = self._rng.random() < self.drop_rate
+        if drop:
+            # Take half the part, then hang up as a flaky network would
+            request.stream.read(max(1, (request.content_length or 0) // 2))
+            with self._lock:
+                self.stats["connections_dropped"] += 1
+            environ["werkzeug.socket"].shutdown(socket.SHUT_RDWR)
+            return _json({"message": "dropped"}, 500)
+        data = request.stream.read()
+        md5 = hashlib.md5(data)
+        if request.headers.get("Content-MD5") != base64.b64encode(md5.digest()).decode():
+            return _json({"message": "Content-MD5 mismatch"}, 400)
+        with self._lock:
+            upload["parts"][index] = data
+            self.stats["parts_received"] += 1
+            self.stats["bytes_received"] += len(data)
+        return Response(status=200, headers={"ETag": f'"{md5.hexdigest()}"'})
+
+    def index_asset(self, request: Request, index_id: str) -> Response:
+        asset_id = request.get_json().get("asset_id")
+        upload = next((u for u in self.uploads.values() if u["asset_id"] == asset_id), None)
+        if not upload:
+            return _json({"message": "Asset not found"}, 404)
+        if len(upload["completed"]) != upload["total_chunks"]:
+            return _json({"message": f"Asset incomplete: {len(upload['completed'])}/{upload['total_chunks']} parts"}, 400)
+        data = b"".join(upload["parts"][i] for i in range(1, upload["total_chunks"] + 1))
+        upload["sha256"] = hashlib.sha256(data).hexdigest()
+        task_id = self.new_task(index_id, len(data))
+        return _json({"_id": task_id}, 201)
+
+    def _status(self, task) -> str:
+        return "ready" if time.time() >= task["ready_at"] else "indexing"
+
+    def _task_body(self, task) -> dict:
+        stamp = datetime.fromtimestamp(task["created"], timezone.utc).isoformat()
+        return {
+            "_id": task["_id"], "video_id": task["video_id"], "index_id": task["index_id"],
+            "status": self._status(task), "system_metadata": {"size": task["size"]},
+            "created_at": stamp, "updated_at": stamp,
+        }
+
+    def get_task(self, task_id: str) -> Response:
+        with self._lock:
+            task = self.tasks.get(task_id)
+        if not task:
+            return _json({"message": "Task not found"}, 404)
+        return _json(self._task_body(task))
+
+    def list_tasks(self, request: Request) -> Response:
+        wanted = set(request.args.getlist("status"))
+        with self._lock:
+            tasks = list(self.tasks.values())
+        data = [{"_id": t["_id"], "status": self._status(t)} for t in tasks]
+        if wanted:
+            data = [t for t in data if t["status"] in wanted]
+        return _json({"data": data, "page_info": {"page": 1, "total_page": 1, "total_results": len(data)}})
+
+    def search(self, request: Request) -> Response:
+        video_ids = json.loads(request.form.get("filter") or "{}").get("id", [])
+        data = []
+        for video_id in video_ids:
+            for i in range(self.clips_per_video):
+                data.append({"video_id": video_id, "start": i * 10.0, "end": i * 10.0 + 5.0,
+                             "score": round(self._rng.uniform(50, 95), 2)})
+        data.sort(key=lambda c: -c["score"])
+        return _json({"data": data, "page_info": {"total_results": len(data)}})
+
+
+def _json(body, status: int = 200, headers=None) -> Response:
+    return Response(json.dumps(body), status=status, headers=headers, mimetype="application/json")
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def start_mock(port: int = 0, quiet: bool = True, **options):
+    """Serve a MockAPI on a background thread; returns (api, server, base URL without the /v1.3 prefix)"""
+    api = MockAPI(**options)
+    server = make_server("127.0.0.1", port, api, threaded=True, request_handler=QuietHandler if quiet else None)
+    threading.Thread(target=server.serve_forever, daemon=True, name="mock-api").start()
+    return api, server, f"http://127.0.0.1:{server.server_port}"
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=0, help="Upload cap in bytes/s (0: unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500/429")
+    parser.add_argument("--indexing-delay", type=float, default=1.0, help="Seconds before a task is ready")
+    parser.add_argument("--indexing-per-mb", type=float, default=0.01, help="Extra indexing seconds per uploaded MB")
+    parser.add_argument("--part-size", type=int, default=5 * 1024 * 1024, help="Multipart upload part size in bytes")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of part uploads whose connection is dropped")
+
+
+def mock_options(args) -> dict:
+    return {"latency": args.latency, "bandwidth": args.bandwidth, "error_rate": args.error_rate,
+            "indexing_delay": args.indexing_delay, "indexing_per_mb": args.indexing_per_mb,
+            "part_size": args.part_size, "drop_rate": args.drop_rate}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8787)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    api, server, base = start_mock(args.port, quiet=False, **mock_options(args))
+    print(f"Mock API on {base}{PREFIX} (TL_API_BASE={base}{PREFIX} TWELVELABS_BASE_URL={base})")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"  {api.stats}")
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,221 @@
+import os
+import time
+import subprocess
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import observe_stage
+from upload_body import read_windows
+from config import CHUNK_WORKERS, UPLOAD_BUFFER_SIZE
+
+
+def plan_cut_points(total_duration: float, chunk_duration: float) -> List[Tuple[float, float]]:
+    """Split a duration into (start, length) pairs of at most chunk_duration"""
+    cut_points = []
+    start = 0.0
+    while start < total_duration:
+        length = min(chunk_duration, total_duration - start)
+        cut_points.append((start, length))
+        start += length
+    return cut_points
+
+
+def plan_keyframe_cuts(keyframes: List[Tuple[float, int]], total_duration: float, total_bytes: int,
+                       max_size: float, max_duration: float, overhead: float = 1.0) -> List[Tuple[float, float]]:
+    """Plan (start, length) cuts at keyframes so every chunk fits both limits.
+
+    keyframes are (time, byte offset) pairs from the probe's keyframe index;
+    a stream-copy cut from one keyframe to another contains the packets
+    stored in between, so chunk sizes are known before anything is cut.
+    total_bytes is the file size. overhead scales the offsets if they
+    undercount file bytes. Cuts are greedy: each chunk runs to the last
+    keyframe still within both limits.
+    """
+    times, offsets = _keyframe_offsets(keyframes, total_duration, total_bytes)
+    budget = max_size / overhead
+
+    cut_points = []
+    i, last = 0, len(times) - 1
+    while i < last:
+        j = min(bisect_right(times, times[i] + max_duration, i + 1),
+                bisect_right(offsets, offsets[i] + budget, i + 1)) - 1
+        if j <= i:
+            # A single GOP over the limit can't be split without re-encoding
+            j = i + 1
+            print(f"⚠️  GOP at {times[i]:.1f}s is larger than the chunk limit, cutting at the next keyframe")
+        cut_points.append((times[i], times[j] - times[i]))
+        i = j
+    return cut_points
+
+
+def _keyframe_offsets(keyframes: List[Tuple[float, int]], total_duration: float,
+                      total_bytes: int) -> Tuple[List[float], List[int]]:
+    """Keyframe times from 0 to the end of the file, and the (non-decreasing) byte offset of each"""
+    pairs = sorted(keyframes)
+    times = [0.0] + [t for t, _ in pairs if 0 < t < total_duration] + [total_duration]
+    offsets = [0]
+    for t, o in pairs:
+        if 0 < t < total_duration:
+            offsets.append(max(offsets[-1], o))
+    offsets.append(max(offsets[-1], total_bytes))
+    return times, offsets
+
+
+def keyframe_sizes(keyframes: List[Tuple[float, int]], cut_points: List[Tuple[float, float]], total_duration: float,
+                   total_bytes: int) -> List[int]:
+    """Source bytes between each cut's start and end by the keyframe index, interpolated between sampled keyframes"""
+    times, offsets = _keyframe_offsets(keyframes, total_duration, total_bytes)
+
+    def offset_at(t: float) -> float:
+        i = min(bisect_left(times, t), len(times) - 1)
+        if i == 0 or times[i] <= t:
+            return offsets[i]
+        span = times[i] - times[i - 1]
+        return offsets[i - 1] + (offsets[i] - offsets[i - 1]) * (t - times[i - 1]) / span if span else offsets[i]
+
+    return [int(offset_at(start + length) - offset_at(start)) for start, length in cut_points]
+
+
+def chunk_path(output_dir: str, stem: str, index: int) -> str:
+    return os.path.join(output_dir, f"{stem}_chunk_{index:03d}.mp4")
+
+
+def cut_one(input_path: str, start: float, length: float, out_path: str) -> float:
+    """Cut a single chunk with an input-side seek and return the time it took"""
+    started = time.monotonic()
+    subprocess.run([
+        "ffmpeg", "-y",
+        "-ss", str(start),
+        "-i", input_path,
+        "-t", str(length),
+        "-c", "copy",
+        "-avoid_negative_ts", "make_zero",
+        "-movflags", "faststart",
+        out_path
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.monotonic() - started
+
+
+def cut_parallel(input_path: str, cut_points: List[Tuple[float, float]], output_dir: str, stem: str,
+                 workers: int = CHUNK_WORKERS, first_index: int = 1, slots: Optional[threading.Semaphore] = None,
+                 held: int = 0) -> Iterator[Dict]:
+    """Cut chunks with input-side seeks, running up to `workers` ffmpeg processes at once.
+
+    Chunks are yielded in completion order. With `slots` (see
+    pipeline.chunk_slots), a cut only starts once it has taken a slot, which
+    the chunk keeps until its consumer has deleted it, so chunks on disk,
+    finished or still being cut, never outnumber the slots. `held` slots were
+    already taken by the caller for this call's first cuts.
+    """
+    workers = max(1, workers)
+    pending = list(enumerate(cut_points, first_index))
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def take_slot():
+            nonlocal held
+            if held:
+                held -= 1
+                return True
+            # Only block while no cut is running: a finished one has to be handed on before its slot comes back
+            return slots is None or slots.acquire(blocking=not in_flight)
+
+        def start_more():
+            while pending and len(in_flight) < workers and take_slot():
+                index, (start, length) = pending.pop(0)
+                out_path = chunk_path(output_dir, stem, index)
+                future = executor.submit(cut_one, input_path, start, length, out_path)
+                in_flight[future] = (index, start, length, out_path)
+
+        start_more()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, start, length, out_path = in_flight.pop(future)
+                elapsed = future.result()
+                observe_stage("cut", elapsed)
+                yield {
+                    "index": index,
+                    "path": out_path,
+                    "start": start,
+                    "duration": length,
+                    "size": os.path.getsize(out_path),
+                    "elapsed": elapsed,
+                }
+            start_more()
+
+
+def cut_streaming(input_path: str, cut_points: List[Tuple[float, float]], output_dir: str, stem: str,
+                  max_size: float, workers: int = CHUNK_WORKERS, slots: Optional[threading.Semaphore] = None,
+                  held: int = 0) -> Iterator[Dict]:
+    """Yield temp chunks as they are cut, re-cutting any that exceed max_size.
+
+    Cuts with input-side seeks (cut_parallel), starting a cut only once it
+    has one of the pipeline's `slots`, which is what keeps a pipelined
+    upload's temp disk bounded. An oversized chunk's slot
+    goes to the first of its pieces.
+    """
+    for c in cut_parallel(input_path, cut_points, output_dir, stem, workers, slots=slots, held=held):
+        size_gb = c["size"] / (1024 * 1024 * 1024)
+        if c["size"] <= max_size:
+            print(f"✅ Created chunk {c['index']}: Duration={c['duration']:.1f}s, Size={size_gb:.2f} GB (cut in {c['elapsed']:.1f}s)")
+            c["temp"] = True
+            yield c
+            continue
+
+        print(f"⚠️  Chunk {c['index']} exceeds size limit ({size_gb:.2f} GB), re-splitting...")
+        os.remove(c["path"])
+        pieces = [(c["start"] + start, length) for start, length in plan_cut_points(c["duration"], c["duration"] * 0.8)]
+        yield from cut_streaming(input_path, pieces, output_dir, f"{stem}_{c['index']:03d}", max_size, workers,
+                                 slots, 1 if slots else 0)
+
+
+def stream_chunk(input_path: str, start: float, length: float, buffer_size: int = UPLOAD_BUFFER_SIZE) -> Iterator[memoryview]:
+    """Remux one chunk to fragmented MP4 on ffmpeg's stdout and yield it block by block; nothing is written to disk.
+
+    Fragmented MP4 (an empty moov up front, then moof/mdat pairs) needs no
+    seek back to patch the header, so it can be written to a pipe.
+    """
+    proc = subprocess.Popen([
+        "ffmpeg", "-v", "error",
+        "-ss", str(start),
+        "-i", input_path,
+        "-t", str(length),
+        "-c", "copy",
+        "-avoid_negative_ts", "make_zero",
+        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+        "-f", "mp4", "pipe:1"
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        yield from read_windows(proc.stdout, buffer_size)
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, "ffmpeg")
+    finally:
+        # Also reached when the upload gives up half way: don't leave ffmpeg blocked on a full pipe
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
+
+
+def virtual_chunks(input_path: str, cut_points: List[Tuple[float, float]], stem: str, total_duration: float,
+                   keyframes: List[Tuple[float, int]]) -> Iterator[Dict]:
+    """Chunk records with no file behind them: stream_chunk produces each one's bytes while it uploads.
+
+    "size" is estimated from the keyframe index's byte offsets until the chunk
+    has been sent.
+    """
+    sizes = keyframe_sizes(keyframes, cut_points, total_duration, os.path.getsize(input_path))
+    for index, ((start, length), size) in enumerate(zip(cut_points, sizes), 1):
+        yield {
+            "index": index,
+            "path": f"{input_path}#t={start:g},{start + length:g}",
+            "name": os.path.basename(chunk_path("", stem, index)),
+            "source": input_path,
+            "start": start,
+            "duration": length,
+            "size": size,
+            "temp": False,
+            "virtual": True,
+        }
@@ -13,21 +13,95 @@ if not API_KEY or not INDEX_ID:
     raise ValueError("Please set TL_API_KEY and TL_INDEX_ID environment variables")
 
 # API Endpoints
-API_BASE = "https://api.twelvelabs.io/v1.3"
+API_BASE = os.environ.get('TL_API_BASE', "https://api.twelvelabs.io/v1.3")
 
 # Video Processing Settings
 MAX_CHUNK_DURATION = 7200  # 120 minutes (2 hours) for Marengo
 MAX_CHUNK_SIZE = 2.0 * 1024 * 1024 * 1024  # 2.0 GB (with safety buffer)
+CHUNK_WORKERS = 4  # Parallel ffmpeg cuts per video
+
+PROBE_CACHE_SIZE = 128  # ffprobe results kept in memory (LRU)
+PROBE_CACHE_PERSIST = True  # Also keep probe results on disk across restarts
+KEYFRAME_SAMPLE_INTERVAL = 10.0  # Seconds between keyframe index samples (planner cut granularity) for files that are chunked
 
 # Upload Settings
-UPLOAD_WORKERS = 1  # Sequential uploads to avoid connection issues
-INDEXING_WORKERS = 6  # Parallel indexing monitoring
+UPLOAD_WORKERS = 3  # Concurrent chunk uploads per file
+PIPELINE_DEPTH = 2  # Cut chunks waiting for an uploader; at most PIPELINE_DEPTH + UPLOAD_WORKERS chunks are on disk at once
+UPLOAD_BUFFER_SIZE = 8 * 1024 * 1024  # Bytes of a file handed to the socket per send (one mmap window)
+VIRTUAL_CHUNKS = False  # API uploader: remux each chunk to fragmented MP4 straight into its upload (chunked encoding), no temp files
+
+# Temp Storage (temp_space.py)
+TEMP_DIR = '/tmp/tl_slicer'  # Where each job's chunk directory is created; only this app writes here, so the orphan sweep touches nothing else
+TEMP_CHUNK_OVERHEAD = 1.05  # Chunk bytes written per source byte cut (container overhead)
+TEMP_MIN_FREE = 1 * 1024 * 1024 * 1024  # Bytes always kept free on TEMP_DIR and UPLOAD_FOLDER when admitting jobs
+TEMP_ADMIT_POLL = 5.0  # Seconds between free-space checks while a batch job waits for admission
+TEMP_ORPHAN_AGE = 6 * 3600  # Seconds; unregistered chunk dirs and partial uploads older than this are swept at startup
+
+# Batch Ingest (batch_ingest.py)
+BATCH_WORKERS = 4  # Files processed at once
+BATCH_MAX_ATTEMPTS = 3  # Tries per file across runs before it stays failed
+
+# Batch Mode (uploader_API.py --batch, asyncio + httpx)
+ASYNC_FILE_CONCURRENCY = 50  # Files being cut and uploaded at once; files waiting for indexing do not count
+ASYNC_UPLOAD_CONCURRENCY = 16  # Chunk uploads in flight across all files
+ASYNC_POLL_CONCURRENCY = 8  # Indexing status requests in flight
+ASYNC_READ_SIZE = 1024 * 1024  # Bytes read from disk per streamed upload block
+
+# Indexing Status Polling (one shared poller for all tasks)
+INDEXING_POLL_MIN = 5.0  # Seconds; shortest gap between checks of a task
+INDEXING_POLL_MAX = 120.0  # Seconds; longest gap between checks of a task
+INDEXING_SPEED_RATIO = 0.3  # Expected indexing time as a fraction of chunk duration
+INDEXING_POLL_MAX_PAGES = 20  # Pages of in-flight tasks listed per tick (50 per page)
+
+# Deduplication
+DEDUP_ENABLED = True  # Reuse video IDs for files and chunks whose content is already indexed
+DEDUP_SAMPLES = 16  # Blocks read for the quick sampled hash
+DEDUP_SAMPLE_SIZE = 256 * 1024  # Bytes per sampled block
+
+# Metrics (GET /metrics, Prometheus text format)
+METRICS_ENABLED = True  # Time each ingest stage; off makes the instrumentation a no-op
+
+# HTTP Settings
+MAX_CONNECTIONS_PER_HOST = 4  # Keep-alive pool size and concurrent request cap per host
+HTTP_MAX_RETRIES = 5  # Retries on 429/5xx and connection errors
+BACKOFF_BASE = 1.0  # Seconds; exponential backoff with jitter
+BACKOFF_MAX = 60.0  # Upper bound on a single backoff wait
+RESUMABLE_UPLOADS = False  # Send files in parts via multipart uploads and resume from a journal
 
 # File Paths
-UPLOAD_FOLDER = '/tmp'
-PROGRESS_FILE = 'progress.json'
-VIDEO_ID_MAP = 'video_id_map.json'
+UPLOAD_FOLDER = '/tmp/tl_slicer/uploads'  # Web uploads (and their .part files while they arrive); app-owned like TEMP_DIR
+APP_DIR = os.path.dirname(os.path.abspath(__file__))  # State below lives here, so a restart from another directory still finds it
+STATE_DB = os.path.join(APP_DIR, 'state.db')  # Files, chunk timelines, indexing tasks, progress, jobs and the dedup content index (SQLite, WAL mode)
+UPLOAD_JOURNAL_DIR = os.environ.get('TL_UPLOAD_JOURNAL_DIR', os.path.join(APP_DIR, '.upload_journal'))
+BATCH_DB = os.path.join(APP_DIR, 'batch_state.db')  # Batch ingest checkpoints (SQLite)
+PROBE_CACHE_DIR = os.path.join(APP_DIR, '.probe_cache')
+# JSON state files from earlier versions, imported into STATE_DB once
+PROGRESS_FILE = os.path.join(APP_DIR, 'progress.json')
+PROGRESS_WAL = os.path.join(APP_DIR, 'progress.wal')
+VIDEO_ID_MAP = os.path.join(APP_DIR, 'video_id_map.json')
+CHUNK_TIMELINE = os.path.join(APP_DIR, 'chunk_timeline.json')
+CONTENT_INDEX = os.path.join(APP_DIR, 'content_index.json')
+
+# Progress Persistence
+PROGRESS_FLUSH_INTERVAL = 1.0  # Seconds between coalesced progress writes
+PROGRESS_POLL_INTERVAL = 1.0  # Seconds a file's progress read from the database is cached (how soon another process's writes show up)
+PROGRESS_LONG_POLL_TIMEOUT = 25.0  # Max seconds GET /progress?since= holds a request
+PROGRESS_KEEPALIVE_INTERVAL = 15.0  # Seconds between SSE keep-alive comments
 
 # Server Settings
 SERVER_PORT = 5000
+INGEST_BUFFER_SIZE = 8 * 1024 * 1024  # Bytes read from the request body and written per block
+INGEST_HEADER_BYTES = 4 * 1024 * 1024  # Bytes on disk before the container header is probed
+INGEST_HASH = 'sha256'  # Content hash computed while the upload streams in
+SEARCH_PAGE_LIMIT = 50  # Clips per search API page
+SEARCH_MAX_RESULTS = 100  # Stop following search pages once this many clips are collected
+SEARCH_MERGE_GAP = 0.5  # Seconds between hits that are still merged into one (e.g. across a chunk boundary)
+SEARCH_WORKERS = 8  # Concurrent API searches in a multi-file search
+SEARCH_TOP_K = 50  # Clips returned by a multi-file search, best first
+SEARCH_CACHE_SIZE = 256  # Search results kept in memory (LRU)
+SEARCH_CACHE_TTL = 300  # Seconds before a cached search is repeated against the API
+VIDEOS_PAGE_SIZE = 100  # Files per /videos page by default
+VIDEOS_PAGE_MAX = 1000  # Largest page /videos will return
+JOB_WORKERS = 4  # Files processed at once by the in-process job engine
+JOB_QUEUE_SIZE = 100  # Uploads waiting for a worker before /upload returns 503
 DEBUG_MODE = True
\ No newline at end of file
@@ -0,0 +1,166 @@
+import os
+import hashlib
+import sqlite3
+from typing import Dict, List, Optional
+from probe import probe_key
+from state_store import get_state
+from config import DEDUP_ENABLED, DEDUP_SAMPLES, DEDUP_SAMPLE_SIZE, INGEST_HASH
+
+# Content-addressed view of what has already been indexed, kept in the
+# state store. A file is found by a cheap sampled hash (size plus a few
+# spread-out blocks), confirmed by its full hash or, for the very same file
+# unchanged, by its path/size/mtime/inode key. Full hashes come from bytes
+# that are read anyway (ingest, or the upload of an unchunked file); a file
+# is only hashed separately when a likely duplicate turns up. Chunks are
+# keyed by their source's sampled hash and time range, so an identical cut
+# of the same content reuses its video ID; the chunk's digest, taken while
+# it was uploaded, is checked before it is trusted. Only content that
+# finished indexing is recorded.
+
+HASH_BLOCK = 8 * 1024 * 1024
+
+
+def sampled_hash(path: str) -> str:
+    """Size plus DEDUP_SAMPLES evenly spaced blocks: cheap, and equal for equal files"""
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= DEDUP_SAMPLES * DEDUP_SAMPLE_SIZE:
+            h.update(f.read())
+        else:
+            step = (size - DEDUP_SAMPLE_SIZE) // (DEDUP_SAMPLES - 1)
+            for i in range(DEDUP_SAMPLES):
+                f.seek(i * step)
+                h.update(f.read(DEDUP_SAMPLE_SIZE))
+    return h.hexdigest()
+
+
+def file_hash(path: str) -> str:
+    """Full content hash, the same kind ingest computes while an upload streams in"""
+    h = hashlib.new(INGEST_HASH)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_info(path: str, content_hash: Optional[str] = None) -> Dict:
+    """What dedup needs to know about a source, gathered before upload: sampled hash, version key and full hash if known"""
+    if not DEDUP_ENABLED:
+        return {"sample": None, "key": None, "hash": content_hash}
+    return {"sample": sampled_hash(path), "key": probe_key(path), "hash": content_hash}
+
+
+def cut_key(source: Dict, chunk: Dict) -> str:
+    return f"{source['sample']}:{chunk['start']:.3f}:{chunk['duration']:.3f}"
+
+
+def _hash_original(entry: Dict) -> Optional[str]:
+    """Full hash of an entry recorded without one, if the file it came from is still there unchanged"""
+    path = (entry["file_key"] or "").rsplit(":", 3)[0]
+    try:
+        if probe_key(path) != entry["file_key"]:
+            return None
+    except OSError:
+        return None
+    content_hash = file_hash(path)
+    try:
+        get_state().update_content(entry["id"], content_hash=content_hash)
+    except sqlite3.IntegrityError:
+        pass  # Another entry already holds this hash
+    return content_hash
+
+
+def find_file(path: str, source: Dict) -> Optional[Dict]:
+    """The entry for an already indexed copy of this file, if any.
+
+    New content costs the few small reads of the sampled hash. Only a
+    sampled-hash match makes it worth hashing the file in full, and only if
+    its full hash isn't known yet and the match isn't the same file.
+    """
+    entries = get_state().content(source["sample"])
+    if not entries:
+        return None
+    same_file = next((e for e in entries if e["file_key"] == source["key"]), None)
+    if same_file:
+        return same_file
+    if source["hash"] is None:
+        source["hash"] = file_hash(path)
+    for entry in entries:
+        if entry["content_hash"] is None:
+            entry["content_hash"] = _hash_original(entry)
+        if entry["content_hash"] == source["hash"]:
+            return entry
+    return None
+
+
+def reuse_chunk(chunk: Dict, source: Dict) -> Optional[str]:
+    """Video ID of an already indexed chunk cut from the same content at the same range, if any.
+
+    Stores the chunk's key on it as "cut_key" so remember() can record it
+    once it is indexed. A candidate is confirmed by reading the chunk once;
+    chunks with no candidate are not read at all. The source itself (an
+    unchunked upload) was already looked up whole, and virtual chunks have no
+    bytes to confirm, so neither is ever matched.
+    """
+    if not DEDUP_ENABLED or not chunk.get("temp") or chunk.get("virtual"):
+        return None
+    chunk["cut_key"] = cut_key(source, chunk)
+    found = get_state().content_chunk(chunk["cut_key"])
+    if not found:
+        return None
+    digest, video_id = found
+    chunk["hash"] = file_hash(chunk["path"])
+    return video_id if chunk["hash"] == digest else None
+
+
+def duplicate_result(filename: str, entry: Dict) -> Dict:
+    """Upload result for content that is already indexed, shaped like pipeline.build_result"""
+    chunks = [{"index": i, **c, "error": None, "indexing": "ready"} for i, c in enumerate(entry["chunks"], 1)]
+    return {
+        "filename": filename,
+        "video_ids": list(entry["video_ids"]),
+        "chunks": chunks,
+        "status": f"Already indexed (same content as {entry['filenames'][0]})",
+        "success": True,
+        "duplicate_of": entry["filenames"][0],
+    }
+
+
+def reuse_existing(filename: str, path: str, source: Dict) -> Optional[Dict]:
+    """Result for a file whose content is already indexed, or None if it is new"""
+    if not DEDUP_ENABLED:
+        return None
+    entry = find_file(path, source)
+    if not entry:
+        return None
+    if filename not in entry["filenames"]:
+        get_state().update_content(entry["id"], filenames=entry["filenames"] + [filename])
+    print(f"♻️  {filename} is already indexed as {', '.join(entry['video_ids'])} (same content as {entry['filenames'][0]})")
+    return duplicate_result(filename, entry)
+
+
+def remember(source: Dict, filename: str, results: List[Dict], indexing: Dict[str, str]):
+    """Record what finished indexing so later uploads of the same content can reuse it.
+
+    Nothing is read here: chunk digests were taken while they were uploaded,
+    and an unchunked file's upload digest is its full hash.
+    """
+    if not DEDUP_ENABLED:
+        return
+    ready = [c for c in results if c["result"] and indexing.get(c["result"]) in ["ready", "completed"]]
+    chunks = [(c["cut_key"], c["hash"], c["result"]) for c in ready if c.get("cut_key") and c.get("hash")]
+    entry = None
+    if results and len(ready) == len(results):
+        whole = results[0] if len(results) == 1 and not results[0].get("temp") else {}
+        entry = {
+            "content_hash": source["hash"] or whole.get("hash"),
+            "sample": source["sample"],
+            "file_key": source["key"],
+            "video_ids": [c["result"] for c in results],
+            "chunks": [{"video_id": c["result"], "start": c["start"], "duration": c.get("duration"),
+                        "size": c.get("size")} for c in results],
+            "filenames": [filename],
+        }
+    if entry or chunks:
+        get_state().add_content(entry, chunks)
@@ -0,0 +1,107 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from config import MAX_CONNECTIONS_PER_HOST, HTTP_MAX_RETRIES, BACKOFF_BASE, BACKOFF_MAX, UPLOAD_WORKERS
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# One connection pool for the whole process. Sessions are per thread (their
+# cookie jars aren't thread-safe) but all mount this adapter, so keep-alive
+# connections outlive the short-lived threads each file's upload runs on.
+# Pools are kept for the API host plus one storage host per concurrent part
+# upload (presigned URLs), each holding up to the per-host request cap.
+_adapter = HTTPAdapter(pool_connections=UPLOAD_WORKERS + 1, pool_maxsize=MAX_CONNECTIONS_PER_HOST)
+_local = threading.local()
+_host_lock = threading.Lock()
+_host_slots = {}
+_host_cooldown = {}
+
+
+def get_session() -> requests.Session:
+    """Return this thread's session on the shared keep-alive pool"""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.mount('https://', _adapter)
+        session.mount('http://', _adapter)
+        _local.session = session
+    return session
+
+
+def _host(url: str) -> str:
+    return urlparse(url).netloc
+
+
+@contextmanager
+def host_slot(url: str):
+    """Limit concurrent requests per host and wait out any shared cooldown.
+
+    The cooldown is waited out before taking a slot, so a throttled host
+    doesn't also hold slots that requests to it can't use yet.
+    """
+    host = _host(url)
+    with _host_lock:
+        slot = _host_slots.setdefault(host, threading.BoundedSemaphore(MAX_CONNECTIONS_PER_HOST))
+    while True:
+        wait = _host_cooldown.get(host, 0) - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        slot.acquire()
+        if _host_cooldown.get(host, 0) <= time.monotonic():
+            break
+        slot.release()  # Throttled again while we waited for the slot
+    try:
+        yield
+    finally:
+        slot.release()
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Seconds to wait before retry `attempt` (0-based): Retry-After if given, else full-jitter exponential"""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass  # HTTP-date form; fall back to exponential
+    return random.uniform(BACKOFF_BASE, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt + 1)))
+
+
+def _cool_down(url: str, delay: float):
+    """Hold back every worker talking to this host, not just the one that was throttled"""
+    host = _host(url)
+    with _host_lock:
+        _host_cooldown[host] = max(_host_cooldown.get(host, 0), time.monotonic() + delay)
+
+
+def with_backoff(send: Callable[[], requests.Response], url: str, max_retries: int = HTTP_MAX_RETRIES) -> requests.Response:
+    """Call send() until it returns a non-retryable response, backing off on 429/5xx and connection errors.
+
+    send() is called again on each retry, so it must rebuild any request body it consumes.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            with host_slot(url):
+                res = send()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"⚠️  Request to {url} failed: {e}. Retrying in {delay:.1f}s...")
+        else:
+            if res.status_code not in RETRY_STATUSES or attempt == max_retries:
+                return res
+            delay = backoff_delay(attempt, res.headers.get('Retry-After'))
+            if res.status_code == 429:
+                _cool_down(url, delay)
+            print(f"⚠️  {res.status_code} from {url}. Retrying in {delay:.1f}s...")
+        time.sleep(delay)
+
+
+def request_with_backoff(method: str, url: str, **kwargs) -> requests.Response:
+    """Send a request on the pooled session with adaptive backoff"""
+    return with_backoff(lambda: get_session().request(method, url, **kwargs), url)
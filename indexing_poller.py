@@ -0,0 +1,215 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+from http_pool import request_with_backoff
+from state_store import get_state
+from metrics import observe_stage
+from config import (
+    API_KEY, INDEX_ID, API_BASE,
+    INDEXING_POLL_MIN, INDEXING_POLL_MAX, INDEXING_SPEED_RATIO, INDEXING_POLL_MAX_PAGES
+)
+
+IN_FLIGHT_STATUSES = ["validating", "pending", "queued", "indexing"]
+DONE_STATUSES = {"ready", "completed", "failed"}
+
+
+def next_interval(elapsed: float, expected: Optional[float]) -> float:
+    """Seconds until a task should be checked again.
+
+    Before the expected indexing time, sleep half of what's left of it; after
+    that (or with no estimate), back off in proportion to how long it has taken.
+    """
+    if expected and elapsed < expected:
+        interval = (expected - elapsed) / 2
+    else:
+        interval = elapsed * 0.25
+    return min(INDEXING_POLL_MAX, max(INDEXING_POLL_MIN, interval))
+
+
+class IndexingPoller:
+    """One background thread that tracks every outstanding indexing task.
+
+    Each tick lists the index's in-flight tasks in as few paged requests as
+    possible; a tracked task missing from that list has finished and gets one
+    GET to learn whether it is ready or failed. Tasks with their own status URL
+    (indexed assets from resumable uploads) are checked individually. Tasks are
+    tracked until they finish: there is no timeout. Status changes are saved
+    to the state database's tasks table. Callers either block in wait() or
+    register a when_done() callback, which the poller thread runs.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._watchers = []  # (task IDs, callback) for when_done
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def track(self, task_id: str, duration: Optional[float] = None, status_url: Optional[str] = None,
+              status: Optional[str] = None):
+        """Watch a task until it finishes; pass a final status for tasks already known to be done"""
+        now = time.monotonic()
+        with self._lock:
+            new = task_id not in self._tasks
+            if new:
+                self._tasks[task_id] = {
+                    "status": status or "pending",
+                    "done": threading.Event(),
+                    "started": now,
+                    "next_check": now + INDEXING_POLL_MIN,
+                    "expected": duration * INDEXING_SPEED_RATIO if duration else None,
+                    "status_url": status_url,
+                }
+                if status in DONE_STATUSES:
+                    self._tasks[task_id]["done"].set()
+            if self._thread is None and status not in DONE_STATUSES:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="indexing-poller")
+                self._thread.start()
+        if new:
+            get_state().set_task(task_id, status or "pending")
+        self._wakeup.set()
+
+    def wait(self, task_id: str, timeout: Optional[float] = None) -> str:
+        """Block until the task is ready or failed and return its final status"""
+        with self._lock:
+            task = self._tasks[task_id]
+        task["done"].wait(timeout)
+        return task["status"]
+
+    def when_done(self, task_ids: Iterable[str], callback: Callable[[Dict[str, str]], None]):
+        """Call callback({task_id: final status}) once every one of the (tracked) tasks has finished
+
+        Runs on the poller thread, or right away if they already have; keep it short.
+        """
+        task_ids = list(task_ids)
+        with self._lock:
+            self._watchers.append((task_ids, callback))
+        self._notify()
+
+    def _notify(self):
+        """Run the when_done callbacks whose tasks have all finished"""
+        with self._lock:
+            ready = [w for w in self._watchers if all(self._tasks[tid]["done"].is_set() for tid in w[0])]
+            self._watchers = [w for w in self._watchers if w not in ready]
+            ready = [(callback, {tid: self._tasks[tid]["status"] for tid in task_ids}) for task_ids, callback in ready]
+        for callback, statuses in ready:
+            try:
+                callback(statuses)
+            except Exception as e:
+                print(f"⚠️  Indexing callback failed: {e}")
+
+    def status(self, task_id: str) -> Optional[str]:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return task["status"] if task else None
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for t in self._tasks.values() if not t["done"].is_set())
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                waiting = {tid: t for tid, t in self._tasks.items() if not t["done"].is_set()}
+            due = [tid for tid, t in waiting.items() if t["next_check"] <= now]
+
+            if not due:
+                next_due = min((t["next_check"] for t in waiting.values()), default=None)
+                self._wakeup.wait(None if next_due is None else max(0, next_due - now))
+                self._wakeup.clear()
+                continue
+
+            try:
+                statuses = self._fetch(due, waiting)
+            except Exception as e:
+                print(f"⚠️  Indexing status check failed: {e}")
+                statuses = {}
+
+            now = time.monotonic()
+            changed = {}
+            with self._lock:
+                for tid in due:
+                    task = self._tasks[tid]
+                    status = statuses.get(tid)
+                    if status and status != task["status"]:
+                        task["status"] = changed[tid] = status
+                    if task["status"] in DONE_STATUSES:
+                        print(f"ℹ️  Indexing done: {tid} → {task['status']}")
+                        observe_stage("indexing_wait", now - task["started"], "error" if task["status"] == "failed" else "ok")
+                        task["done"].set()
+                    else:
+                        task["next_check"] = now + next_interval(now - task["started"], task["expected"])
+            for tid, status in changed.items():
+                get_state().set_task(tid, status)
+            self._notify()
+
+    def _fetch(self, due: List[str], waiting: Dict[str, Dict]) -> Dict[str, str]:
+        headers = {"x-api-key": API_KEY}
+        statuses = {}
+        individual = [tid for tid in due if waiting[tid]["status_url"]]
+        batched = [tid for tid in due if not waiting[tid]["status_url"]]
+
+        if batched:
+            in_flight = self._list_in_flight(headers)
+            if in_flight is None:
+                individual += batched
+            else:
+                for tid in batched:
+                    if tid in in_flight:
+                        statuses[tid] = in_flight[tid]
+                    else:
+                        # Most likely finished: one GET to learn how it ended
+                        individual.append(tid)
+
+        for tid in individual:
+            url = waiting[tid]["status_url"] or f"{API_BASE}/tasks/{tid}"
+            res = request_with_backoff("GET", url, headers=headers)
+            if res.status_code == 404:
+                statuses[tid] = "failed"
+            elif res.status_code == 200:
+                statuses[tid] = res.json().get("status")
+            else:
+                print(f"⚠️  Error checking status for {tid}: {res.text}")
+        return statuses
+
+    def _list_in_flight(self, headers: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """Statuses of the index's in-flight tasks (at most INDEXING_POLL_MAX_PAGES pages), or None if listing fails"""
+        in_flight = {}
+        for page in range(1, INDEXING_POLL_MAX_PAGES + 1):
+            params = [("index_id", INDEX_ID), ("page", page), ("page_limit", 50)]
+            params += [("status", s) for s in IN_FLIGHT_STATUSES]
+            res = request_with_backoff("GET", f"{API_BASE}/tasks", headers=headers, params=params)
+            if res.status_code != 200:
+                return None
+            body = res.json()
+            for task in body.get("data", []):
+                in_flight[task.get("_id") or task.get("id")] = task.get("status")
+            if page >= body.get("page_info", {}).get("total_page", 1):
+                break
+        return in_flight
+
+
+_poller: Optional[IndexingPoller] = None
+_poller_lock = threading.Lock()
+
+
+def get_poller() -> IndexingPoller:
+    """The process-wide indexing poller, created on first use"""
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = IndexingPoller()
+        return _poller
+
+
+def wait_for_indexing(task_ids: Iterable[str], on_update: Optional[Callable[[int, int], None]] = None) -> Dict[str, str]:
+    """Wait for tracked tasks to finish; on_update(done, total) is called as each one does"""
+    poller = get_poller()
+    task_ids = list(task_ids)
+    statuses = {}
+    for tid in task_ids:
+        statuses[tid] = poller.wait(tid)
+        if on_update:
+            on_update(len(statuses), len(task_ids))
+    return statuses
@@ -0,0 +1,88 @@
+import os
+import hashlib
+from typing import BinaryIO, Callable, Dict, Optional
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, Field, File, Data, Epilogue
+from config import INGEST_BUFFER_SIZE, INGEST_HEADER_BYTES, INGEST_HASH
+
+
+class IngestError(Exception):
+    pass
+
+
+def stream_multipart(stream: BinaryIO, content_type: str, dest_dir: str, file_field: str = "file",
+                     on_header: Optional[Callable[[str], None]] = None) -> Dict:
+    """Parse a multipart body incrementally, writing the file part straight to dest_dir.
+
+    The body is read in INGEST_BUFFER_SIZE blocks and the file part is written
+    once, hashed as it goes, to `<name>.part`, which is renamed when complete.
+    No spooled copy is made. on_header(partial_path) is called once the first
+    INGEST_HEADER_BYTES are on disk, so probing can start before the body ends.
+    Returns the form fields plus filename, path, size and content hash.
+    """
+    mimetype, options = parse_options_header(content_type)
+    if mimetype != "multipart/form-data" or "boundary" not in options:
+        raise IngestError("Expected a multipart/form-data body")
+
+    decoder = MultipartDecoder(options["boundary"].encode())
+    fields = {}
+    result = None
+    current = None  # ("field", name, bytearray) or ("file", name, fh, hasher)
+    written = 0
+    header_sent = on_header is None
+
+    try:
+        while True:
+            block = stream.read(INGEST_BUFFER_SIZE)
+            decoder.receive_data(block or None)
+            event = decoder.next_event()
+            while event is not NEED_DATA:
+                if isinstance(event, Field):
+                    current = ("field", event.name, bytearray())
+                elif isinstance(event, File):
+                    if event.name != file_field or result is not None:
+                        current = ("skip", event.name, None)
+                    else:
+                        filename = os.path.basename(event.filename or "")
+                        if not filename:
+                            raise IngestError("No file selected")
+                        path = os.path.join(dest_dir, filename)
+                        fh = open(path + ".part", "wb", buffering=INGEST_BUFFER_SIZE)
+                        result = {"filename": filename, "path": path}
+                        current = ("file", event.name, fh, hashlib.new(INGEST_HASH))
+                elif isinstance(event, Data):
+                    if current[0] == "field":
+                        current[2].extend(event.data)
+                    elif current[0] == "file":
+                        current[2].write(event.data)
+                        current[3].update(event.data)
+                        written += len(event.data)
+                        if not header_sent and written >= INGEST_HEADER_BYTES:
+                            current[2].flush()
+                            on_header(result["path"] + ".part")
+                            header_sent = True
+                    if not event.more_data:
+                        if current[0] == "field":
+                            fields[current[1]] = current[2].decode("utf-8", "replace")
+                        elif current[0] == "file":
+                            current[2].close()
+                            os.replace(result["path"] + ".part", result["path"])
+                            result.update(size=written, hash=current[3].hexdigest())
+                        current = None
+                elif isinstance(event, Epilogue):
+                    break
+                event = decoder.next_event()
+            if isinstance(event, Epilogue) or not block:
+                break
+        if result is None or "hash" not in result:
+            raise IngestError("No file part in request" if result is None else "Upload ended before the file was complete")
+    except Exception:
+        if current and current[0] == "file":
+            current[2].close()
+        if result and os.path.exists(result["path"] + ".part"):
+            os.remove(result["path"] + ".part")
+        raise
+
+    result["fields"] = fields
+    result["hash_type"] = INGEST_HASH
+    return result
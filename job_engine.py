@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+import traceback
+import uuid
+from typing import Callable, Dict, Optional
+from state_store import get_state
+from config import JOB_WORKERS, JOB_QUEUE_SIZE
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobEngine:
+    """Bounded in-process worker pool for upload jobs.
+
+    Jobs are plain callables run on long-lived worker threads, so uploads call
+    the uploader modules directly instead of spawning a Python per file. Every
+    state change is saved to the state database, so a job can still be looked
+    up after a restart; jobs a previous run never finished are marked failed.
+    Only queued and running jobs are kept in memory: a finished job is looked
+    up in the database, and stats() keeps a count of how each one ended.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._finished = {}  # Finished jobs per final status
+        self._lock = threading.Lock()
+        interrupted = get_state().interrupt_jobs()
+        if interrupted:
+            print(f"⚠️  {interrupted} job(s) from a previous run were interrupted")
+        self._workers = [threading.Thread(target=self._work, daemon=True, name=f"job-worker-{i}") for i in range(workers)]
+        for t in self._workers:
+            t.start()
+
+    def submit(self, fn: Callable, *args, name: Optional[str] = None, **kwargs) -> str:
+        """Queue fn(*args, **kwargs) and return its job id; raises JobQueueFull when the queue is at capacity"""
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "name": name or getattr(fn, '__name__', 'job'),
+            "status": "queued",
+            "result": None,
+            "error": None,
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        # Saved under the lock so a worker's first update can't be overwritten by this one
+        with self._lock:
+            try:
+                self._queue.put_nowait((job_id, fn, args, kwargs))
+            except queue.Full:
+                raise JobQueueFull(f"Job queue is full ({self._queue.maxsize} waiting)")
+            self._jobs[job_id] = job
+            get_state().save_job(job)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        return get_state().job(job_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._finished)
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {"workers": len(self._workers), "queued": self._queue.qsize(), "jobs": counts}
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            get_state().save_job(job)
+            if job["status"] in ("done", "failed"):
+                # Saved; get() reads it back from the database from now on
+                del self._jobs[job_id]
+                self._finished[job["status"]] = self._finished.get(job["status"], 0) + 1
+
+    def _work(self):
+        while True:
+            job_id, fn, args, kwargs = self._queue.get()
+            self._update(job_id, status="running", started_at=time.time())
+            try:
+                result = fn(*args, **kwargs)
+                self._update(job_id, status="done", result=result, finished_at=time.time())
+            except Exception as e:
+                traceback.print_exc()
+                self._update(job_id, status="failed", error=str(e), finished_at=time.time())
+            finally:
+                self._queue.task_done()
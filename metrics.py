@@ -0,0 +1,147 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import METRICS_ENABLED
+
+# Stage timings for the ingest pipeline, aggregated into histograms and
+# served by server.py at /metrics in the Prometheus text format. Stages:
+# probe, plan, cut, upload, task_create, indexing_wait, cleanup and job (a
+# whole server upload job). With METRICS_ENABLED off, span() hands back one
+# shared no-op context manager and observe_stage()/record_upload() return
+# straight away.
+
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+RATE_BUCKETS = (1e5, 5e5, 1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8, 1e9)
+
+_NOOP = nullcontext()
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label set"""
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...], label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def labels(self) -> List[Tuple[str, ...]]:
+        with self._lock:
+            return sorted(self._series)
+
+    def quantile(self, q: float, labels: Tuple[str, ...] = ()) -> Optional[float]:
+        """Estimate a quantile from the buckets by linear interpolation, as PromQL's histogram_quantile does"""
+        with self._lock:
+            counts = list(self._series.get(labels, ()))
+        total = sum(counts[:-1])
+        if not total:
+            return None
+        rank, cumulative = q * total, 0
+        for i, count in enumerate(counts[:-1]):
+            if cumulative + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]  # Beyond the last bound: all that is known
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {labels: list(counts) for labels, counts in self._series.items()}
+        for labels, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket{_labels(self.label_names, labels, le=le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {counts[-1]:g}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, labels: Tuple[str, ...] = ()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.label_names, labels)} {value:g}"
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], **extra) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+STAGE_SECONDS = Histogram("tl_stage_seconds", "Time spent in each ingest stage", STAGE_BUCKETS, ("stage", "outcome"))
+UPLOAD_RATE = Histogram("tl_upload_bytes_per_second", "Upload transfer rate per request", RATE_BUCKETS)
+UPLOAD_BYTES = Counter("tl_upload_bytes_total", "Bytes uploaded to the API")
+
+REGISTRY: Dict[str, object] = {m.name: m for m in (STAGE_SECONDS, UPLOAD_RATE, UPLOAD_BYTES)}
+
+
+@contextmanager
+def _timed(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_SECONDS.observe(time.perf_counter() - started, (stage, "error"))
+        raise
+    STAGE_SECONDS.observe(time.perf_counter() - started, (stage, "ok"))
+
+
+def span(stage: str):
+    """Time a block as one observation of the stage; failures are recorded with outcome=error"""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _timed(stage)
+
+
+def observe_stage(stage: str, seconds: float, outcome: str = "ok"):
+    """Record a stage duration measured elsewhere (e.g. a cut timed by its worker)"""
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, (stage, outcome))
+
+
+def record_upload(size: int, seconds: float):
+    """Count an upload's bytes and its transfer rate"""
+    if METRICS_ENABLED:
+        UPLOAD_BYTES.inc(size)
+        if seconds > 0:
+            UPLOAD_RATE.observe(size / seconds)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(line for metric in REGISTRY.values() for line in metric.render()) + "\n"
@@ -0,0 +1,170 @@
+import os
+import queue
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+from metrics import span
+from state_store import get_state
+from progress_store import get_store
+from indexing_poller import get_poller, wait_for_indexing
+from dedup import remember
+from config import PIPELINE_DEPTH
+
+_DONE = object()
+
+
+def chunk_slots(depth: int = PIPELINE_DEPTH, workers: int = 1) -> threading.BoundedSemaphore:
+    """Temp chunks allowed on disk at once, counting those still being cut: one per queue place and one per uploader"""
+    return threading.BoundedSemaphore(max(1, depth) + max(1, workers))
+
+
+def run_pipeline(chunks: Iterable[Dict], upload_fn: Callable[[Dict], object],
+                 depth: int = PIPELINE_DEPTH, workers: int = 1, slots: Optional[threading.BoundedSemaphore] = None,
+                 scope=None) -> List[Dict]:
+    """Upload chunks while later chunks are still being cut.
+
+    A producer thread pulls chunks from `chunks` into a queue bounded by
+    `depth`, so a lazy chunk generator stops cutting while uploads fall behind.
+    `workers` consumer threads pass each chunk to `upload_fn` and delete temp
+    chunks as soon as it returns. `slots` are the chunk_slots the splitter
+    takes before each cut; each temp chunk's slot is given back once it is
+    deleted. Temp chunks are deleted through `scope` (the job's TempScope) if
+    given, so it knows the space is free again. Each chunk gets a 0-based "position" in the order it came off
+    the splitter.
+
+    Returns one record per chunk, in source order, with the upload "result"
+    or the "error" raised by `upload_fn`. Errors from the chunk generator are
+    re-raised once the uploads already queued have finished.
+    """
+    workers = max(1, workers)
+    pending = queue.Queue(maxsize=max(1, depth))
+    results = []
+    results_lock = threading.Lock()
+    producer_errors = []
+
+    def produce():
+        try:
+            for position, chunk in enumerate(chunks):
+                chunk["position"] = position
+                pending.put(chunk)
+        except Exception as e:
+            producer_errors.append(e)
+        finally:
+            for _ in range(workers):
+                pending.put(_DONE)
+
+    def consume():
+        while True:
+            chunk = pending.get()
+            if chunk is _DONE:
+                return
+            result, error = None, None
+            try:
+                result = upload_fn(chunk)
+            except Exception as e:
+                error = e
+            finally:
+                if chunk.get("temp") and os.path.exists(chunk["path"]):
+                    with span("cleanup"):
+                        if scope:
+                            scope.remove(chunk["path"])
+                        else:
+                            os.remove(chunk["path"])
+                    print(f"🧹 Cleaned up: {chunk['path']}")
+                if chunk.get("temp") and slots:
+                    slots.release()
+            with results_lock:
+                results.append({**chunk, "result": result, "error": error})
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    threads += [threading.Thread(target=consume, daemon=True) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if producer_errors:
+        raise producer_errors[0]
+
+    return sorted(results, key=lambda r: r["start"])
+
+
+def build_result(filename: str, results: List[Dict], status: str, indexing: Optional[Dict[str, str]] = None) -> Dict:
+    """Structured outcome of one file's upload, as returned to the job engine"""
+    indexing = indexing or {}
+    chunks = [{
+        "index": r["position"] + 1,
+        "video_id": r["result"],
+        "start": r["start"],
+        "duration": r.get("duration"),
+        "size": r.get("size"),
+        "error": str(r["error"]) if r["error"] else None,
+        "indexing": indexing.get(r["result"]),
+    } for r in results]
+    video_ids = [c["video_id"] for c in chunks if c["video_id"]]
+    return {
+        "filename": filename,
+        "video_ids": video_ids,
+        "chunks": chunks,
+        "status": status,
+        "success": bool(chunks) and len(video_ids) == len(chunks),
+    }
+
+
+def save_result(result: Dict, content_hash: Optional[str] = None):
+    """Store a file's video IDs and chunk timeline in the state store, where the server and search look them up"""
+    if result["video_ids"]:
+        get_state().set_file(result["filename"], result["video_ids"], result["chunks"], content_hash)
+
+
+def accepted_upload(filename: str, source: Dict, results: List[Dict], chunked: bool) -> Dict:
+    """A file whose uploads have all been accepted, as plain JSON, so its indexing can be finished later or by another run
+
+    Keeps from each run_pipeline record what tracking, dedup and build_result
+    need; a chunk's "status_url" and known "indexing" status are set by the
+    uploader.
+    """
+    keep = ("position", "start", "duration", "size", "temp", "result", "cut_key", "hash", "status_url", "indexing")
+    chunks = [{**{k: r.get(k) for k in keep}, "error": str(r["error"]) if r["error"] else None} for r in results]
+    return {"filename": filename, "source": source, "chunked": chunked, "chunks": chunks}
+
+
+def track_upload(upload: Dict):
+    """Register an accepted upload's tasks with the shared indexing poller (again, after a restart)"""
+    poller = get_poller()
+    for c in upload["chunks"]:
+        if c["result"]:
+            poller.track(c["result"], c["duration"], c["status_url"], status=c["indexing"])
+
+
+def complete_upload(upload: Dict, indexing: Dict[str, str]) -> Dict:
+    """Record how an accepted upload's indexing ended and set its final status; returns its build_result"""
+    filename, chunks = upload["filename"], upload["chunks"]
+    ready = [vid for vid, status in indexing.items() if status in ["ready", "completed"]]
+    remember(upload["source"], filename, chunks, indexing)
+
+    # Final status, set once the video IDs and chunk timeline are stored
+    if len(ready) == len(chunks):
+        status = "Upload & Indexing successful"
+    else:
+        status = f"Partial success: {len(ready)}/{len(chunks)} {'chunks' if upload['chunked'] else 'file'} indexed"
+    result = build_result(filename, chunks, status, indexing)
+    save_result(result, upload["source"]["hash"])
+    get_store().set(filename, 100, status)
+    return result
+
+
+def finish_upload(upload: Dict) -> Dict:
+    """Wait for an accepted upload's indexing on the shared poller, then complete it
+
+    A file that was already indexed (upload["result"]) is returned as it is.
+    """
+    if "result" in upload:
+        return upload["result"]
+    filename = upload["filename"]
+
+    # One shared poller watches every task; we only wait on our own
+    def on_indexed(done, total):
+        get_store().set(filename, 99, f"Uploaded, waiting for indexing ({done}/{total} done)...")
+
+    indexing = wait_for_indexing([c["result"] for c in upload["chunks"] if c["result"]], on_indexed)
+    return complete_upload(upload, indexing)
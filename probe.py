@@ -0,0 +1,203 @@
+import os
+import json
+import hashlib
+import subprocess
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from metrics import span
+from config import PROBE_CACHE_SIZE, PROBE_CACHE_PERSIST, PROBE_CACHE_DIR, KEYFRAME_SAMPLE_INTERVAL
+
+# Probing is split in two so the common case stays cheap. probe() reads only
+# the container header (duration, bitrate, streams), which ffprobe gets
+# without touching the packets. keyframe_index() is only built for files
+# that have to be chunked: it seeks through the video stream's container
+# index every KEYFRAME_SAMPLE_INTERVAL seconds and reads one packet at each
+# stop, giving the keyframe times and byte offsets the planner cuts at.
+# Results are cached in memory (LRU) and optionally on disk, keyed by path,
+# size, mtime and inode, so a file is never probed twice while it is unchanged.
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+STREAM_FIELDS = ("index", "codec_type", "codec_name", "width", "height", "r_frame_rate", "bit_rate")
+CACHE_VERSION = 2  # Bumped when cached fields change meaning; older entries are re-probed
+
+
+def probe_key(path: str) -> str:
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}:{st.st_ino}"
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(PROBE_CACHE_DIR, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+
+def _load_from_disk(key: str) -> Optional[Dict]:
+    cache_file = _cache_path(key)
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, 'r') as f:
+            info = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return info if info.get("key") == key and info.get("version") == CACHE_VERSION else None
+
+
+def _save_to_disk(key: str, info: Dict):
+    """Write atomically; a failed write only costs a re-probe later"""
+    try:
+        os.makedirs(PROBE_CACHE_DIR, exist_ok=True)
+        cache_file = _cache_path(key)
+        tmp = cache_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp, cache_file)
+    except OSError as e:
+        print(f"⚠️  Could not persist probe result: {e}")
+
+
+def _fields(line: str) -> Tuple[str, Dict[str, str]]:
+    """Parse one line of ffprobe's compact output: section|key=value|..."""
+    section, _, rest = line.rstrip("\n").partition("|")
+    return section, dict(item.split("=", 1) for item in rest.split("|") if "=" in item)
+
+
+def _number(value: Optional[str], cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def run_ffprobe(path: str) -> Dict:
+    """Probe format and streams from the container header"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration,bit_rate,size:stream=" + ",".join(STREAM_FIELDS),
+        "-of", "json",
+        path
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, cmd, stderr=result.stderr)
+    data = json.loads(result.stdout)
+    fmt = data.get("format", {})
+
+    duration = _number(fmt.get("duration"))
+    if duration is None:
+        raise ValueError(f"ffprobe reported no duration for {path}: {result.stderr.strip()}")
+    size = _number(fmt.get("size"), int) or os.path.getsize(path)
+    bitrate = _number(fmt.get("bit_rate"), int)
+    if not bitrate:
+        # Estimate bitrate from file size
+        bitrate = int((size * 8) / duration)  # bits per second
+
+    streams = [{k: s.get(k) for k in STREAM_FIELDS} for s in data.get("streams", [])]
+    for s in streams:
+        for k in ("index", "width", "height", "bit_rate"):
+            s[k] = _number(s[k], int)
+    video = next((s for s in streams if s["codec_type"] == "video"), None)
+
+    return {
+        "duration": duration,
+        "bit_rate": bitrate,
+        "size": size,
+        "streams": streams,
+        "video_stream": video["index"] if video else None,
+    }
+
+
+def run_keyframe_probe(path: str, duration: float, interval: float = KEYFRAME_SAMPLE_INTERVAL) -> List[List[float]]:
+    """Sample the video stream's keyframes as [time, byte offset] pairs.
+
+    Each read interval seeks to a target time, which lands on the keyframe at
+    or before it via the container index, and reads a single packet, so the
+    cost grows with the number of samples rather than the file size.
+    """
+    targets = [i * interval for i in range(int(duration // interval) + 1)]
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-read_intervals", ",".join(f"{t:.3f}%+#1" for t in targets),
+        "-show_entries", "packet=pts_time,dts_time,pos,flags",
+        "-of", "compact=p=1:nk=0",
+        path
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, cmd, stderr=result.stderr)
+
+    keyframes = {}
+    for line in result.stdout.splitlines():
+        section, values = _fields(line)
+        if section != "packet" or "K" not in values.get("flags", ""):
+            continue
+        t = _number(values.get("pts_time"))
+        if t is None:
+            t = _number(values.get("dts_time"))
+        pos = _number(values.get("pos"), int)
+        if t is not None and pos is not None:
+            # Neighbouring targets inside one GOP land on the same keyframe
+            keyframes[t] = pos
+    return [[t, pos] for t, pos in sorted(keyframes.items())]
+
+
+def probe_header(path: str) -> Optional[Dict]:
+    """Read duration and streams from the start of a file that may still be arriving (None if not readable yet)"""
+    result = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration:stream=" + ",".join(STREAM_FIELDS),
+        "-of", "json",
+        path
+    ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        return None  # e.g. an MP4 whose moov atom is at the end
+    data = json.loads(result.stdout)
+    return {"duration": _number(data.get("format", {}).get("duration")), "streams": data.get("streams", [])}
+
+
+def probe(path: str) -> Dict:
+    """Probe a file once per version; later calls are served from the cache"""
+    key = probe_key(path)
+    with _cache_lock:
+        info = _cache.get(key)
+        if info is not None:
+            _cache.move_to_end(key)
+            return info
+
+    info = _load_from_disk(key) if PROBE_CACHE_PERSIST else None
+    if info is None:
+        with span("probe"):
+            info = run_ffprobe(path)
+        info["key"], info["version"] = key, CACHE_VERSION
+        if PROBE_CACHE_PERSIST:
+            _save_to_disk(key, info)
+
+    with _cache_lock:
+        _cache[key] = info
+        _cache.move_to_end(key)
+        while len(_cache) > PROBE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
+
+
+def keyframe_index(path: str) -> List[List[float]]:
+    """Sampled keyframes of the file's video stream (empty if it has none), built on first use and cached with the probe"""
+    info = probe(path)
+    if "keyframes" not in info:
+        keyframes = []
+        if info["video_stream"] is not None:
+            with span("keyframe_index"):
+                keyframes = run_keyframe_probe(path, info["duration"])
+        info["keyframes"] = keyframes
+        if PROBE_CACHE_PERSIST:
+            _save_to_disk(info["key"], info)
+    return info["keyframes"]
+
+
+def get_video_info(path: str) -> Tuple[float, int]:
+    """Get video duration and bitrate"""
+    info = probe(path)
+    return info["duration"], info["bit_rate"]
@@ -0,0 +1,185 @@
+import atexit
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from state_store import get_state
+from config import PROGRESS_FLUSH_INTERVAL, PROGRESS_POLL_INTERVAL
+
+NO_PROGRESS = {"progress": 0, "status": "No progress information"}
+FORGET_AFTER = 300  # Seconds
+
+
+class ProgressStore:
+    """Per-file progress kept in memory and persisted to the state database.
+
+    Updates are O(1) dict writes; a background thread writes only the latest
+    state of each changed file every PROGRESS_FLUSH_INTERVAL seconds, in one
+    transaction, so a burst of upload callbacks costs one row write. Reads of
+    written states go through a cache that is refreshed from the database at
+    most once per PROGRESS_POLL_INTERVAL per file, so progress written by
+    another process (a CLI upload, a batch run) shows up within one interval
+    while polling clients, advance() calls and waiters share a single query.
+
+    Every change bumps a version number, and wait_for_change lets any number of
+    subscribers block on one file until it moves past the version they last saw.
+    Each file has its own condition, so a change only wakes that file's watchers.
+    Other processes can't wake them, so waiters also wake whenever the cached
+    state is due for a refresh; a refreshed state that differs from the cached
+    one counts as a change. Files nobody has looked at for FORGET_AFTER seconds
+    are dropped from memory.
+    """
+
+    def __init__(self, flush_interval: float = PROGRESS_FLUSH_INTERVAL, poll_interval: float = PROGRESS_POLL_INTERVAL):
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self._data = {}  # States not yet written to the database
+        self._cache = {}  # Last state this process wrote or read, and when, per file
+        self._versions = {}
+        self._version = 0
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._conditions = {}
+        self._waiting = {}  # Waiters per file
+        self._used = {}  # When each file was last read or written here
+        self._io_lock = threading.Lock()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name="progress-flusher")
+        self._flusher.start()
+
+    def _state(self, filename: str) -> Dict:
+        """Unwritten in-memory state, else the cached persisted one; the caller holds the lock"""
+        now = time.monotonic()
+        self._used[filename] = now
+        state = self._data.get(filename)
+        if state is None:
+            cached = self._cache.get(filename)
+            if cached and now - cached[1] < self.poll_interval:
+                return dict(cached[0])
+            state = get_state().progress(filename) or NO_PROGRESS
+            if cached and cached[0] != state:
+                # Written by another process since this one last saw it
+                self._bump(filename)
+            self._cache[filename] = (state, now)
+        return dict(state)
+
+    def _refresh_due(self, filename: str) -> float:
+        """Seconds until _state would re-read the file from the database; the caller holds the lock"""
+        cached = self._cache.get(filename)
+        if filename in self._data or not cached:
+            return self.poll_interval
+        return max(cached[1] + self.poll_interval - time.monotonic(), 0.01)
+
+    def get(self, filename: str) -> Dict:
+        with self._lock:
+            return self._state(filename)
+
+    def get_versioned(self, filename: str) -> Tuple[int, Dict]:
+        with self._lock:
+            state = self._state(filename)
+            return self._versions.get(filename, 0), state
+
+    def wait_for_change(self, filename: str, since: int, timeout: float) -> Tuple[int, Dict]:
+        """Block until the file's version exceeds `since` or the timeout passes; returns (version, state)"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            cond = self._conditions.setdefault(filename, threading.Condition(self._lock))
+            self._waiting[filename] = self._waiting.get(filename, 0) + 1
+            try:
+                state = self._state(filename)
+                while self._versions.get(filename, 0) <= since:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    cond.wait(min(remaining, self._refresh_due(filename)))
+                    state = self._state(filename)
+            finally:
+                self._waiting[filename] -= 1
+                if not self._waiting[filename]:
+                    del self._waiting[filename]
+                    del self._conditions[filename]
+            return self._versions.get(filename, 0), state
+
+    def _bump(self, filename: str):
+        """Give the file a new version and wake its watchers; the caller holds the lock"""
+        self._version += 1
+        self._versions[filename] = self._version
+        cond = self._conditions.get(filename)
+        if cond:
+            cond.notify_all()
+
+    def _changed(self, filename: str, state: Dict):
+        """Record a change made here; the caller holds the lock"""
+        now = time.monotonic()
+        self._data[filename] = state
+        self._cache[filename] = (state, now)
+        self._used[filename] = now
+        self._dirty.add(filename)
+        self._bump(filename)
+
+    def set(self, filename: str, progress: int, status: str):
+        state = {"progress": progress, "status": status}
+        with self._lock:
+            if self._data.get(filename) != state:
+                self._changed(filename, state)
+        # Final states are worth a write right away; everything else is coalesced
+        if progress >= 100:
+            self.flush()
+
+    def advance(self, filename: str, progress: int, status: str):
+        """Like set, but never moves the bar backwards (concurrent chunk uploads report out of order)"""
+        with self._lock:
+            current = self._state(filename)
+            state = {"progress": max(current["progress"], progress), "status": status}
+            if current != state:
+                self._changed(filename, state)
+
+    def flush(self):
+        """Write the latest state of every changed file to the database"""
+        with self._io_lock:
+            with self._lock:
+                states = {k: self._data[k] for k in self._dirty}
+                self._dirty.clear()
+            if not states:
+                return
+            try:
+                get_state().set_progress(states)
+            except Exception:
+                with self._lock:
+                    self._dirty.update(k for k, state in states.items() if self._data.get(k) is state)
+                raise
+            with self._lock:
+                # Written: from now on the database has them, unless they changed again meanwhile
+                for k, state in states.items():
+                    if self._data.get(k) is state:
+                        del self._data[k]
+
+    def _forget_idle(self):
+        """Drop what is kept about files nobody has read or written for FORGET_AFTER seconds"""
+        cutoff = time.monotonic() - FORGET_AFTER
+        with self._lock:
+            for k in [k for k, used in self._used.items() if used < cutoff and k not in self._data and k not in self._waiting]:
+                del self._used[k]
+                self._cache.pop(k, None)
+                self._versions.pop(k, None)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                self._forget_idle()
+            except Exception as e:
+                print(f"⚠️  Failed to persist progress: {e}")
+
+
+_store: Optional[ProgressStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ProgressStore:
+    """The process-wide progress store, created on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ProgressStore()
+            atexit.register(_store.flush)
+        return _store
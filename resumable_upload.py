@@ -0,0 +1,218 @@
+import os
+import json
+import base64
+import hashlib
+from typing import Callable, Dict, List, Optional
+from http_pool import get_session, with_backoff, request_with_backoff
+from metrics import span
+from config import API_KEY, INDEX_ID, API_BASE, UPLOAD_JOURNAL_DIR, INGEST_HASH
+
+# Resumable uploads follow the TwelveLabs multipart upload flow: create an
+# upload session, PUT each fixed-size part to its presigned URL, report the
+# part's ETag, then index the finished asset. The journal records every part
+# the server has acknowledged so an interrupted upload (or a restarted
+# process) picks up from the last acknowledged part instead of byte zero.
+# A journal is deleted once its asset has been handed over for indexing.
+
+
+class UploadError(Exception):
+    pass
+
+
+def _headers() -> Dict[str, str]:
+    return {"x-api-key": API_KEY}
+
+
+def file_key(path: str) -> str:
+    """Identity of one version of a file (path, size and mtime)"""
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def chunk_key(source_path: str, chunk: Dict) -> Optional[str]:
+    """Journal key for a temp chunk: its source file plus time range (None for the source itself)"""
+    if not chunk.get("temp"):
+        return None
+    return f"{file_key(source_path)}:{chunk['start']:.3f}:{chunk['duration']:.3f}"
+
+
+def _journal_path(key: str) -> str:
+    return os.path.join(UPLOAD_JOURNAL_DIR, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+
+def load_journal(key: str) -> Optional[Dict]:
+    journal_file = _journal_path(key)
+    if not os.path.exists(journal_file):
+        return None
+    with open(journal_file, 'r') as f:
+        return json.load(f)
+
+
+def save_journal(key: str, journal: Dict):
+    """Write the journal atomically so a crash never leaves it half-written"""
+    os.makedirs(UPLOAD_JOURNAL_DIR, exist_ok=True)
+    journal_file = _journal_path(key)
+    tmp = journal_file + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(journal, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, journal_file)
+
+
+def discard_journal(key: str):
+    journal_file = _journal_path(key)
+    if os.path.exists(journal_file):
+        os.remove(journal_file)
+
+
+def _check(res, action: str) -> Dict:
+    if res.status_code not in [200, 201]:
+        raise UploadError(f"{action} failed: {res.status_code} - {res.text}")
+    return res.json() if res.content else {}
+
+
+def create_session(path: str) -> Dict:
+    """Start a multipart upload and return a fresh journal for it"""
+    res = request_with_backoff("POST", f"{API_BASE}/assets/multipart-uploads", headers=_headers(), json={
+        "filename": os.path.basename(path),
+        "type": "video",
+        "total_size": os.path.getsize(path),
+    })
+    data = _check(res, "Creating upload session")
+    return {
+        "path": os.path.abspath(path),
+        "upload_id": data["upload_id"],
+        "asset_id": data.get("asset_id"),
+        "chunk_size": int(data["chunk_size"]),
+        "total_chunks": int(data["total_chunks"]),
+        "total_size": os.path.getsize(path),
+        "urls": {str(u["chunk_index"]): u["url"] for u in data.get("upload_urls", [])},
+        "parts": {},
+    }
+
+
+def server_acknowledged(upload_id: str) -> Dict[str, Dict]:
+    """Parts the server already has, keyed by chunk index"""
+    res = request_with_backoff("GET", f"{API_BASE}/assets/multipart-uploads/{upload_id}", headers=_headers())
+    data = _check(res, "Checking upload status")
+    return {str(c["chunk_index"]): c for c in data.get("chunks", []) if c.get("status") == "completed"}
+
+
+def refresh_urls(journal: Dict, indexes: List[int]):
+    """Presigned part URLs expire, so fetch new ones for the parts still to send"""
+    if not indexes:
+        return
+    res = request_with_backoff("POST", f"{API_BASE}/assets/multipart-uploads/{journal['upload_id']}/presigned-urls",
+                               headers=_headers(), json={"start": min(indexes), "count": max(indexes) - min(indexes) + 1})
+    data = _check(res, "Refreshing part URLs")
+    journal["urls"].update({str(u["chunk_index"]): u["url"] for u in data.get("upload_urls", [])})
+
+
+def read_part(path: str, journal: Dict, index: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek((index - 1) * journal["chunk_size"])
+        return f.read(journal["chunk_size"])
+
+
+def upload_part(path: str, journal: Dict, index: int, hasher=None) -> Dict:
+    """PUT one part with a Content-MD5 checksum and return its journal record; hasher, if given, is fed the part"""
+    data = read_part(path, journal, index)
+    if hasher:
+        hasher.update(data)
+    md5 = hashlib.md5(data).digest()
+    url = journal["urls"][str(index)]
+    headers = {"Content-MD5": base64.b64encode(md5).decode()}
+
+    res = with_backoff(lambda: get_session().put(url, data=data, headers=headers), url)
+    if res.status_code not in [200, 201]:
+        raise UploadError(f"Part {index} upload failed: {res.status_code} - {res.text}")
+
+    etag = res.headers.get("ETag", "").strip('"')
+    return {"chunk_index": index, "proof": etag, "proof_type": "etag", "chunk_size": len(data), "md5": md5.hex()}
+
+
+def report_parts(journal: Dict, parts: List[Dict]):
+    res = request_with_backoff("POST", f"{API_BASE}/assets/multipart-uploads/{journal['upload_id']}", headers=_headers(), json={
+        "completed_chunks": [{k: p[k] for k in ("chunk_index", "proof", "proof_type", "chunk_size")} for p in parts]
+    })
+    _check(res, "Reporting uploaded parts")
+
+
+def index_asset(journal: Dict) -> str:
+    with span("task_create"):
+        res = request_with_backoff("POST", f"{API_BASE}/indexes/{INDEX_ID}/indexed-assets", headers=_headers(),
+                                   json={"asset_id": journal["asset_id"]})
+    data = _check(res, "Indexing uploaded asset")
+    return data.get("_id") or data.get("id")
+
+
+def indexing_status_url(video_id: str) -> str:
+    return f"{API_BASE}/indexes/{INDEX_ID}/indexed-assets/{video_id}"
+
+
+def _matches_local(path: str, journal: Dict) -> bool:
+    """Check acknowledged parts against the local bytes, e.g. after a chunk was re-cut"""
+    if journal.get("total_size") != os.path.getsize(path):
+        return False
+    return all(hashlib.md5(read_part(path, journal, int(i))).hexdigest() == p["md5"]
+               for i, p in journal["parts"].items())
+
+
+def upload_resumable(path: str, on_progress: Optional[Callable[[int, int], None]] = None,
+                     journal_key: Optional[str] = None, on_digest: Optional[Callable[[str], None]] = None) -> str:
+    """Upload a file in fixed-size parts, resuming from the journal if one exists, and return its video_id.
+
+    journal_key defaults to the file's path/size/mtime. Temp chunks pass a key
+    derived from their source and time range instead, so a chunk re-cut after a
+    restart still finds its journal. on_digest gets the file's INGEST_HASH,
+    taken from the parts as they are sent, if this call sent all of them.
+    """
+    total_size = os.path.getsize(path)
+    key = journal_key or file_key(path)
+    journal = load_journal(key)
+
+    if journal and journal.get("video_id"):
+        # Left by an earlier version, which kept journals after indexing
+        print(f"♻️  Already uploaded and indexed: {journal['video_id']}")
+        discard_journal(key)
+        return journal["video_id"]
+
+    if journal and not _matches_local(path, journal):
+        print(f"⚠️  Local file no longer matches upload {journal['upload_id']}, starting over")
+        discard_journal(key)
+        journal = None
+
+    if journal:
+        # The server is the source of truth for which parts landed
+        acknowledged = server_acknowledged(journal["upload_id"])
+        journal["parts"] = {i: p for i, p in journal["parts"].items() if i in acknowledged}
+        print(f"♻️  Resuming upload {journal['upload_id']}: {len(journal['parts'])}/{journal['total_chunks']} parts already acknowledged")
+        remaining = [i for i in range(1, journal["total_chunks"] + 1) if str(i) not in journal["parts"]]
+        refresh_urls(journal, remaining)
+    else:
+        journal = create_session(path)
+        remaining = list(range(1, journal["total_chunks"] + 1))
+        missing_urls = [i for i in remaining if str(i) not in journal["urls"]]
+        refresh_urls(journal, missing_urls)
+    save_journal(key, journal)
+
+    done_bytes = sum(p["chunk_size"] for p in journal["parts"].values())
+    hasher = hashlib.new(INGEST_HASH) if on_digest and not journal["parts"] else None
+    for index in remaining:
+        part = upload_part(path, journal, index, hasher)
+        report_parts(journal, [part])
+
+        # Only journal a part once the server has acknowledged it
+        journal["parts"][str(index)] = part
+        save_journal(key, journal)
+
+        done_bytes += part["chunk_size"]
+        if on_progress:
+            on_progress(done_bytes, total_size)
+
+    video_id = index_asset(journal)
+    discard_journal(key)
+    if hasher:
+        on_digest(hasher.hexdigest())
+    return video_id
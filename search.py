@@ -0,0 +1,255 @@
+import json
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+from http_pool import request_with_backoff
+from config import (
+    API_KEY, INDEX_ID, API_BASE,
+    SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_PAGE_LIMIT, SEARCH_MAX_RESULTS,
+    SEARCH_WORKERS, SEARCH_TOP_K, SEARCH_MERGE_GAP
+)
+
+
+class SearchError(Exception):
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+CONFIDENCE_LEVELS = {'high': 0.9, 'medium': 0.5, 'low': 0.1}
+
+
+def confidence_value(item: Dict) -> float:
+    """Numeric confidence for ranking; the API reports either a score or a level"""
+    conf = item.get('confidence', 0)
+    if isinstance(conf, str):
+        return CONFIDENCE_LEVELS.get(conf.lower(), 0)
+    return float(conf)
+
+
+def to_source_timecodes(hits: List[Dict], chunks: Optional[List[Dict]], merge_gap: float = SEARCH_MERGE_GAP) -> List[Dict]:
+    """Shift chunk-relative hits to source timecodes and merge the ones that overlap.
+
+    A hit at the end of one chunk and one at the start of the next are the
+    same moment in the source, so after shifting, hits are sorted by start and
+    any that overlap (or are within merge_gap seconds) are merged, keeping the
+    best confidence. Hits from videos not in the timeline keep their times.
+    """
+    by_video = {c["video_id"]: c for c in chunks or []}
+    shifted = []
+    for hit in hits:
+        chunk = by_video.get(hit.get("video_id"))
+        offset = float(chunk["start"] or 0) if chunk else 0.0
+        shifted.append({
+            **hit,
+            "start": float(hit.get("start", 0)) + offset,
+            "end": float(hit.get("end", 0)) + offset,
+            "chunks": [chunk["index"]] if chunk else [],
+        })
+
+    shifted.sort(key=lambda h: (h["start"], h["end"]))
+    merged = []
+    for hit in shifted:
+        last = merged[-1] if merged else None
+        if last and hit["start"] <= last["end"] + merge_gap:
+            last["end"] = max(last["end"], hit["end"])
+            if confidence_value(hit) > confidence_value(last):
+                last["confidence"] = hit["confidence"]
+            last["chunks"] += [i for i in hit["chunks"] if i not in last["chunks"]]
+        else:
+            merged.append(hit)
+    return merged
+
+
+def _clip(clip: Dict) -> Dict:
+    return {
+        "video_id": clip.get('video_id'),
+        "start": clip.get('start', 0),
+        "end": clip.get('end', 0),
+        "confidence": clip.get('confidence', clip.get('score', 0))
+    }
+
+
+def _check(res) -> Dict:
+    print(f"Search response: {res.status_code}")
+    if res.status_code != 200:
+        print(f"Response body: {res.text}")
+        raise SearchError(f"API error: {res.status_code} - {res.text}", res.status_code)
+    try:
+        return res.json()
+    except json.JSONDecodeError:
+        print(f"Failed to parse JSON response: {res.text[:200]}")
+        raise SearchError("Invalid JSON response from API")
+
+
+def iter_search_clips(query: str, search_options: List[str], video_ids: List[str]) -> Iterator[Dict]:
+    """Yield matching clips page by page; the next page is only requested when the caller wants more.
+
+    The video-ID filter is sent to the API, so every page holds matches for
+    these videos rather than the top of the whole index.
+    """
+    headers = {"x-api-key": API_KEY}
+
+    # Multipart form: repeated search_options fields carry the array
+    data = [
+        ("index_id", INDEX_ID),
+        ("query_text", query),
+        ("page_limit", str(SEARCH_PAGE_LIMIT)),
+        ("operator", "or"),
+        ("sort_option", "score"),
+        ("filter", json.dumps({"id": list(video_ids)})),
+    ]
+    data += [("search_options", option) for option in search_options]
+
+    print(f"Search request: {API_BASE}/search, options={search_options}, videos={len(video_ids)}")
+    res = request_with_backoff("POST", f"{API_BASE}/search", headers=headers, data=data,
+                               files={"dummy": (None, "")})  # Force multipart encoding
+    page = _check(res)
+
+    while True:
+        for clip in page.get('data', []):
+            # The API already filtered; this only guards against a filter it ignored
+            if clip.get('video_id') in video_ids:
+                yield _clip(clip)
+        token = page.get('page_info', {}).get('next_page_token')
+        if not token:
+            return
+        res = request_with_backoff("GET", f"{API_BASE}/search/{token}", headers=headers)
+        page = _check(res)
+
+
+def run_search(query: str, search_options: List[str], video_ids: List[str],
+               max_results: int = SEARCH_MAX_RESULTS) -> List[Dict]:
+    """Search the given videos and return up to max_results clips, best first"""
+    results = list(islice(iter_search_clips(query, search_options, video_ids), max_results))
+    print(f"Results for our videos: {len(results)}")
+    return results
+
+
+def cached_search(cache: "SearchCache", filename: str, query: str, search_options: List[str],
+                  video_ids: List[str]) -> List[Dict]:
+    """run_search through the cache"""
+    key = cache.key(query, search_options, video_ids)
+    results = cache.get(key)
+    if results is None:
+        results = run_search(query, search_options, video_ids)
+        cache.put(key, results, filename)
+    return results
+
+
+def search_files(query: str, search_options: List[str], files: Dict[str, List[str]], cache: "SearchCache",
+                 top_k: int = SEARCH_TOP_K, workers: int = SEARCH_WORKERS,
+                 timelines: Optional[Dict[str, List[Dict]]] = None) -> Iterator[Dict]:
+    """Search many files at once, yielding each file's outcome as it arrives and then the merged top_k.
+
+    With timelines (filename -> chunk timeline), hits are reported in source
+    timecodes, merged across chunk boundaries.
+
+    Searches run on a bounded thread pool over the shared keep-alive
+    sessions (http_pool also caps requests per host). A min-heap of size
+    top_k keeps the best clips across all files without sorting everything.
+    """
+    top = []  # (confidence, seq, clip): smallest of the current top_k first
+    seq = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(cached_search, cache, filename, query, search_options, ids): filename
+                   for filename, ids in files.items()}
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                yield {"type": "error", "filename": filename, "error": str(e)}
+                continue
+            if timelines is not None:
+                results = to_source_timecodes(results, timelines.get(filename))
+            for clip in results:
+                seq += 1
+                entry = (confidence_value(clip), seq, {"filename": filename, **clip})
+                if len(top) < top_k:
+                    heapq.heappush(top, entry)
+                elif entry[0] > top[0][0]:
+                    heapq.heapreplace(top, entry)
+            best = max(results, key=confidence_value, default=None)
+            yield {"type": "file", "filename": filename, "matches": len(results), "best": best}
+    yield {"type": "top", "results": [clip for _, _, clip in sorted(top, key=lambda e: (-e[0], e[1]))]}
+
+
+class SearchCache:
+    """LRU cache of search results with a TTL, invalidated per file.
+
+    Keys cover everything that changes the answer: index, query text, search
+    options (order-insensitive) and the set of video IDs searched. Each entry
+    is tagged with the file it was searched for, so a change to that file's
+    video IDs drops its entries.
+    """
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_file = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def key(query: str, search_options: Iterable[str], video_ids: Iterable[str], index_id: str = INDEX_ID) -> Tuple:
+        return index_id, query, tuple(sorted(search_options)), frozenset(video_ids)
+
+    def get(self, key: Hashable) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            results, filename, expires = entry
+            if time.monotonic() >= expires:
+                self._drop(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return list(results)
+
+    def put(self, key: Hashable, results: List[Dict], filename: str):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (results, filename, time.monotonic() + self.ttl)
+            self._by_file.setdefault(filename, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def invalidate(self, filename: str):
+        """Forget every cached search for a file (its video IDs changed)"""
+        with self._lock:
+            keys = self._by_file.pop(filename, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            self._stats["invalidations"] += len(keys)
+
+    def _drop(self, key: Hashable):
+        """Remove one entry; the caller holds the lock"""
+        _, filename, _ = self._entries.pop(key)
+        keys = self._by_file.get(filename)
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self._by_file[filename]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            }
@@ -1,18 +1,28 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
 import shutil
-import subprocess
-import threading
 import uuid
 import json
+import hashlib
 import time
-import requests
 from twelvelabs import TwelveLabs
+import uploader_sdk
+import uploader_API
+from job_engine import JobEngine, JobQueueFull
+from progress_store import get_store
+from ingest import stream_multipart, IngestError
+from probe import probe_header
+from dedup import source_info, reuse_existing
+from pipeline import save_result, finish_upload
+from search import SearchCache, SearchError, cached_search, search_files, confidence_value, to_source_timecodes
+from state_store import get_state
+from temp_space import InsufficientSpace, get_temp_space, projected_need, projected_total
+import metrics
 from config import (
-    API_KEY, INDEX_ID, API_BASE, 
-    UPLOAD_FOLDER, PROGRESS_FILE, VIDEO_ID_MAP,
-    SERVER_PORT, DEBUG_MODE
+    API_KEY, UPLOAD_FOLDER,
+    SERVER_PORT, DEBUG_MODE, PROGRESS_LONG_POLL_TIMEOUT, PROGRESS_KEEPALIVE_INTERVAL, SEARCH_TOP_K,
+    VIDEOS_PAGE_SIZE, VIDEOS_PAGE_MAX, TEMP_ADMIT_POLL
 )
 
 app = Flask(__name__)
@@ -23,73 +33,62 @@ sdk_client = TwelveLabs(api_key=API_KEY)
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Load or initialize progress
-if os.path.exists(PROGRESS_FILE):
-    with open(PROGRESS_FILE, 'r') as f:
-        progress = json.load(f)
-else:
-    progress = {}
-
-# Load or initialize video ID map
-if os.path.exists(VIDEO_ID_MAP):
-    with open(VIDEO_ID_MAP, 'r') as f:
-        video_id_map = json.load(f)
-else:
-    video_id_map = {}
-
-def save_progress():
-    with open(PROGRESS_FILE, 'w') as f:
-        json.dump(progress, f)
-
-def save_video_id_map():
-    with open(VIDEO_ID_MAP, 'w') as f:
-        json.dump(video_id_map, f)
-
-def run_script(filepath, filename, method='sdk'):
+# Uploads run in-process on a bounded worker pool
+job_engine = JobEngine()
+
+# Progress is shared in memory with the in-process uploaders
+progress_store = get_store()
+
+# Recent search results, dropped when a file's video IDs change
+search_cache = SearchCache()
+
+# Video IDs and chunk timelines, written by every uploader (in-process, CLI and batch) when a file finishes
+state_store = get_state()
+
+# Uploaded files and chunk directories, deleted with their job; orphans from earlier runs are swept now
+temp_space = get_temp_space()
+
+
+def run_job(filepath, filename, method='sdk', content_hash=None, temp=None):
+    """Upload one file in-process with the chosen uploader and record its video IDs; temp (the upload's scope) is closed once the uploads are accepted"""
     try:
         # Update progress at start
-        progress[filename] = {"progress": 0, "status": "Initializing..."}
-        save_progress()
+        progress_store.set(filename, 0, "Initializing...")
         
-        # Choose the right script
-        script_name = 'uploader_sdk.py' if method == 'sdk' else 'uploader_API.py'
-        cmd = ['python3', script_name, filepath]
+        # Choose the right uploader
+        uploader = uploader_sdk if method == 'sdk' else uploader_API
+        print(f"Running {uploader.__name__}.upload_video({filepath!r})")
         
-        print(f"Running command: {' '.join(cmd)}")
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        print(f"STDOUT:\n{result.stdout}")
-        print(f"STDERR:\n{result.stderr}")
-        
-        # Look for video_id(s) in stdout - can be multiple for chunked videos
-        video_ids = []
-        for line in result.stdout.splitlines():
-            if 'video_id=' in line:
-                video_id = line.split('video_id=')[1].strip()
-                video_ids.append(video_id)
+        with metrics.span("job"):
+            upload = uploader.upload_video(filepath, filename, content_hash, temp)
+            # Every upload is accepted: the server's copy and the chunk directory can go before the (long) indexing wait
+            if temp:
+                temp.close()
+            result = finish_upload(upload)
+        video_ids = result["video_ids"]
 
         if video_ids:
-            # Store all video IDs associated with this original file
-            video_id_map[filename] = video_ids
-            save_video_id_map()
+            # The uploader stored the video IDs and chunk timeline; searches cached for the old ones are stale
+            search_cache.invalidate(filename)
             print(f"Stored {len(video_ids)} video IDs for {filename}")
             
             # Check final progress status
-            if filename not in progress or progress[filename].get('progress', 0) < 100:
-                progress[filename] = {"progress": 100, "status": "Upload & Indexing successful"}
-                save_progress()
-        elif result.returncode == 0:
-            progress[filename] = {"progress": 100, "status": "Processing completed"}
-            save_progress()
+            if progress_store.get(filename)['progress'] < 100:
+                progress_store.set(filename, 100, "Upload & Indexing successful")
         else:
-            error_msg = result.stderr or 'Unknown error'
-            progress[filename] = {"progress": 100, "status": f"Failed: {error_msg}"}
-            save_progress()
+            errors = [c["error"] for c in result["chunks"] if c["error"]]
+            error_msg = errors[0] if errors else 'Unknown error'
+            progress_store.set(filename, 100, f"Failed: {error_msg}")
+        
+        return result
 
     except Exception as e:
-        print(f"❌ Script failed: {e}")
-        progress[filename] = {"progress": 100, "status": f"Failed: {str(e)}"}
-        save_progress()
+        print(f"❌ Upload job failed: {e}")
+        progress_store.set(filename, 100, f"Failed: {str(e)}")
+        raise
+    finally:
+        if temp:
+            temp.close()
 
 @app.route('/')
 def serve_index():
@@ -98,48 +97,128 @@ def serve_index():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    scope = None
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file part in request'}), 400
+        # Admit the upload only if its copy and its chunks will fit on disk
+        try:
+            size = request.content_length or 0
+            scope = temp_space.scope("upload", projected_need(size, includes_source=True),
+                                     total=projected_total(size, includes_source=True))
+        except InsufficientSpace as e:
+            headers = {'Retry-After': str(int(TEMP_ADMIT_POLL))} if e.retryable else {}
+            return jsonify({'error': str(e)}), 507, headers
         
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+        # Stream the body straight to its final path instead of spooling it first
+        try:
+            upload = stream_multipart(request.stream, request.content_type or '', UPLOAD_FOLDER, on_header=report_header)
+        except IngestError as e:
+            return jsonify({'error': str(e)}), 400
         
-        filename = file.filename
-        temp_path = os.path.join(UPLOAD_FOLDER, filename)
-        
-        # Save the file
-        file.save(temp_path)
+        filename = upload["filename"]
+        temp_path = upload["path"]
+        scope.owner = filename
+        scope.add(temp_path)
         
         # Get method (sdk or api)
-        method = request.form.get('method', 'sdk')
+        method = upload["fields"].get('method', 'sdk')
+        
+        # Same content already indexed (under any name): answer right away
+        existing = reuse_existing(filename, temp_path, source_info(temp_path, upload["hash"]))
+        if existing:
+            save_result(existing, upload["hash"])
+            search_cache.invalidate(filename)
+            progress_store.set(filename, 100, existing["status"])
+            return jsonify({"message": "Already indexed", "filename": filename, "video_ids": existing["video_ids"],
+                            "duplicate_of": existing["duplicate_of"], "size": upload["size"], upload["hash_type"]: upload["hash"]})
         
         # Initialize progress
-        progress[filename] = {"progress": 0, "status": "Upload received, starting processing..."}
-        save_progress()
+        progress_store.set(filename, 0, "Upload received, starting processing...")
         
-        # Start processing in background thread
-        thread = threading.Thread(target=run_script, args=(temp_path, filename, method))
-        thread.start()
+        # Queue processing on the in-process job engine
+        try:
+            job_id = job_engine.submit(run_job, temp_path, filename, method, upload["hash"], scope, name=filename)
+        except JobQueueFull as e:
+            progress_store.set(filename, 100, f"Failed: {e}")
+            return jsonify({'error': str(e)}), 503
+        scope = None  # The job deletes the upload once it is done with it
         
-        return jsonify({"message": "Upload started", "filename": filename})
+        return jsonify({"message": "Upload started", "filename": filename, "job_id": job_id,
+                        "size": upload["size"], upload["hash_type"]: upload["hash"]})
         
     except Exception as e:
         print(f"Upload error: {e}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        # Rejected, failed or already indexed: nothing will use the uploaded copy
+        if scope:
+            scope.close()
+
+def report_header(partial_path):
+    """Show what the upload contains while the rest of it is still arriving"""
+    filename = os.path.basename(partial_path)[:-len(".part")]
+    try:
+        info = probe_header(partial_path)
+    except Exception as e:
+        print(f"⚠️  Could not probe upload header: {e}")
+        return
+    if not info:
+        return  # Header not readable yet (e.g. moov atom at the end)
+    video = next((s for s in info["streams"] if s.get("codec_type") == "video"), None)
+    if video is None:
+        progress_store.set(filename, 0, "Receiving upload (no video stream found so far)...")
+        return
+    duration = f", {info['duration'] / 60:.1f} min" if info["duration"] else ""
+    progress_store.set(filename, 0, f"Receiving upload ({video.get('codec_name')} {video.get('width')}x{video.get('height')}{duration})...")
+
+def is_finished(state):
+    status = state.get("status", "")
+    return state.get("progress", 0) >= 100 and any(word in status for word in ("successful", "Failed", "Partial", "completed"))
 
 @app.route('/progress/<filename>', methods=['GET'])
 def get_progress(filename):
-    # Reload progress file to get latest updates
-    if os.path.exists(PROGRESS_FILE):
-        with open(PROGRESS_FILE, 'r') as f:
-            current_progress = json.load(f)
-            status = current_progress.get(filename, {"progress": 0, "status": "No progress information"})
+    # Served from memory; the store persists in the background.
+    # With ?since=<version>, long-poll until the file moves past that version.
+    since = request.args.get('since', type=int)
+    if since is None:
+        version, state = progress_store.get_versioned(filename)
     else:
-        status = {"progress": 0, "status": "No progress information"}
-    
-    return jsonify(status)
+        wait = min(request.args.get('wait', PROGRESS_LONG_POLL_TIMEOUT, type=float), PROGRESS_LONG_POLL_TIMEOUT)
+        version, state = progress_store.wait_for_change(filename, since, wait)
+    return jsonify({**state, "version": version})
+
+@app.route('/progress/<filename>/stream', methods=['GET'])
+def stream_progress(filename):
+    """Server-Sent Events: one event per progress change, ending once the upload finishes"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    since = int(last_event_id) if last_event_id and last_event_id.isdigit() else -1
+
+    def events():
+        last = since
+        while True:
+            version, state = progress_store.wait_for_change(filename, last, PROGRESS_KEEPALIVE_INTERVAL)
+            if version > last:
+                last = version
+                yield f"id: {version}\ndata: {json.dumps(state)}\n\n"
+                if is_finished(state):
+                    return
+            else:
+                yield ": keep-alive\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_engine.get(job_id)
+    if not job:
+        return jsonify({'error': f"No job '{job_id}'"}), 404
+    return jsonify(job)
+
+@app.route('/jobs', methods=['GET'])
+def get_jobs():
+    return jsonify(job_engine.stats())
 
 @app.route('/search', methods=['POST'])
 def search():
@@ -154,18 +233,10 @@ def search():
         if not query or not selected_file:
             return jsonify({"error": "Missing query or file selection"}), 400
 
-        # Load video_id_map
-        with open(VIDEO_ID_MAP, "r") as f:
-            video_id_map = json.load(f)
-
-        video_ids = video_id_map.get(selected_file)
+        video_ids = state_store.video_ids(selected_file)
         if not video_ids:
             return jsonify({"error": f"No video_id(s) found for '{selected_file}'"}), 404
 
-        # Ensure video_ids is a list
-        if isinstance(video_ids, str):
-            video_ids = [video_ids]
-
         print(f"Found video IDs: {video_ids}")
 
         # Get search options from form
@@ -175,96 +246,19 @@ def search():
         print(f"Search options received: {search_options}")
         print(f"Search options type: {type(search_options)}")
 
-        aggregated_results = []
-
-        # Direct API call using v1.3 with multipart/form-data
-        headers = {
-            "x-api-key": API_KEY
-            # Do NOT set Content-Type - requests will set it automatically with boundary
-        }
-        
-        # Prepare payload - start with basic fields
-        payload = {
-            "index_id": INDEX_ID,
-            "query_text": query,
-            "page_limit": "50",
-            "operator": "or",
-            "sort_option": "score"
-        }
+        # Repeat searches are answered from the cache
+        try:
+            chunk_hits = cached_search(search_cache, selected_file, query, search_options, video_ids)
+        except SearchError as e:
+            return jsonify({"error": str(e)}), e.status_code
         
-        # Create files dict with search options as form fields
-        files = {
-            "dummy": (None, ""),  # Force multipart encoding
-        }
-        
-        # Add search options as multiple form fields with the same name
-        # This is how arrays are sent in multipart/form-data
-        for option in search_options:
-            files[f"search_options"] = (None, option)
-        
-        print(f"\n=== API SEARCH REQUEST ===")
-        print(f"URL: {API_BASE}/search")
-        print(f"Basic payload: {payload}")
-        print(f"Search options: {search_options}")
-        
-        # For multipart with multiple values of same field, we need to use tuples
-        data = []
-        for key, value in payload.items():
-            data.append((key, value))
-        
-        # Add search options
-        for option in search_options:
-            data.append(("search_options", option))
-        
-        res = requests.post(
-            f"{API_BASE}/search",
-            headers=headers,
-            data=data,  # Use list of tuples for multiple values
-            files={"dummy": (None, "")}  # Still need this for multipart
-        )
-        
-        print(f"\n=== SEARCH RESPONSE ===")
-        print(f"Status: {res.status_code}")
-        print(f"Response headers: {dict(res.headers)}")
-        
-        if res.status_code == 200:
-            try:
-                search_data = res.json()
-                all_results = search_data.get('data', [])
-                print(f"Total results from API: {len(all_results)}")
-                
-                # Filter for our video IDs
-                for clip in all_results:
-                    if clip.get('video_id') in video_ids:
-                        start = clip.get('start', 0)
-                        end = clip.get('end', 0)
-                        confidence = clip.get('confidence', clip.get('score', 0))
-                        aggregated_results.append({
-                            "start": start,
-                            "end": end,
-                            "confidence": confidence
-                        })
-                
-                print(f"Filtered results for our videos: {len(aggregated_results)}")
-            except json.JSONDecodeError:
-                print(f"Failed to parse JSON response: {res.text[:200]}")
-                return jsonify({"error": "Invalid JSON response from API"}), 500
-        else:
-            print(f"Response body: {res.text}")
-            return jsonify({"error": f"API error: {res.status_code} - {res.text}"}), res.status_code
+        # Chunk-relative hits -> source timecodes, merged across chunk boundaries
+        aggregated_results = to_source_timecodes(chunk_hits, state_store.timeline(selected_file))
 
-        # Format results - just timecodes and confidence
+        # Format results - source timecodes and confidence
         if aggregated_results:
             # Sort by confidence score (handle both numeric and string values)
-            def get_sort_value(item):
-                conf = item.get('confidence', 0)
-                if isinstance(conf, str):
-                    # Map string confidence to numeric values for sorting
-                    confidence_map = {'high': 0.9, 'medium': 0.5, 'low': 0.1}
-                    return confidence_map.get(conf.lower(), 0)
-                return float(conf)
-            
-            aggregated_results.sort(key=get_sort_value, reverse=True)
+            aggregated_results.sort(key=confidence_value, reverse=True)
             
             result_text = f"Found {len(aggregated_results)} matches for '{query}':\n\n"
             for i, r in enumerate(aggregated_results[:10], 1):
@@ -289,7 +283,8 @@ def search():
                 all_results_clean.append({
                     "start": float(r.get('start', 0)),
                     "end": float(r.get('end', 0)),
-                    "confidence": r.get('confidence', 0)
+                    "confidence": r.get('confidence', 0),
+                    "chunks": r.get('chunks', [])
                 })
             
             return jsonify({"result": result_text, "allResults": all_results_clean})
@@ -303,19 +298,72 @@ def search():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/search/multi', methods=['POST'])
+def search_multi():
+    """Search many files at once; streams one NDJSON line per file as it finishes, then the merged top results"""
+    query = request.form.get("query")
+    filenames = request.form.getlist("selectedVideo")
+    if not filenames and request.form.get("selectedVideos"):
+        filenames = json.loads(request.form["selectedVideos"])
+    search_options = json.loads(request.form.get("searchOptions", '["visual", "audio"]'))
+    top_k = request.form.get("topK", type=int) or SEARCH_TOP_K
+
+    if not query or not filenames:
+        return jsonify({"error": "Missing query or file selection"}), 400
+
+    files = {}
+    missing = []
+    for filename in filenames:
+        video_ids = state_store.video_ids(filename)
+        if video_ids:
+            files[filename] = video_ids
+        else:
+            missing.append(filename)
+
+    def lines():
+        for filename in missing:
+            yield json.dumps({"type": "error", "filename": filename, "error": f"No video_id(s) found for '{filename}'"}) + "\n"
+        timelines = {filename: state_store.timeline(filename) for filename in files}
+        for event in search_files(query, search_options, files, search_cache, top_k, timelines=timelines):
+            yield json.dumps(event) + "\n"
+
+    return Response(lines(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+@app.route('/search/cache', methods=['GET'])
+def get_search_cache_stats():
+    return jsonify(search_cache.stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Ingest stage histograms in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/videos', methods=['GET'])
 def get_videos():
-    """Get list of uploaded videos"""
+    """List uploaded videos a page at a time.
+
+    ?limit=, ?cursor= (next_cursor of the previous page), ?prefix=, ?q= (substring)
+    and ?sort=name|recent (most recently ingested first). Responses carry an ETag
+    that changes whenever any file is added or updated, so an unchanged page
+    costs a 304 without touching the list.
+    """
     try:
-        videos = []
-        for filename, ids in video_id_map.items():
-            video_count = len(ids) if isinstance(ids, list) else 1
-            videos.append({
-                "filename": filename,
-                "video_ids": ids if isinstance(ids, list) else [ids],
-                "chunk_count": video_count
-            })
-        return jsonify({"videos": videos})
+        etag = hashlib.sha1(f"{state_store.files_version()}?{request.query_string.decode()}".encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            limit = min(max(1, request.args.get('limit', VIDEOS_PAGE_SIZE, type=int)), VIDEOS_PAGE_MAX)
+            try:
+                files, next_cursor = state_store.list_files(
+                    limit, request.args.get('cursor'), request.args.get('prefix'), request.args.get('q'),
+                    request.args.get('sort', 'name'))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            videos = [{**f, "chunk_count": len(f["video_ids"])} for f in files]
+            response = jsonify({"videos": videos, "next_cursor": next_cursor})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'  # Always revalidate; a match costs a 304
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
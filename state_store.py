@@ -0,0 +1,408 @@
+import os
+import json
+import time
+import base64
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import STATE_DB, VIDEO_ID_MAP, CHUNK_TIMELINE, PROGRESS_FILE, PROGRESS_WAL, CONTENT_INDEX
+
+# Shared state for the server, the uploaders and the batch tools in one
+# SQLite database in WAL mode: readers never block the writer, every process
+# sees the others' commits, and lookups go through primary keys and indexes
+# instead of loading and rewriting whole JSON files. Each thread gets its own
+# connection; writes are short transactions. The JSON files used before
+# (video_id_map.json, chunk_timeline.json, progress.json/.wal,
+# content_index.json) are imported once into an empty database.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    video_ids TEXT NOT NULL,
+    content_hash TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    filename TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    video_id TEXT NOT NULL,
+    start REAL,
+    duration REAL,
+    size INTEGER,
+    PRIMARY KEY (filename, position)
+);
+CREATE INDEX IF NOT EXISTS files_created_at ON files (created_at, filename);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('files_version', 0);
+CREATE TRIGGER IF NOT EXISTS files_version_insert AFTER INSERT ON files BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'files_version';
+END;
+CREATE TRIGGER IF NOT EXISTS files_version_update AFTER UPDATE ON files BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'files_version';
+END;
+CREATE TRIGGER IF NOT EXISTS files_version_delete AFTER DELETE ON files BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'files_version';
+END;
+CREATE INDEX IF NOT EXISTS chunks_video_id ON chunks (video_id);
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS progress (
+    filename TEXT PRIMARY KEY,
+    progress INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    submitted_at REAL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS temp_files (
+    path TEXT PRIMARY KEY,
+    owner TEXT,
+    pid INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS content (
+    id INTEGER PRIMARY KEY,
+    content_hash TEXT UNIQUE,
+    sample TEXT NOT NULL,
+    file_key TEXT,
+    video_ids TEXT NOT NULL,
+    chunks TEXT NOT NULL,
+    filenames TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS content_sample ON content (sample);
+CREATE TABLE IF NOT EXISTS content_chunks (
+    cut_key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    video_id TEXT NOT NULL
+);
+"""
+
+# Trigram index over filenames for substring search, kept in sync by triggers
+FILENAME_SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5 (filename, content='files', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts (rowid, filename) VALUES (new.rowid, new.filename);
+END;
+CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts (files_fts, rowid, filename) VALUES ('delete', old.rowid, old.filename);
+END;
+INSERT INTO files_fts (files_fts) VALUES ('rebuild');
+"""
+
+LIST_ORDERS = {
+    # sort -> (ORDER BY, keyset condition for the rows after the cursor, cursor columns)
+    "name": ("filename", "filename > ?", ("filename",)),
+    "recent": ("created_at DESC, filename DESC", "(created_at, filename) < (?, ?)", ("created_at", "filename")),
+}
+
+JOB_FIELDS = ("id", "name", "status", "result", "error", "submitted_at", "started_at", "finished_at")
+CONTENT_FIELDS = ("id", "content_hash", "sample", "file_key", "video_ids", "chunks", "filenames")
+
+
+class StateStore:
+    """Files, chunk timelines, indexing tasks, progress, jobs, temp files and indexed content in one SQLite database"""
+
+    def __init__(self, path: str = STATE_DB):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        self._fts = self._create_filename_search(conn)
+        self._import_legacy(conn)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # Durable at each commit's WAL write, fsync at checkpoints
+            self._local.conn = conn
+        return conn
+
+    def _write(self, statements: Iterable[Tuple[str, tuple]]):
+        """Run statements in one immediate transaction"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in statements:
+                conn.execute(sql, params)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # Files and chunk timelines
+
+    def set_file(self, filename: str, video_ids: List[str], chunks: Optional[List[Dict]] = None,
+                 content_hash: Optional[str] = None):
+        """Record a file's video IDs and where each chunk (as in build_result) starts in the source"""
+        now = time.time()
+        statements = [(
+            "INSERT INTO files (filename, video_ids, content_hash, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (filename) DO UPDATE SET video_ids = excluded.video_ids, "
+            "content_hash = COALESCE(excluded.content_hash, files.content_hash), updated_at = excluded.updated_at",
+            (filename, json.dumps(video_ids), content_hash, now, now),
+        )]
+        if chunks is not None:
+            statements.append(("DELETE FROM chunks WHERE filename = ?", (filename,)))
+            statements += [(
+                "INSERT INTO chunks (filename, position, video_id, start, duration, size) VALUES (?, ?, ?, ?, ?, ?)",
+                (filename, c.get("index") or i + 1, c["video_id"], c.get("start"), c.get("duration"), c.get("size")),
+            ) for i, c in enumerate(chunks) if c.get("video_id")]
+        self._write(statements)
+
+    def video_ids(self, filename: str) -> Optional[List[str]]:
+        row = self._conn().execute("SELECT video_ids FROM files WHERE filename = ?", (filename,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def files_version(self) -> int:
+        """Bumped by every change to the files table, in any process"""
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'files_version'").fetchone()[0]
+
+    def list_files(self, limit: int, cursor: Optional[str] = None, prefix: Optional[str] = None,
+                   contains: Optional[str] = None, sort: str = "name") -> Tuple[List[Dict], Optional[str]]:
+        """One page of files and the cursor for the next (None on the last page).
+
+        Pages are keyset-paginated on the sort order's index, so each costs
+        O(log n + limit) however deep it is. prefix is a range scan on the
+        filename key; contains uses the trigram index when there is one and
+        the substring has at least 3 characters, otherwise a scan. Raises
+        ValueError for an unknown sort or a malformed cursor.
+        """
+        if sort not in LIST_ORDERS:
+            raise ValueError(f"Unknown sort '{sort}' (use {' or '.join(LIST_ORDERS)})")
+        order_by, after, cursor_columns = LIST_ORDERS[sort]
+        where, params = [], []
+        if prefix:
+            where.append("filename >= ? AND filename < ?")
+            params += [prefix, prefix + "\U0010ffff"]
+        if contains and self._fts and len(contains) >= 3:
+            where.append("rowid IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?)")
+            params.append('"' + contains.replace('"', '""') + '"')
+        elif contains:
+            where.append("filename LIKE ? ESCAPE '\\'")
+            params.append("%" + contains.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if cursor:
+            where.append(after)
+            params += _decode_cursor(cursor, len(cursor_columns))
+
+        sql = "SELECT filename, video_ids, created_at FROM files"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order_by} LIMIT ?"
+        rows = self._conn().execute(sql, params + [limit + 1]).fetchall()
+
+        files = [{"filename": f, "video_ids": json.loads(ids), "ingested_at": created} for f, ids, created in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = dict(zip(("filename", "video_ids", "created_at"), rows[limit - 1]))
+            next_cursor = _encode_cursor([last[c] for c in cursor_columns])
+        return files, next_cursor
+
+    def timeline(self, filename: str) -> List[Dict]:
+        """The file's chunks in source order: index, video_id, start, duration, size"""
+        rows = self._conn().execute(
+            "SELECT position, video_id, start, duration, size FROM chunks WHERE filename = ? ORDER BY start",
+            (filename,)).fetchall()
+        return [{"index": p, "video_id": v, "start": s, "duration": d, "size": z} for p, v, s, d, z in rows]
+
+    # Indexing tasks
+
+    def set_task(self, task_id: str, status: str):
+        self._write([("INSERT OR REPLACE INTO tasks (task_id, status, updated_at) VALUES (?, ?, ?)",
+                      (task_id, status, time.time()))])
+
+    def task_status(self, task_id: str) -> Optional[str]:
+        row = self._conn().execute("SELECT status FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return row[0] if row else None
+
+    # Progress
+
+    def set_progress(self, states: Dict[str, Dict]):
+        """Write the latest state of several files in one transaction"""
+        now = time.time()
+        self._write([("INSERT OR REPLACE INTO progress (filename, progress, status, updated_at) VALUES (?, ?, ?, ?)",
+                      (f, s["progress"], s["status"], now)) for f, s in states.items()])
+
+    def progress(self, filename: str) -> Optional[Dict]:
+        row = self._conn().execute("SELECT progress, status FROM progress WHERE filename = ?", (filename,)).fetchone()
+        return {"progress": row[0], "status": row[1]} if row else None
+
+    # Jobs
+
+    def save_job(self, job: Dict):
+        row = dict(job, result=json.dumps(job["result"]) if job.get("result") is not None else None)
+        self._write([(f"INSERT OR REPLACE INTO jobs ({', '.join(JOB_FIELDS)}) VALUES ({', '.join('?' * len(JOB_FIELDS))})",
+                      tuple(row.get(k) for k in JOB_FIELDS))])
+
+    def job(self, job_id: str) -> Optional[Dict]:
+        row = self._conn().execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def interrupt_jobs(self) -> int:
+        """Mark jobs a previous server run left queued or running as failed; returns how many"""
+        conn = self._conn()
+        cur = conn.execute("UPDATE jobs SET status = 'failed', error = 'Interrupted by a server restart', "
+                           "finished_at = ? WHERE status IN ('queued', 'running')", (time.time(),))
+        return cur.rowcount
+
+    # Temp files
+
+    def add_temp(self, path: str, owner: Optional[str], pid: int):
+        self._write([("INSERT OR REPLACE INTO temp_files (path, owner, pid, created_at) VALUES (?, ?, ?, ?)",
+                      (path, owner, pid, time.time()))])
+
+    def remove_temp(self, path: str):
+        self._write([("DELETE FROM temp_files WHERE path = ?", (path,))])
+
+    def temp_files(self) -> List[Dict]:
+        rows = self._conn().execute("SELECT path, owner, pid, created_at FROM temp_files").fetchall()
+        return [{"path": p, "owner": o, "pid": i, "created_at": c} for p, o, i, c in rows]
+
+    # Indexed content (dedup.py)
+
+    def content(self, sample: str) -> List[Dict]:
+        """Indexed files whose sampled hash is `sample`"""
+        rows = self._conn().execute(f"SELECT {', '.join(CONTENT_FIELDS)} FROM content WHERE sample = ?",
+                                    (sample,)).fetchall()
+        entries = [dict(zip(CONTENT_FIELDS, row)) for row in rows]
+        for entry in entries:
+            for k in ("video_ids", "chunks", "filenames"):
+                entry[k] = json.loads(entry[k])
+        return entries
+
+    def add_content(self, entry: Optional[Dict], chunks: Iterable[Tuple[str, str, str]] = ()):
+        """Record an indexed file (replacing an entry for the same content) and chunks as (cut_key, digest, video_id)"""
+        statements = []
+        if entry and entry.get("content_hash"):
+            statements.append(("DELETE FROM content WHERE content_hash = ?", (entry["content_hash"],)))
+        elif entry and entry.get("file_key"):
+            statements.append(("DELETE FROM content WHERE content_hash IS NULL AND file_key = ?", (entry["file_key"],)))
+        if entry:
+            statements.append((
+                "INSERT INTO content (content_hash, sample, file_key, video_ids, chunks, filenames) VALUES (?, ?, ?, ?, ?, ?)",
+                (entry.get("content_hash"), entry["sample"], entry.get("file_key"), json.dumps(entry["video_ids"]),
+                 json.dumps(entry["chunks"]), json.dumps(entry["filenames"])),
+            ))
+        statements += [("INSERT OR REPLACE INTO content_chunks (cut_key, digest, video_id) VALUES (?, ?, ?)", c)
+                       for c in chunks]
+        self._write(statements)
+
+    def update_content(self, content_id: int, **fields):
+        """Set content_hash and/or filenames of one entry"""
+        if "filenames" in fields:
+            fields["filenames"] = json.dumps(fields["filenames"])
+        self._write([(f"UPDATE content SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                      (*fields.values(), content_id))])
+
+    def content_chunk(self, cut_key: str) -> Optional[Tuple[str, str]]:
+        """(digest, video_id) of an indexed chunk cut at cut_key, if any"""
+        row = self._conn().execute("SELECT digest, video_id FROM content_chunks WHERE cut_key = ?", (cut_key,)).fetchone()
+        return tuple(row) if row else None
+
+    def _create_filename_search(self, conn: sqlite3.Connection) -> bool:
+        """Set up the trigram filename index if SQLite supports it; returns whether it is available"""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'files_fts'").fetchone():
+            return True
+        try:
+            conn.executescript("BEGIN IMMEDIATE;" + FILENAME_SEARCH_SCHEMA + "COMMIT;")
+            return True
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"⚠️  No trigram index for filename search ({e}); substring search will scan")
+            return False
+
+    def _import_legacy(self, conn: sqlite3.Connection):
+        """Bring in the JSON state files from before the database, once"""
+        self._import_content_index(conn)
+        if conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() or \
+                conn.execute("SELECT 1 FROM progress LIMIT 1").fetchone():
+            return
+        video_id_map = _load_json(VIDEO_ID_MAP) or {}
+        timelines = _load_json(CHUNK_TIMELINE) or {}
+        for filename, ids in video_id_map.items():
+            self.set_file(filename, ids if isinstance(ids, list) else [ids], timelines.get(filename))
+
+        progress = _load_json(PROGRESS_FILE) or {}
+        if os.path.exists(PROGRESS_WAL):
+            with open(PROGRESS_WAL, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # Torn final line
+                    progress[entry["filename"]] = entry["state"]
+        if progress:
+            self.set_progress(progress)
+        if video_id_map or progress:
+            print(f"📦 Imported {len(video_id_map)} files and {len(progress)} progress entries into {self.path}")
+
+
+    def _import_content_index(self, conn: sqlite3.Connection):
+        """Indexed files from content_index.json. Its chunk entries are keyed by chunk bytes, which can't be
+        looked up without reading a chunk, so they are left behind."""
+        if conn.execute("SELECT 1 FROM content LIMIT 1").fetchone():
+            return
+        legacy = _load_json(CONTENT_INDEX)
+        if not legacy:
+            return
+        samples = {h: sample for sample, hashes in legacy.get("samples", {}).items() for h in hashes}
+        files = [(h, e) for h, e in legacy.get("files", {}).items() if h in samples]
+        for content_hash, entry in files:
+            self.add_content({"content_hash": content_hash, "sample": samples[content_hash], **entry})
+        print(f"📦 Imported {len(files)} indexed files from {CONTENT_INDEX} into {self.path}")
+
+
+def _encode_cursor(values: List) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, length: int) -> List:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Malformed cursor")
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Malformed cursor")
+    return values
+
+
+def _load_json(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+_state: Optional[StateStore] = None
+_state_lock = threading.Lock()
+
+
+def get_state() -> StateStore:
+    """The process-wide state store, opened on first use"""
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = StateStore()
+        return _state
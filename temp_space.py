@@ -0,0 +1,242 @@
+import os
+import glob
+import time
+import shutil
+import tempfile
+import threading
+from contextlib import nullcontext
+from typing import List, Optional
+from state_store import get_state
+from metrics import span
+from config import (
+    TEMP_DIR, UPLOAD_FOLDER, TEMP_CHUNK_OVERHEAD, TEMP_MIN_FREE, TEMP_ADMIT_POLL, TEMP_ORPHAN_AGE,
+    MAX_CHUNK_SIZE, PIPELINE_DEPTH, UPLOAD_WORKERS
+)
+
+# Temp storage with a guaranteed lifecycle. Every job works inside a
+# TempScope: each temp file or directory it creates (the server's copy of an
+# upload, the job's chunk directory) is registered with the scope and, under
+# this process's pid, in the state database. Closing the scope deletes them
+# whether the job succeeded or raised; chunks are still deleted one by one as
+# soon as their upload is accepted, by the pipeline (through the scope, which
+# counts the bytes it has given back). The first use in a process sweeps what
+# earlier processes left behind: registered paths whose process is gone, and
+# unregistered chunk directories and partial uploads older than
+# TEMP_ORPHAN_AGE. TEMP_DIR and UPLOAD_FOLDER belong to this app alone, so the
+# sweep never looks at anything else. Jobs are only admitted when the free
+# space, less what open scopes may still write, covers the job's projected
+# peak and leaves TEMP_MIN_FREE to spare.
+
+
+class InsufficientSpace(Exception):
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable  # Other jobs still hold space, so trying again later can succeed
+
+
+def projected_need(source_size: int, includes_source: bool = False, virtual: bool = False) -> int:
+    """Peak temp bytes for one file: the chunk copies alive at once, plus the source if it is itself a temp file.
+
+    A cut only starts once it has one of the pipeline's chunk slots, so at
+    most PIPELINE_DEPTH + UPLOAD_WORKERS chunks are on disk at once, counting
+    those still being cut; virtual chunks never reach the disk.
+    """
+    in_flight = (max(1, PIPELINE_DEPTH) + max(1, UPLOAD_WORKERS)) * MAX_CHUNK_SIZE
+    chunks = 0 if virtual else min(source_size, in_flight) * TEMP_CHUNK_OVERHEAD
+    return int(chunks + (source_size if includes_source else 0))
+
+
+def projected_total(source_size: int, includes_source: bool = False, virtual: bool = False) -> int:
+    """Temp bytes one file writes over its whole run: every chunk once, plus the source if it is itself a temp file"""
+    chunks = 0 if virtual else source_size * TEMP_CHUNK_OVERHEAD
+    return int(chunks + (source_size if includes_source else 0))
+
+
+def _size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Deleted by an uploader while we were looking
+    return total
+
+
+def _delete(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Someone else's process
+    return True
+
+
+class TempScope:
+    """Temp paths and reserved disk space belonging to one job; close() deletes the paths and frees the reservation
+
+    need is the most the job holds at once and total what it writes over its
+    whole run (need if not given). Bytes deleted through remove() count as
+    released, so a job that has written most of its total stops reserving
+    its full peak.
+    """
+
+    def __init__(self, space: "TempSpace", owner: str, need: int = 0, total: Optional[int] = None):
+        self.space = space
+        self.owner = owner
+        self.need = need
+        self.total = need if total is None else max(need, total)
+        self.released = 0
+        self.paths: List[str] = []
+        self._lock = threading.Lock()
+
+    def add(self, path: str) -> str:
+        """Register a temp file or directory, to be deleted with the scope (or by a later sweep)"""
+        get_state().add_temp(path, self.owner, os.getpid())
+        with self._lock:
+            self.paths.append(path)
+        return path
+
+    def make_dir(self, prefix: str = "tl_chunks_") -> str:
+        return self.add(tempfile.mkdtemp(prefix=prefix, dir=TEMP_DIR))
+
+    def remove(self, path: str):
+        """Delete a temp file inside the scope (e.g. a chunk whose upload was accepted) and count its bytes as released"""
+        size = _size(path)
+        _delete(path)
+        with self._lock:
+            self.released += size
+            registered = path in self.paths
+            if registered:
+                self.paths.remove(path)
+        if registered:
+            get_state().remove_temp(path)
+
+    def outstanding(self) -> int:
+        """Reserved bytes this job has not written yet: up to its peak, and no more than is left of its total"""
+        with self._lock:
+            paths, released = list(self.paths), self.released
+        return max(0, min(self.need, self.total - released) - sum(_size(p) for p in paths))
+
+    def close(self):
+        """Delete the scope's paths and free its reservation; closing again does nothing more"""
+        with self._lock:
+            paths, self.paths = self.paths, []
+        for path in paths:
+            try:
+                with span("cleanup"):
+                    _delete(path)
+            except OSError as e:
+                # Left registered: the sweep retries once this process is gone
+                print(f"⚠️  Could not delete temp {path}: {e}")
+                continue
+            get_state().remove_temp(path)
+        self.space._release(self)
+
+    def __enter__(self) -> "TempScope":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TempSpace:
+    """Admission control over temp disk space, and the owner of every job's TempScope"""
+
+    def __init__(self):
+        self._scopes: List[TempScope] = []
+        self._cond = threading.Condition()
+        for d in (TEMP_DIR, UPLOAD_FOLDER):
+            os.makedirs(d, exist_ok=True)
+        swept = self._sweep()
+        if swept:
+            print(f"🧹 Swept {swept} orphaned temp file(s) from earlier runs")
+
+    def free_bytes(self) -> int:
+        return min(shutil.disk_usage(d).free for d in {TEMP_DIR, UPLOAD_FOLDER} if os.path.isdir(d))
+
+    def scope(self, owner: str, need: int = 0, wait: bool = False, total: Optional[int] = None) -> TempScope:
+        """Open a scope for a job that may need `need` temp bytes at its peak (and `total` over its run).
+
+        Raises InsufficientSpace if that would leave less than TEMP_MIN_FREE
+        once open scopes have written what they reserved. With wait=True it
+        waits for other jobs to finish instead, and only raises if none are
+        left to free anything.
+        """
+        with self._cond:
+            while need:
+                available = self.free_bytes() - sum(s.outstanding() for s in self._scopes) - TEMP_MIN_FREE
+                if need <= available:
+                    break
+                message = f"Not enough temp space for {owner}: needs {need / 1024 ** 3:.2f} GB, {max(0, available) / 1024 ** 3:.2f} GB available"
+                if not wait or not self._scopes:
+                    raise InsufficientSpace(message, bool(self._scopes))
+                print(f"⏳ {message}, waiting...")
+                self._cond.wait(TEMP_ADMIT_POLL)
+            scope = TempScope(self, owner, need, total)
+            self._scopes.append(scope)
+            return scope
+
+    def _release(self, scope: TempScope):
+        with self._cond:
+            if scope in self._scopes:
+                self._scopes.remove(scope)
+            self._cond.notify_all()
+
+    def _sweep(self) -> int:
+        """Delete temp paths left by processes that are gone; only safe before this process registers any"""
+        state = get_state()
+        swept = 0
+        for row in state.temp_files():
+            if row["pid"] != os.getpid() and _running(row["pid"]):
+                continue  # A live process still owns it (the same pid can only be a recycled one)
+            try:
+                _delete(row["path"])
+            except OSError as e:
+                print(f"⚠️  Could not delete orphaned temp {row['path']}: {e}")
+                continue
+            state.remove_temp(row["path"])
+            swept += 1
+
+        # Leftovers nobody registered: killed between creating and registering, or from older versions
+        registered = {row["path"] for row in state.temp_files()}
+        cutoff = time.time() - TEMP_ORPHAN_AGE
+        # Only the app's own directories are searched, so other programs' files in /tmp are never touched
+        candidates = (glob.glob(os.path.join(TEMP_DIR, "tl_chunks_*"))
+                      + glob.glob(os.path.join(UPLOAD_FOLDER, "*.part")))
+        for path in candidates:
+            try:
+                if path not in registered and os.path.getmtime(path) < cutoff:
+                    _delete(path)
+                    swept += 1
+            except OSError:
+                pass
+        return swept
+
+
+def job_scope(temp: Optional[TempScope], owner: str):
+    """The caller's scope if one was given (the caller closes it), else a new one closed on exit"""
+    return nullcontext(temp) if temp else get_temp_space().scope(owner)
+
+
+_space: Optional[TempSpace] = None
+_space_lock = threading.Lock()
+
+
+def get_temp_space() -> TempSpace:
+    """The process-wide temp space, which sweeps orphans when first created"""
+    global _space
+    with _space_lock:
+        if _space is None:
+            _space = TempSpace()
+        return _space
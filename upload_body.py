@@ -0,0 +1,193 @@
+import io
+import os
+import mmap
+import uuid
+import hashlib
+from contextlib import closing
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from config import UPLOAD_BUFFER_SIZE, INGEST_HASH
+
+# Multipart/form-data upload bodies streamed straight from disk. The envelope
+# (the text fields, the file part's header and the closing boundary) is built
+# up front, so the Content-Length is known and no chunked encoding is needed.
+# The file's bytes go to the socket as memoryviews over an mmap window of
+# UPLOAD_BUFFER_SIZE bytes, which is unmapped as soon as the socket has taken
+# it. Nothing is copied into Python objects, memory stays at one window
+# whatever the chunk size, and there is one Python-level step per window
+# rather than one per 8 KB block. Files that can't be mapped are read into a
+# single reused buffer instead. Virtual chunks, which have no file, are
+# sent with chunked transfer encoding around whatever stream produces them.
+# File bodies hash the bytes as they go out (INGEST_HASH), so dedup gets
+# each file's digest without reading it a second time.
+
+WINDOW_ALIGN = mmap.ALLOCATIONGRANULARITY
+
+
+def multipart_envelope(filename: str, fields: Dict[str, str], boundary: str, file_field: str = "video_file",
+                       content_type: str = "video/mp4") -> Tuple[bytes, bytes]:
+    """The bytes before and after the file's content in a multipart/form-data body"""
+    head = b"".join(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+                    for name, value in fields.items())
+    head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+             f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n').encode()
+    return head, f'\r\n--{boundary}--\r\n'.encode()
+
+
+def _mapped_windows(f, size: int, window: int) -> Iterator[memoryview]:
+    offset = 0
+    while offset < size:
+        length = min(window, size - offset)
+        mm = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ, offset=offset)
+        view = memoryview(mm)
+        try:
+            yield view
+        finally:
+            view.release()
+            mm.close()
+        offset += length
+
+
+def read_windows(f, buffer_size: int = UPLOAD_BUFFER_SIZE) -> Iterator[memoryview]:
+    """Yield what a file or pipe holds through one reused buffer; each view is valid until the next"""
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        n = f.readinto(buffer)
+        if not n:
+            return
+        yield view[:n]
+
+
+def file_windows(f, size: int, buffer_size: int = UPLOAD_BUFFER_SIZE) -> Iterator[memoryview]:
+    """Yield an open file's bytes as memoryviews, each valid only until the next one is requested"""
+    window = max(WINDOW_ALIGN, buffer_size // WINDOW_ALIGN * WINDOW_ALIGN)
+    try:
+        mmap.mmap(f.fileno(), min(size, window), access=mmap.ACCESS_READ).close()
+    except (OSError, ValueError):
+        return read_windows(f, buffer_size)  # Empty files, pipes and the like
+    return _mapped_windows(f, size, window)
+
+
+class MultipartFileBody:
+    """A multipart/form-data body for one file, to pass as requests' data=
+
+    len() gives the Content-Length. Each iteration reopens the file, so the
+    same body can be sent again on a retry. on_progress(sent, total) is
+    called after every window. digest is the file's INGEST_HASH once an
+    attempt has sent all of it.
+    """
+
+    def __init__(self, path: str, fields: Dict[str, str], file_field: str = "video_file", content_type: str = "video/mp4",
+                 on_progress: Optional[Callable[[int, int], None]] = None, buffer_size: int = UPLOAD_BUFFER_SIZE):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.head, self.tail = multipart_envelope(os.path.basename(path), fields, self.boundary, file_field, content_type)
+        self.on_progress = on_progress
+        self.buffer_size = buffer_size
+        self.digest = None
+
+    def __len__(self) -> int:
+        return len(self.head) + self.size + len(self.tail)
+
+    def __iter__(self) -> Iterator[memoryview]:
+        total = len(self)
+        sent = len(self.head)
+        h = hashlib.new(INGEST_HASH)
+        self.digest = None
+        yield memoryview(self.head)
+        with open(self.path, "rb") as f:
+            for view in file_windows(f, self.size, self.buffer_size):
+                n = len(view)
+                h.update(view)
+                yield view
+                sent += n
+                if self.on_progress:
+                    self.on_progress(sent, total)
+        self.digest = h.hexdigest()
+        yield memoryview(self.tail)
+        if self.on_progress:
+            self.on_progress(total, total)
+
+
+class HashingFile(io.FileIO):
+    """A file opened for reading that hashes its bytes as they are read front to back,
+    for uploads whose body is built elsewhere (e.g. by an SDK that takes a file object).
+
+    digest is the file's INGEST_HASH once every byte has been read in order;
+    reads after a seek back are not hashed again.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path, "rb")
+        self.size = os.fstat(self.fileno()).st_size
+        self._hash = hashlib.new(INGEST_HASH)
+        self._hashed = 0
+
+    def _update(self, offset: int, data):
+        if data and offset == self._hashed:
+            self._hash.update(data)
+            self._hashed += len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        offset = self.tell()
+        data = super().read(size)
+        self._update(offset, data)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, buffer) -> int:
+        offset = self.tell()
+        n = super().readinto(buffer)
+        if n:
+            self._update(offset, memoryview(buffer)[:n])
+        return n
+
+    @property
+    def digest(self) -> Optional[str]:
+        return self._hash.hexdigest() if self._hashed == self.size else None
+
+
+class ChunkTooLarge(ValueError):
+    pass
+
+
+class MultipartStreamBody:
+    """A multipart/form-data body around a byte stream of unknown length, sent with chunked encoding
+
+    stream() is called on each iteration and must produce the file's bytes
+    from the start, so the body can be sent again on a retry. Progress is
+    reported against expected_size, the caller's estimate. A stream that
+    grows past max_size is abandoned with ChunkTooLarge.
+    """
+
+    def __init__(self, stream: Callable[[], Iterator[memoryview]], filename: str, fields: Dict[str, str], expected_size: int,
+                 max_size: Optional[float] = None, file_field: str = "video_file", content_type: str = "video/mp4",
+                 on_progress: Optional[Callable[[int, int], None]] = None):
+        self.stream = stream
+        self.filename = filename
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.head, self.tail = multipart_envelope(filename, fields, self.boundary, file_field, content_type)
+        self.expected_size = max(1, expected_size)
+        self.max_size = max_size
+        self.on_progress = on_progress
+        self.size = 0  # File bytes sent by the latest attempt
+
+    def __iter__(self) -> Iterator[memoryview]:
+        self.size = 0
+        yield memoryview(self.head)
+        with closing(self.stream()) as blocks:
+            for block in blocks:
+                self.size += len(block)
+                if self.max_size and self.size > self.max_size:
+                    raise ChunkTooLarge(f"{self.filename} passed {self.max_size / (1024 ** 3):.2f} GB while streaming")
+                yield block
+                if self.on_progress:
+                    self.on_progress(min(self.size, self.expected_size - 1), self.expected_size)
+        yield memoryview(self.tail)
+        if self.on_progress:
+            self.on_progress(self.expected_size, self.expected_size)
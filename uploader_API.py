@@ -3,53 +3,27 @@ import sys
 import math
 import time
 import subprocess
-import requests
-import json
 from tqdm import tqdm
-from typing import List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from probe import probe, keyframe_index, get_video_info
+from chunker import plan_cut_points, plan_keyframe_cuts, cut_streaming, cut_one, chunk_path, stream_chunk, virtual_chunks
+from pipeline import run_pipeline, chunk_slots, save_result, accepted_upload, finish_upload
+from progress_store import get_store
+from http_pool import get_session, with_backoff
+from upload_body import MultipartFileBody, MultipartStreamBody, ChunkTooLarge
+from temp_space import TempScope, job_scope, get_temp_space, projected_need
+from resumable_upload import upload_resumable, chunk_key, indexing_status_url
+from indexing_poller import get_poller
+from dedup import source_info, reuse_existing, reuse_chunk
+from metrics import span, observe_stage, record_upload
 from config import (
     API_KEY, INDEX_ID, API_BASE, MAX_CHUNK_DURATION, MAX_CHUNK_SIZE,
-    UPLOAD_WORKERS, INDEXING_WORKERS, PROGRESS_FILE
+    UPLOAD_WORKERS, RESUMABLE_UPLOADS, VIRTUAL_CHUNKS
 )
 
 # Progress tracking
-progress_data = {}
-
-def load_progress():
-    global progress_data
-    if os.path.exists(PROGRESS_FILE):
-        with open(PROGRESS_FILE, 'r') as f:
-            progress_data = json.load(f)
-
-def save_progress():
-    with open(PROGRESS_FILE, 'w') as f:
-        json.dump(progress_data, f)
-
-def get_video_info(path: str) -> Tuple[float, int]:
-    """Get video duration and bitrate"""
-    result = subprocess.run(
-        ["ffprobe", "-v", "error", "-show_entries",
-         "format=duration,bit_rate", "-of", "json", path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-    
-    data = json.loads(result.stdout)
-    duration = float(data['format']['duration'])
-    
-    # Get bitrate, fallback to file size calculation if not available
-    bitrate = data['format'].get('bit_rate')
-    if bitrate:
-        bitrate = int(bitrate)
-    else:
-        # Estimate bitrate from file size
-        file_size = os.path.getsize(path)
-        bitrate = int((file_size * 8) / duration)  # bits per second
-    
-    return duration, bitrate
+progress_store = get_store()
 
 def should_chunk_video(duration: float, bitrate: int, file_size: int) -> Tuple[bool, float]:
     """Determine if video needs chunking"""
@@ -60,72 +34,45 @@ def should_chunk_video(duration: float, bitrate: int, file_size: int) -> Tuple[b
     # If video duration is less than optimal chunk duration, no chunking needed
     return duration > optimal_chunk_duration, optimal_chunk_duration
 
-def chunk_video_smart(path: str) -> Tuple[List[str], bool]:
-    """Split video respecting both duration and size constraints"""
-    total_duration, bitrate = get_video_info(path)
-    original_filename = Path(path).stem
+def plan_video_chunks(path: str) -> Tuple[float, Optional[List[Tuple[float, float]]]]:
+    """Decide whether a video needs chunking and plan its cut points (None if not)"""
+    info = probe(path)
+    total_duration, bitrate = info["duration"], info["bit_rate"]
     file_size = os.path.getsize(path)
     
-    needs_chunking, optimal_chunk_duration = should_chunk_video(total_duration, bitrate, file_size)
-    
-    if not needs_chunking:
+    if total_duration <= MAX_CHUNK_DURATION and file_size <= MAX_CHUNK_SIZE:
         print(f"✅ Video is within limits (duration: {total_duration:.1f}s, size: {file_size/(1024*1024*1024):.2f}GB)")
         print(f"📤 No chunking needed - uploading as single file")
-        return [path], False  # Return original file, no chunking done
+        return total_duration, None
     
-    # If we reach here, we need to chunk the video
     print(f"📊 Video stats: Duration={total_duration:.1f}s, Bitrate={bitrate/1_000_000:.1f} Mbps")
-    print(f"🧮 Optimal chunk duration: {optimal_chunk_duration:.1f}s (based on size/duration limits)")
     
-    chunks = []
-    start = 0.0
+    # Only files that get chunked pay for the keyframe index
+    keyframes = keyframe_index(path)
+    if keyframes:
+        # Cut at keyframes using their byte offsets, so VBR peaks can't push a chunk over the limit
+        cut_points = plan_keyframe_cuts(keyframes, total_duration, file_size, MAX_CHUNK_SIZE, MAX_CHUNK_DURATION)
+        print(f"🧮 Planned {len(cut_points)} chunks at keyframes (based on size/duration limits)")
+        return total_duration, cut_points
     
-    # Calculate chunks based on optimal duration
-    while start < total_duration:
-        length = min(optimal_chunk_duration, total_duration - start)
-        chunks.append((start, length))
-        start += length
-    
-    chunk_paths = []
-    for i, (start, length) in enumerate(chunks):
-        out_path = f"/tmp/{original_filename}_chunk_{i + 1:03d}.mp4"
-        
-        # Create chunk
-        ffmpeg_cmd = [
-            "ffmpeg", "-y",
-            "-ss", str(start),
-            "-t", str(length),
-            "-i", path,
-            "-c", "copy",
-            "-movflags", "faststart",
-            out_path
-        ]
-        
-        print(f"🎬 Creating chunk {i + 1}/{len(chunks)} (Duration: {length:.1f}s)")
-        subprocess.run(ffmpeg_cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
-        # Verify chunk size
-        chunk_size = os.path.getsize(out_path)
-        chunk_size_gb = chunk_size / (1024 * 1024 * 1024)
-        
-        if chunk_size > MAX_CHUNK_SIZE:
-            print(f"⚠️  Chunk {i + 1} exceeds size limit ({chunk_size_gb:.2f} GB)")
-            # In production, you might want to re-split this chunk
-            # For now, we'll warn but continue
-        else:
-            print(f"✅ Chunk {i + 1}: Size={chunk_size_gb:.2f} GB")
-        
-        chunk_paths.append(out_path)
+    # No keyframe index (e.g. audio-only): fall back to the average bitrate
+    _, optimal_chunk_duration = should_chunk_video(total_duration, bitrate, file_size)
+    print(f"🧮 Optimal chunk duration: {optimal_chunk_duration:.1f}s (based on size/duration limits)")
     
-    return chunk_paths, True  # Return paths and indicate chunking was done
+    # Calculate chunks based on optimal duration
+    return total_duration, plan_cut_points(total_duration, optimal_chunk_duration)
 
-def upload_chunk_with_progress(path: str, chunk_index: int, total_chunks: int, original_filename: str, is_single_file: bool = False) -> str:
-    """Upload chunk with progress tracking"""
+def upload_chunk_with_progress(path: str, chunk_index: int, total_chunks: int, original_filename: str, is_single_file: bool = False, journal_key: Optional[str] = None,
+                               virtual: Optional[Dict] = None) -> Tuple[str, Optional[str]]:
+    """Upload chunk with progress tracking; returns its video ID and the digest of the bytes sent (None if unknown)
+
+    virtual is the chunk's record when it has no file and is streamed from ffmpeg instead.
+    """
     # Calculate progress
-    chunk_percent = 80 / total_chunks  # 80% for uploads
+    chunk_percent = 79 / total_chunks  # 79% for uploads; 100 is only reached once indexing has finished
     base_progress = 20 + (chunk_index * chunk_percent)
     
-    file_size = os.path.getsize(path)
+    file_size = virtual["size"] if virtual else os.path.getsize(path)
     file_size_mb = file_size / (1024 * 1024)
     
     # Update progress with appropriate message
@@ -134,47 +81,65 @@ def upload_chunk_with_progress(path: str, chunk_index: int, total_chunks: int, o
     else:
         status_msg = f"Uploading chunk {chunk_index + 1}/{total_chunks} ({file_size_mb:.1f} MB)..."
     
-    progress_data[original_filename] = {
-        "progress": int(base_progress),
-        "status": status_msg
-    }
-    save_progress()
+    progress_store.advance(original_filename, int(base_progress), status_msg)
     
-    headers = {"x-api-key": API_KEY}
-    
-    # Use requests-toolbelt for upload progress if available
-    try:
-        from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
-        
-        def upload_callback(monitor):
-            progress = (monitor.bytes_read / monitor.len) * 100
-            chunk_progress = base_progress + (progress * chunk_percent / 100)
-            progress_data[original_filename] = {
-                "progress": int(chunk_progress),
-                "status": f"Uploading {'video' if is_single_file else f'chunk {chunk_index + 1}/{total_chunks}'}... {int(progress)}%"
-            }
-            save_progress()
-        
-        with open(path, "rb") as f:
-            encoder = MultipartEncoder(
-                fields={
-                    'video_file': (os.path.basename(path), f, 'video/mp4'),
-                    'index_id': INDEX_ID,
-                    'language': 'en'
-                }
+    if RESUMABLE_UPLOADS:
+        def on_progress(done, total):
+            progress = done / total * 100
+            progress_store.advance(
+                original_filename,
+                int(base_progress + (progress * chunk_percent / 100)),
+                f"Uploading {'video' if is_single_file else f'chunk {chunk_index + 1}/{total_chunks}'}... {int(progress)}%"
             )
-            monitor = MultipartEncoderMonitor(encoder, upload_callback)
-            
-            headers['Content-Type'] = monitor.content_type
-            res = requests.post(f"{API_BASE}/tasks", headers=headers, data=monitor)
-            
-    except ImportError:
-        # Fallback without progress monitoring
-        print("ℹ️  Install requests-toolbelt for upload progress: pip install requests-toolbelt")
-        with open(path, "rb") as f:
-            files = {"video_file": f}
-            data = {"index_id": INDEX_ID, "language": "en"}
-            res = requests.post(f"{API_BASE}/tasks", headers=headers, files=files, data=data)
+        
+        digests = []
+        started = time.perf_counter()
+        with span("upload"):
+            video_id = upload_resumable(path, on_progress, journal_key, digests.append)
+        record_upload(file_size, time.perf_counter() - started)
+        status_msg = "Upload complete, processing..." if is_single_file else f"Chunk {chunk_index + 1}/{total_chunks} uploaded, processing..."
+        progress_store.advance(original_filename, int(base_progress + chunk_percent), status_msg)
+        return video_id, (digests or [None])[0]
+    
+    headers = {"x-api-key": API_KEY}
+    url = f"{API_BASE}/tasks"
+    
+    # Per attempt: when the body started and finished going out, to split transfer from task creation
+    timing = {}
+    
+    def upload_callback(sent, total):
+        if sent >= total:
+            timing.setdefault("sent", time.perf_counter())
+        progress = (sent / total) * 100
+        chunk_progress = base_progress + (progress * chunk_percent / 100)
+        progress_store.advance(
+            original_filename,
+            int(chunk_progress),
+            f"Uploading {'video' if is_single_file else f'chunk {chunk_index + 1}/{total_chunks}'}... {int(progress)}%"
+        )
+    
+    def send():
+        # Called once per attempt: the body is streamed from the file again each time
+        timing.clear()
+        timing["started"] = time.perf_counter()
+        fields = {'index_id': INDEX_ID, 'language': 'en'}
+        if virtual:
+            body = MultipartStreamBody(lambda: stream_chunk(virtual["source"], virtual["start"], virtual["duration"]),
+                                       virtual["name"], fields, file_size, MAX_CHUNK_SIZE, on_progress=upload_callback)
+        else:
+            body = MultipartFileBody(path, fields, on_progress=upload_callback)
+        timing["body"] = body
+        return get_session().post(url, headers={**headers, 'Content-Type': body.content_type}, data=body)
+    
+    with span("upload"):
+        res = with_backoff(send, url)
+    received = time.perf_counter()
+    sent = timing.get("sent", received)
+    if virtual:
+        file_size = virtual["size"] = timing["body"].size
+    record_upload(file_size, sent - timing["started"])
+    if "sent" in timing:
+        observe_stage("task_create", received - sent)
 
     if res.status_code not in [200, 201]:
         raise Exception(f"Upload failed: {res.status_code} - {res.text}")
@@ -188,96 +153,126 @@ def upload_chunk_with_progress(path: str, chunk_index: int, total_chunks: int, o
     else:
         status_msg = f"Chunk {chunk_index + 1}/{total_chunks} uploaded, processing..."
     
-    progress_data[original_filename] = {
-        "progress": int(base_progress + chunk_percent),
-        "status": status_msg
-    }
-    save_progress()
+    progress_store.advance(original_filename, int(base_progress + chunk_percent), status_msg)
     
-    return video_id
-
-def wait_for_indexing(video_id: str, chunk_path: str, is_temp_file: bool):
-    headers = {"x-api-key": API_KEY}
-    url = f"{API_BASE}/tasks/{video_id}"
+    return video_id, None if virtual else timing["body"].digest
 
-    while True:
-        res = requests.get(url, headers=headers)
-        if res.status_code != 200:
-            print(f"⚠️  Error checking status for {video_id}: {res.text}")
-            break
+def iter_video_chunks(path: str, temp: TempScope, slots=None) -> Tuple[Iterator[Dict], int, bool]:
+    """Plan a video's chunks and return (chunk generator, planned count, is_chunked) so uploads start while later chunks are cut
 
-        status = res.json().get("status")
-        if status in ["ready", "failed"]:
-            print(f"ℹ️  Indexing done: {video_id} → {status}")
-            break
+    Chunks are cut into a directory registered with the job's temp scope, each
+    once it has one of `slots` (pipeline.chunk_slots).
+    """
+    original_filename = Path(path).stem
+    with span("plan"):
+        total_duration, cut_points = plan_video_chunks(path)
+    
+    if cut_points is None:
+        single = {
+            "index": 1, "path": path, "start": 0.0, "duration": total_duration,
+            "size": os.path.getsize(path), "temp": False
+        }
+        return iter([single]), 1, False
+    
+    keyframes = keyframe_index(path) if VIRTUAL_CHUNKS and not RESUMABLE_UPLOADS else None
+    if keyframes:
+        # Sizes were planned from keyframe byte offsets, so each chunk can go out as it is remuxed, never cut to disk
+        return virtual_chunks(path, cut_points, original_filename, total_duration, keyframes), len(cut_points), True
+    
+    chunks = cut_streaming(path, cut_points, temp.make_dir(), original_filename, MAX_CHUNK_SIZE, slots=slots)
+    return chunks, len(cut_points), True
 
-        time.sleep(5)
+def upload_cut_range(chunk: Dict, chunk_index: int, total_chunks: int, original_filename: str, source_path: str) -> Tuple[str, Optional[str]]:
+    """Upload a virtual chunk that couldn't be streamed by cutting its range to a temp file first
 
-    # Only remove temp files (chunks), not the original file
-    if is_temp_file and os.path.exists(chunk_path):
-        os.remove(chunk_path)
-        print(f"🧹 Cleaned up: {chunk_path}")
+    The file gets a temp scope of its own, deleted once the upload is accepted
+    or has failed. It is not waited for: the job's own scope is open and
+    would keep the wait going, so without the space the chunk fails with
+    InsufficientSpace.
+    """
+    with get_temp_space().scope(original_filename, projected_need(MAX_CHUNK_SIZE)) as scope:
+        out_path = chunk_path(scope.make_dir(), Path(source_path).stem, chunk["index"])
+        cut_one(source_path, chunk["start"], chunk["duration"], out_path)
+        size = os.path.getsize(out_path)
+        if size > MAX_CHUNK_SIZE:
+            raise ChunkTooLarge(f"{os.path.basename(out_path)} is {size / (1024 ** 3):.2f} GB even when cut to disk")
+        chunk["size"] = size
+        return upload_chunk_with_progress(out_path, chunk_index, total_chunks, original_filename)
 
-def upload_all_sequential(paths: List[str], original_filename: str, is_chunked: bool):
-    """Upload chunks sequentially with progress tracking"""
-    video_ids = []
-    
-    with ThreadPoolExecutor(max_workers=INDEXING_WORKERS) as index_exec:
-        for i, path in enumerate(paths):
+def upload_all_pipelined(chunks: Iterable[Dict], total_chunks: int, original_filename: str, is_chunked: bool, source_path: str,
+                         source: Dict, slots=None, scope: Optional[TempScope] = None) -> Dict:
+    """Upload chunks as they come off the splitter, with progress tracking; returns the pipeline.accepted_upload"""
+    poller = get_poller()
+    
+    def upload(chunk):
+        i = chunk["position"]
+        total = max(total_chunks, i + 1)
+        is_single_file = not is_chunked
+        
+        reused = reuse_chunk(chunk, source)
+        if reused:
+            print(f"♻️  Chunk {i + 1} is already indexed as {reused}, skipping upload")
+            chunk["indexing"] = "ready"
+            poller.track(reused, status="ready")
+            return reused
+        
+        if is_single_file:
+            print(f"⬆️  Uploading video...")
+        else:
+            print(f"⬆️  Uploading chunk {i + 1}/{total}...")
+        
+        try:
             try:
-                is_single_file = len(paths) == 1 and not is_chunked
-                
-                if is_single_file:
-                    print(f"⬆️  Uploading video...")
-                else:
-                    print(f"⬆️  Uploading chunk {i + 1}/{len(paths)}...")
-                    
-                video_id = upload_chunk_with_progress(path, i, len(paths), original_filename, is_single_file)
-                print(f"✅ Upload accepted: {video_id}")
-                print(f"video_id={video_id}")
-                
-                video_ids.append(video_id)
-                index_exec.submit(wait_for_indexing, video_id, path, is_chunked)
-                
-                # Small delay between chunks
-                if i < len(paths) - 1:
-                    time.sleep(2)
-                    
-            except Exception as e:
-                print(f"❌ Upload failed for {path}: {e}")
-                if os.path.exists(path) and is_chunked:
-                    os.remove(path)
-    
-    # Update final status
-    if len(video_ids) == len(paths):
-        progress_data[original_filename] = {"progress": 100, "status": "Upload & Indexing successful"}
-    else:
-        progress_data[original_filename] = {
-            "progress": 100,
-            "status": f"Partial success: {len(video_ids)}/{len(paths)} {'chunks' if is_chunked else 'file'} uploaded"
-        }
-    save_progress()
-    
-    # Print all video IDs for the server to capture
-    for vid in video_ids:
-        print(f"video_id={vid}")
+                video_id, chunk["hash"] = upload_chunk_with_progress(chunk["path"], i, total, original_filename, is_single_file,
+                                                                     chunk_key(source_path, chunk), chunk if chunk.get("virtual") else None)
+            except (ChunkTooLarge, subprocess.CalledProcessError) as e:
+                # Not worth a retry: the remux came out over the limit or ffmpeg failed writing to the pipe
+                if not chunk.get("virtual"):
+                    raise
+                print(f"⚠️  Streaming chunk {i + 1} failed ({e}), cutting it to a temp file instead")
+                video_id, chunk["hash"] = upload_cut_range(chunk, i, total, original_filename, source_path)
+        except Exception as e:
+            print(f"❌ Upload failed for {chunk['path']}: {e}")
+            raise
+        
+        print(f"✅ Upload accepted: {video_id}")
+        print(f"video_id={video_id}")
+        chunk["status_url"] = indexing_status_url(video_id) if RESUMABLE_UPLOADS else None
+        poller.track(video_id, chunk["duration"], chunk["status_url"])
+        return video_id
+    
+    # Temp chunks are deleted by the pipeline as soon as their upload is accepted
+    results = run_pipeline(chunks, upload, workers=UPLOAD_WORKERS, slots=slots, scope=scope)
+    return accepted_upload(original_filename, source, results, is_chunked)
 
-def main(input_path: str):
+def upload_video(input_path: str, original_filename: Optional[str] = None, content_hash: Optional[str] = None,
+                 temp: Optional[TempScope] = None) -> Dict:
+    """Chunk and upload one video without waiting for indexing; returns a pipeline.accepted_upload
+    (or {"filename", "result"} for content that is already indexed) for pipeline.finish_upload
+
+    content_hash is the file's full hash if already known (e.g. from ingest).
+    temp is the job's temp scope if the caller has one; otherwise the chunks
+    get a scope of their own that is closed once they are all uploaded.
+    """
     if not os.path.isfile(input_path):
-        print(f"❌ File not found: {input_path}")
-        sys.exit(1)
+        raise FileNotFoundError(input_path)
 
-    original_filename = os.path.basename(input_path)
+    original_filename = original_filename or os.path.basename(input_path)
     
-    # Load existing progress
-    load_progress()
     
     # Initialize progress
-    progress_data[original_filename] = {"progress": 0, "status": "Starting..."}
-    save_progress()
+    progress_store.set(original_filename, 0, "Starting...")
     
     print(f"📁 Processing: {input_path}")
     
+    # Same content already indexed: nothing to probe, cut or upload
+    source = source_info(input_path, content_hash)
+    existing = reuse_existing(original_filename, input_path, source)
+    if existing:
+        save_result(existing, source["hash"])
+        progress_store.set(original_filename, 100, existing["status"])
+        return {"filename": original_filename, "result": existing}
+    
     # Get video info
     duration, bitrate = get_video_info(input_path)
     file_size_gb = os.path.getsize(input_path) / (1024 * 1024 * 1024)
@@ -290,26 +285,45 @@ def main(input_path: str):
     print(f"⏱️  Duration: {h:02d}:{m:02d}:{s:02d}")
     print(f"💾 File size: {file_size_gb:.2f} GB")
     
-    progress_data[original_filename] = {"progress": 5, "status": "Analyzing video..."}
-    save_progress()
+    progress_store.set(original_filename, 5, "Analyzing video...")
     
-    print("\n🔍 Checking if video needs splitting...")
-    chunks, is_chunked = chunk_video_smart(input_path)
+    with job_scope(temp, original_filename) as scope:
+        print("\n🔍 Checking if video needs splitting...")
+        slots = chunk_slots(workers=UPLOAD_WORKERS)
+        chunks, total_chunks, is_chunked = iter_video_chunks(input_path, scope, slots)
     
-    # Update progress message based on chunking
-    if is_chunked:
-        progress_data[original_filename] = {"progress": 20, "status": f"Created {len(chunks)} chunks, starting upload..."}
-    else:
-        progress_data[original_filename] = {"progress": 20, "status": "Starting upload (no chunking needed)..."}
-    save_progress()
+        # Update progress message based on chunking
+        if is_chunked:
+            progress_store.set(original_filename, 20, f"Cutting {total_chunks} chunks, uploading as they are ready...")
+        else:
+            progress_store.set(original_filename, 20, "Starting upload (no chunking needed)...")
+    
+        print(f"\n📦 Files to upload: {total_chunks}")
+        upload = upload_all_pipelined(chunks, total_chunks, original_filename, is_chunked, input_path, source, slots, scope)
+        print("🎉 Uploads and indexing triggered.")
+        return upload
+
+def process_video(input_path: str, original_filename: Optional[str] = None, content_hash: Optional[str] = None,
+                  temp: Optional[TempScope] = None) -> Dict:
+    """Chunk and upload one video and wait for its indexing, returning its video IDs and per-chunk results (see upload_video)"""
+    return finish_upload(upload_video(input_path, original_filename, content_hash, temp))
+
+def main(input_path: str):
+    if not os.path.isfile(input_path):
+        print(f"❌ File not found: {input_path}")
+        sys.exit(1)
     
-    print(f"\n📦 Files to upload: {len(chunks)}")
-    upload_all_sequential(chunks, original_filename, is_chunked)
-    print("🎉 Uploads and indexing triggered.")
+    process_video(input_path)
 
 if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--batch":
+        from async_uploader import run_batch
+        run_batch(sys.argv[2])
+        sys.exit(0)
+
     if len(sys.argv) != 2:
         print("Usage: python uploader_API.py /path/to/video.mp4")
+        print("       python uploader_API.py --batch /path/to/dir/")
         sys.exit(1)
 
     main(sys.argv[1])
\ No newline at end of file
@@ -1,56 +1,27 @@
 import os
-import subprocess
-import tempfile
-import shutil
-import json
 import time
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from twelvelabs import TwelveLabs
-from twelvelabs.models.task import Task
+from probe import probe, keyframe_index, get_video_info
+from chunker import plan_cut_points, plan_keyframe_cuts, cut_streaming
+from pipeline import run_pipeline, chunk_slots, save_result, accepted_upload, finish_upload
+from progress_store import get_store
+from http_pool import host_slot, backoff_delay
+from resumable_upload import upload_resumable, chunk_key, indexing_status_url
+from indexing_poller import get_poller
+from dedup import source_info, reuse_existing, reuse_chunk
+from metrics import span, record_upload
+from upload_body import HashingFile
+from temp_space import job_scope
 from config import (
-    API_KEY, INDEX_ID, MAX_CHUNK_DURATION, MAX_CHUNK_SIZE,
-    UPLOAD_WORKERS, INDEXING_WORKERS, PROGRESS_FILE
+    API_KEY, INDEX_ID, API_BASE, MAX_CHUNK_DURATION, MAX_CHUNK_SIZE,
+    UPLOAD_WORKERS, RESUMABLE_UPLOADS
 )
 
 client = TwelveLabs(api_key=API_KEY)
 
 # Progress tracking
-progress_data = {}
-
-def load_progress():
-    global progress_data
-    if os.path.exists(PROGRESS_FILE):
-        with open(PROGRESS_FILE, 'r') as f:
-            progress_data = json.load(f)
-
-def save_progress():
-    with open(PROGRESS_FILE, 'w') as f:
-        json.dump(progress_data, f)
-
-def get_video_info(filepath):
-    """Get video duration and bitrate"""
-    result = subprocess.run([
-        "ffprobe", "-v", "error",
-        "-show_entries", "format=duration,bit_rate",
-        "-of", "json",
-        filepath
-    ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-    
-    import json
-    data = json.loads(result.stdout)
-    duration = float(data['format']['duration'])
-    
-    # Get bitrate, fallback to file size calculation if not available
-    bitrate = data['format'].get('bit_rate')
-    if bitrate:
-        bitrate = int(bitrate)
-    else:
-        # Estimate bitrate from file size
-        file_size = os.path.getsize(filepath)
-        bitrate = int((file_size * 8) / duration)  # bits per second
-    
-    return duration, bitrate
+progress_store = get_store()
 
 def should_chunk_video(duration, bitrate, file_size):
     """Determine if video needs chunking"""
@@ -61,92 +32,59 @@ def should_chunk_video(duration, bitrate, file_size):
     # If video duration is less than optimal chunk duration, no chunking needed
     return duration > optimal_chunk_duration, optimal_chunk_duration
 
-def split_video_smart(input_path):
-    """Split video respecting both duration and size constraints"""
-    total_duration, bitrate = get_video_info(input_path)
-    original_filename = Path(input_path).stem
+def plan_video_chunks(input_path):
+    """Decide whether a video needs chunking and plan its cut points (None if not)"""
+    info = probe(input_path)
+    total_duration, bitrate = info["duration"], info["bit_rate"]
     file_size = os.path.getsize(input_path)
     
-    needs_chunking, optimal_chunk_duration = should_chunk_video(total_duration, bitrate, file_size)
-    
-    if not needs_chunking:
+    if total_duration <= MAX_CHUNK_DURATION and file_size <= MAX_CHUNK_SIZE:
         print(f"✅ Video is within limits (duration: {total_duration:.1f}s, size: {file_size/(1024*1024*1024):.2f}GB)")
         print(f"📤 No chunking needed - uploading as single file")
-        return [input_path], None  # Return original file, no temp directory
-    
-    # If we reach here, we need to chunk the video
-    output_dir = tempfile.mkdtemp(prefix="tl_chunks_")
-    chunk_paths = []
+        return total_duration, None
     
     print(f"📊 Video stats: Duration={total_duration:.1f}s, Bitrate={bitrate/1_000_000:.1f} Mbps")
-    print(f"🧮 Optimal chunk duration: {optimal_chunk_duration:.1f}s (based on size/duration limits)")
     
-    start = 0
-    index = 1
+    # Only files that get chunked pay for the keyframe index
+    keyframes = keyframe_index(input_path)
+    if keyframes:
+        # Cut at keyframes using their byte offsets, so VBR peaks can't push a chunk over the limit
+        cut_points = plan_keyframe_cuts(keyframes, total_duration, file_size, MAX_CHUNK_SIZE, MAX_CHUNK_DURATION)
+        print(f"🧮 Planned {len(cut_points)} chunks at keyframes (based on size/duration limits)")
+        return total_duration, cut_points
     
-    while start < total_duration:
-        chunk_duration = min(optimal_chunk_duration, total_duration - start)
-        output_path = os.path.join(output_dir, f"{original_filename}_chunk_{index:03d}.mp4")
-        
-        # Create chunk
-        subprocess.run([
-            "ffmpeg", "-y", "-i", input_path,
-            "-ss", str(start), "-t", str(chunk_duration),
-            "-c", "copy", "-movflags", "faststart",
-            output_path
-        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
-        # Verify chunk size
-        chunk_size = os.path.getsize(output_path)
-        chunk_size_gb = chunk_size / (1024 * 1024 * 1024)
-        
-        if chunk_size > MAX_CHUNK_SIZE:
-            print(f"⚠️  Chunk {index} exceeds size limit ({chunk_size_gb:.2f} GB), re-splitting...")
-            os.remove(output_path)
-            
-            # Reduce chunk duration by 20% and retry
-            optimal_chunk_duration *= 0.8
-            continue
-        
-        print(f"✅ Created chunk {index}: Duration={chunk_duration:.1f}s, Size={chunk_size_gb:.2f} GB")
-        chunk_paths.append(output_path)
-        start += chunk_duration
-        index += 1
+    # No keyframe index (e.g. audio-only): fall back to the average bitrate
+    _, optimal_chunk_duration = should_chunk_video(total_duration, bitrate, file_size)
+    print(f"🧮 Optimal chunk duration: {optimal_chunk_duration:.1f}s (based on size/duration limits)")
     
-    return chunk_paths, output_dir
+    return total_duration, plan_cut_points(total_duration, optimal_chunk_duration)
 
-def wait_for_indexing(task_id: str, chunk_path: str):
-    """Monitor indexing status in background"""
-    print(f"👁️  Monitoring indexing for {task_id}")
+def iter_video_chunks(input_path, temp, slots=None):
+    """Plan a video's chunks and return (chunk generator, planned count, temp dir) so uploads start while later chunks are cut
+
+    The temp dir is registered with the job's temp scope, which deletes it.
+    Each chunk is cut once it has one of `slots` (pipeline.chunk_slots).
+    """
+    original_filename = Path(input_path).stem
+    with span("plan"):
+        total_duration, cut_points = plan_video_chunks(input_path)
     
-    max_checks = 60  # Check for up to 5 minutes
-    for i in range(max_checks):
-        try:
-            task = client.task.retrieve(task_id)
-            status = task.status if hasattr(task, 'status') else 'unknown'
-            
-            if status in ['ready', 'completed']:
-                print(f"✅ Indexing complete: {task_id}")
-                break
-            elif status == 'failed':
-                print(f"❌ Indexing failed: {task_id}")
-                break
-            
-            time.sleep(5)  # Check every 5 seconds
-        except Exception as e:
-            print(f"⚠️  Error checking status for {task_id}: {e}")
-            break
+    if cut_points is None:
+        single = {
+            "index": 1, "path": input_path, "start": 0.0, "duration": total_duration,
+            "size": os.path.getsize(input_path), "temp": False
+        }
+        return iter([single]), 1, None
     
-    # Clean up the chunk file after indexing ONLY if it's a temp file
-    if chunk_path and 'tl_chunks_' in chunk_path and os.path.exists(chunk_path):
-        os.remove(chunk_path)
-        print(f"🧹 Cleaned up: {chunk_path}")
+    output_dir = temp.make_dir()
+    chunks = cut_streaming(input_path, cut_points, output_dir, original_filename, MAX_CHUNK_SIZE, slots=slots)
+    return chunks, len(cut_points), output_dir
 
-def upload_file_with_progress(path, chunk_index, total_chunks, original_filename, index_executor, is_single_file=False, max_retries=3):
+def upload_file_with_progress(path, chunk_index, total_chunks, original_filename, is_single_file=False, max_retries=3, journal_key=None):
     print(f"⬆️ Uploading: {path}")
     
     # Calculate base progress for this chunk
-    chunk_size_percent = 80 / total_chunks  # 80% for uploads, 20% for other operations
+    chunk_size_percent = 79 / total_chunks  # 79% for uploads, 20% for analysis; 100 only once indexing has finished
     base_progress = 20 + (chunk_index * chunk_size_percent)  # Start at 20% after analysis
     
     # Get file size for progress tracking
@@ -163,16 +101,24 @@ def upload_file_with_progress(path, chunk_index, total_chunks, original_filename
                 status_msg = f"Uploading chunk {chunk_index + 1}/{total_chunks} ({file_size_mb:.1f} MB)..."
                 print(f"📤 Starting upload of chunk {chunk_index + 1}/{total_chunks}")
             
-            progress_data[original_filename] = {
-                "progress": int(base_progress),
-                "status": status_msg
-            }
-            save_progress()
-            
-            # Upload the file
-            task = client.task.create(index_id=INDEX_ID, file=path)
+            progress_store.advance(original_filename, int(base_progress), status_msg)
             
-            task_id = task.id if hasattr(task, 'id') else task._id
+            started = time.perf_counter()
+            if RESUMABLE_UPLOADS:
+                # Each retry resumes from the last acknowledged part instead of byte zero
+                digests = []
+                with span("upload"):
+                    task = task_id = upload_resumable(path, journal_key=journal_key, on_digest=digests.append)
+                digest = (digests or [None])[0]
+            else:
+                # Upload the file (the SDK owns the HTTP call; we still share the per-host cap).
+                # The file is hashed as the SDK reads it, for dedup
+                with host_slot(API_BASE), span("upload"), HashingFile(path) as f:
+                    task = client.task.create(index_id=INDEX_ID, file=f)
+                    digest = f.digest
+                
+                task_id = task.id if hasattr(task, 'id') else task._id
+            record_upload(file_size, time.perf_counter() - started)
             print(f"video_id={task_id}")
             
             # Update progress after successful upload
@@ -182,51 +128,47 @@ def upload_file_with_progress(path, chunk_index, total_chunks, original_filename
             else:
                 status_msg = f"Chunk {chunk_index + 1}/{total_chunks} uploaded, processing..."
             
-            progress_data[original_filename] = {
-                "progress": int(progress_after),
-                "status": status_msg
-            }
-            save_progress()
-            
-            # Submit indexing monitoring to background thread pool
-            index_executor.submit(wait_for_indexing, task_id, path)
+            progress_store.advance(original_filename, int(progress_after), status_msg)
             
-            return path, task
+            return path, task_id, digest
             
         except Exception as e:
             if attempt < max_retries - 1:
-                wait_time = (attempt + 1) * 5
-                print(f"⚠️  Upload failed for {path}: {e}. Retrying in {wait_time}s...")
+                wait_time = backoff_delay(attempt)
+                print(f"⚠️  Upload failed for {path}: {e}. Retrying in {wait_time:.1f}s...")
                 
-                progress_data[original_filename] = {
-                    "progress": int(base_progress),
-                    "status": f"Retry {attempt + 1}/{max_retries} for {'video' if is_single_file else f'chunk {chunk_index + 1}'}..."
-                }
-                save_progress()
+                progress_store.advance(
+                    original_filename, int(base_progress),
+                    f"Retry {attempt + 1}/{max_retries} for {'video' if is_single_file else f'chunk {chunk_index + 1}'}..."
+                )
                 
-                import time
                 time.sleep(wait_time)
             else:
                 print(f"🔥 Upload error for {path} after {max_retries} attempts: {e}")
-                return path, None
+                return path, None, None
     
-    return path, None
+    return path, None, None
 
-def main():
-    import sys
-    if len(sys.argv) < 2:
-        print("Usage: python uploader_sdk.py <video_path>")
-        return
+def upload_video(video_path, original_filename=None, content_hash=None, temp=None):
+    """Chunk and upload one video without waiting for indexing; returns a pipeline.accepted_upload
+    (or {"filename", "result"} for content that is already indexed) for pipeline.finish_upload
 
-    video_path = sys.argv[1]
-    original_filename = os.path.basename(video_path)
+    temp is the job's temp scope if the caller has one; otherwise the chunks
+    get a scope of their own that is closed once they are all uploaded.
+    """
+    original_filename = original_filename or os.path.basename(video_path)
     
-    # Load existing progress
-    load_progress()
     
     # Initialize progress for this file
-    progress_data[original_filename] = {"progress": 0, "status": "Starting..."}
-    save_progress()
+    progress_store.set(original_filename, 0, "Starting...")
+    
+    # Same content already indexed: nothing to probe, cut or upload
+    source = source_info(video_path, content_hash)
+    existing = reuse_existing(original_filename, video_path, source)
+    if existing:
+        save_result(existing, source["hash"])
+        progress_store.set(original_filename, 100, existing["status"])
+        return {"filename": original_filename, "result": existing}
     
     duration, bitrate = get_video_info(video_path)
     h = int(duration // 3600)
@@ -240,57 +182,59 @@ def main():
     print(f"💾 File size: {file_size_gb:.2f} GB")
     print(f"📊 Bitrate: {bitrate/1_000_000:.1f} Mbps")
     
-    progress_data[original_filename] = {"progress": 5, "status": "Analyzing video..."}
-    save_progress()
-    
-    print("\n🔍 Checking if video needs splitting...")
-    chunks, temp_dir = split_video_smart(video_path)
-    
-    # Update progress message based on chunking
-    if len(chunks) == 1 and not temp_dir:
-        progress_data[original_filename] = {"progress": 20, "status": "Starting upload (no chunking needed)..."}
-    else:
-        progress_data[original_filename] = {"progress": 20, "status": f"Created {len(chunks)} chunks, starting upload..."}
-    save_progress()
-    
-    print(f"\n📦 Files to upload: {len(chunks)}")
-    print(f"🚀 Starting upload...")
-    
-    # Create thread pool for indexing monitoring
-    with ThreadPoolExecutor(max_workers=INDEXING_WORKERS) as index_executor:
-        # Sequential upload with progress tracking
-        successful_uploads = []
-        for i, chunk in enumerate(chunks):
-            if i > 0:
-                import time
-                time.sleep(2)  # 2 second delay between chunks
-            
-            # Determine if this is a single file upload
-            is_single_file = len(chunks) == 1 and not temp_dir
-            path, task = upload_file_with_progress(chunk, i, len(chunks), original_filename, index_executor, is_single_file)
-            
-            if task:
-                successful_uploads.append(task)
-    
-    # Final status
-    if len(successful_uploads) == len(chunks):
-        progress_data[original_filename] = {"progress": 100, "status": "Upload & Indexing successful"}
-    else:
-        progress_data[original_filename] = {
-            "progress": 100, 
-            "status": f"Partial success: {len(successful_uploads)}/{len(chunks)} chunks uploaded"
-        }
-    save_progress()
+    progress_store.set(original_filename, 5, "Analyzing video...")
+    
+    with job_scope(temp, original_filename) as scope:
+        print("\n🔍 Checking if video needs splitting...")
+        slots = chunk_slots(workers=UPLOAD_WORKERS)
+        chunks, total_chunks, temp_dir = iter_video_chunks(video_path, scope, slots)
+        is_single_file = temp_dir is None
+    
+        # Update progress message based on chunking
+        if is_single_file:
+            progress_store.set(original_filename, 20, "Starting upload (no chunking needed)...")
+        else:
+            progress_store.set(original_filename, 20, f"Cutting {total_chunks} chunks, uploading as they are ready...")
+    
+        print(f"\n📦 Files to upload: {total_chunks}")
+        print(f"🚀 Starting upload...")
+    
+        poller = get_poller()
+    
+        def upload(chunk):
+            i = chunk["position"]
+            reused = reuse_chunk(chunk, source)
+            if reused:
+                print(f"♻️  Chunk {i + 1} is already indexed as {reused}, skipping upload")
+                chunk["indexing"] = "ready"
+                poller.track(reused, status="ready")
+                return reused
+            path, task_id, chunk["hash"] = upload_file_with_progress(chunk["path"], i, max(total_chunks, i + 1), original_filename,
+                                                                     is_single_file, journal_key=chunk_key(video_path, chunk))
+            if task_id:
+                # Multipart uploads are indexed as assets, which have their own status URL
+                chunk["status_url"] = indexing_status_url(task_id) if RESUMABLE_UPLOADS else None
+                poller.track(task_id, chunk["duration"], chunk["status_url"])
+            return task_id
+    
+        # Chunks are uploaded as soon as they are cut and deleted once accepted
+        results = run_pipeline(chunks, upload, workers=UPLOAD_WORKERS, slots=slots, scope=scope)
+    successful_uploads = [r["result"] for r in results if r["result"]]
+    print(f"\n🧹 Uploaded {len(successful_uploads)}/{len(results)} {'chunks' if temp_dir else 'file'}, indexing triggered.")
+    
+    return accepted_upload(original_filename, source, results, not is_single_file)
 
-    print(f"\n🧹 All done. Uploaded {len(successful_uploads)}/{len(chunks)} {'chunks' if temp_dir else 'file'}.")
-    
-    # Clean up temp directory if it exists
-    if temp_dir and os.path.exists(temp_dir):
-        try:
-            shutil.rmtree(temp_dir)
-            print("🧹 Cleaned up temporary files.")
-        except:
-            pass  # Directory might not be empty if indexing is still running
+def process_video(video_path, original_filename=None, content_hash=None, temp=None):
+    """Chunk and upload one video and wait for its indexing, returning its video IDs and per-chunk results (see upload_video)"""
+    return finish_upload(upload_video(video_path, original_filename, content_hash, temp))
+
+def main():
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python uploader_sdk.py <video_path>")
+        return
+
+    process_video(sys.argv[1])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file